@@ -0,0 +1,91 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+import pdf_direct
+from conversion import CONVERTISSEUR_DEFAUT, chemin_pdf
+from modeles import ModeleJinja, charger_modele, empreinte_fichier
+
+# Aperçu du premier courrier d'un fichier, produit avant la génération complète et gardé en cache sur disque
+# par fichier téléversé et templates : une relance de l'interface ne relit ni ne reconvertit rien.
+# ouvrir_lecteur() renvoie le lecteur du fichier Excel ; il n'est appelé que si l'aperçu n'est pas déjà en cache.
+# choisir_template(donnees) donne le template de la première ligne, comme pour la génération (voir registre.py)
+
+# Clé de cache : contenu du fichier Excel, contenu des templates utilisables et nom du fichier (qui peut choisir le template)
+def cle_apercu(octets_excel, fichiers_templates, nom_fichier=""):
+    empreinte = hashlib.sha256(octets_excel)
+    for chemin in sorted(fichiers_templates):
+        empreinte.update(f"\0{os.path.basename(chemin)}:{empreinte_fichier(chemin)}".encode())
+    empreinte.update(f"\0{os.path.basename(nom_fichier)}".encode())
+    return empreinte.hexdigest()[:32]
+
+# Première ligne du fichier (le lecteur est refermé sans lire la suite)
+def _premiere_ligne(ouvrir_lecteur):
+    lecteur = ouvrir_lecteur()
+    lignes = iter(lecteur)
+    try:
+        return next(lignes, None)
+    finally:
+        lignes.close()
+        lecteur.fermer()
+
+# Écrire le fichier de cache sous un nom provisoire puis le renommer : un lecteur ne voit jamais un aperçu partiel
+def _publier(contenu, chemin):
+    chemin_temporaire = f"{chemin}.{os.getpid()}.tmp"
+    with open(chemin_temporaire, "wb") as f:
+        f.write(contenu)
+    os.replace(chemin_temporaire, chemin)
+    return chemin
+
+# Aperçu PDF de la première ligne : moteur PDF direct si demandé (et si le template s'y prête), sinon Word + LibreOffice
+# Retourne le chemin du PDF en cache, ou None si le fichier ne contient aucune ligne
+def apercu_pdf(cle, ouvrir_lecteur, choisir_template, dossier_apercus, convertisseur=CONVERTISSEUR_DEFAUT, moteur_pdf_direct=False):
+    chemin = os.path.join(dossier_apercus, f"{cle}.pdf")
+    if os.path.exists(chemin):
+        return chemin
+    donnees = _premiere_ligne(ouvrir_lecteur)
+    if donnees is None:
+        return None
+    fichier_template = choisir_template(donnees)
+    os.makedirs(dossier_apercus, exist_ok=True)
+    dossier_travail = tempfile.mkdtemp(prefix="apercu_")
+    try:
+        fichier_pdf = None
+        if moteur_pdf_direct:
+            try:
+                pdf_direct.preparer_fond(fichier_template, convertisseur)
+                fichier_pdf = os.path.join(dossier_travail, "apercu.pdf")
+                pdf_direct.rendre_pdf_direct(fichier_template, donnees, fichier_pdf)
+            except (ValueError, pdf_direct.HorsGabarit):
+                fichier_pdf = None
+        if fichier_pdf is None:
+            fichier_docx = os.path.join(dossier_travail, "apercu.docx")
+            charger_modele(fichier_template).enregistrer(donnees, fichier_docx)
+            erreurs = convertisseur([fichier_docx], dossier_travail)
+            if erreurs:
+                raise RuntimeError(erreurs[fichier_docx])
+            fichier_pdf = chemin_pdf(fichier_docx, dossier_travail)
+        with open(fichier_pdf, "rb") as f:
+            return _publier(f.read(), chemin)
+    finally:
+        shutil.rmtree(dossier_travail, ignore_errors=True)
+
+# Aperçu texte de la première ligne (paragraphes du document rendu en mémoire, sans fichier intermédiaire)
+def apercu_texte(cle, ouvrir_lecteur, choisir_template, dossier_apercus, classe_modele=ModeleJinja):
+    chemin = os.path.join(dossier_apercus, f"{cle}.txt")
+    if os.path.exists(chemin):
+        with open(chemin, encoding="utf-8") as f:
+            return f.read()
+    donnees = _premiere_ligne(ouvrir_lecteur)
+    if donnees is None:
+        return None
+    fichier_template = choisir_template(donnees)
+    from docx import Document
+    document = io.BytesIO()
+    charger_modele(fichier_template, classe_modele).enregistrer(donnees, document)
+    texte = "\n\n".join(paragraphe.text for paragraphe in Document(document).paragraphs)
+    os.makedirs(dossier_apercus, exist_ok=True)
+    _publier(texte.encode("utf-8"), chemin)
+    return texte
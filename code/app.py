@@ -1,15 +1,19 @@
 import streamlit as st
-import pandas as pd
-from docxtpl import DocxTemplate
 from datetime import datetime
 import os
-import shutil
-from io import BytesIO
-from PyPDF2 import PdfReader
+import uuid
 import platform
-import zipfile
 import base64
-import subprocess
+from apercu import apercu_pdf, cle_apercu
+import generateur
+from archivage import ArchiveZip, espace_travail
+from fusion import TAILLE_VOLUME_DEFAUT, DocumentFusionne
+from generateur import CHAMPS_ACCUSE, CHAMPS_ALLOCATAIRE, GenerateurLot
+from moteur import NB_WORKERS_DEFAUT
+from registre import CHAMP_TYPE_COURRIER
+from resultats import CacheResultats, cle_resultat
+import pdf_direct
+import telechargements
 
 SYSTEME = platform.system()
 preview_pdf_active = SYSTEME in ["Windows", "Linux", "Darwin"]
@@ -20,181 +24,190 @@ definir_chemin = lambda *chemins: os.path.join(DOSSIER_BASE, *chemins)
 
 # Créer les répertoires requis
 def verifier_et_creer_repertoires():
-    for dossier in ["template", "accuse_recep", "archive"]:
+    for dossier in ["template", "accuse_recep", "archive", "static"]:
         os.makedirs(definir_chemin(dossier), exist_ok=True)
 
-# Déplacer le fichier Excel dans le dossier archive
-def deplacer_fichier(temp_path, nom_original):
-    archive_path = definir_chemin("archive", nom_original)
-    if os.path.exists(archive_path):
-        base, ext = os.path.splitext(archive_path)
-        i = 1
-        while os.path.exists(f"{base}_{i}{ext}"):
-            i += 1
-        archive_path = f"{base}_{i}{ext}"
-    shutil.move(temp_path, archive_path)
-
-# Extraire les données depuis le fichier Excel
-def extraire_donnees(fichier_excel, champs_attendus):
+# Colonnes du template de l'application : destinataire bailleur et allocataire
+CHAMPS_APPLICATION = CHAMPS_ACCUSE + CHAMPS_ALLOCATAIRE
+
+# Résultats partagés par toutes les sessions du serveur (voir resultats.py)
+cache_resultats = CacheResultats(definir_chemin("accuse_recep"))
+
+# Extraire les données depuis le fichier Excel (en-tête vérifié tout de suite, lignes lues en flux pendant la génération)
+def extraire_donnees(fichier_excel, champs_attendus=CHAMPS_APPLICATION):
     try:
-        df = pd.read_excel(fichier_excel)
-        df.columns = [col.strip().replace(' ', '_') for col in df.columns]
-        champs_manquants = [champ for champ in champs_attendus if champ not in df.columns]
-        if champs_manquants:
-            st.error(f"Champs manquants : {', '.join(champs_manquants)}")
-            return None
-        return df[champs_attendus].to_dict(orient="records")
+        return generateur.extraire_donnees(fichier_excel, champs_attendus, champs_facultatifs=[CHAMP_TYPE_COURRIER])
+    except ValueError as e:
+        st.error(str(e))
+        return None
     except Exception as e:
         st.error(f"Erreur de lecture : {e}")
         return None
 
-# Conversion avec LibreOffice
-def convert_with_libreoffice(docx_path, pdf_path):
-    try:
-        sortie_dir = os.path.dirname(pdf_path)
-
-        # Tentative automatique de détection
-        soffice_path = shutil.which("soffice")
-        if not soffice_path:
-            soffice_path = r"C:\Program Files (x86)\LibreOffice 4\program\soffice.exe"  # Modifie ce chemin si besoin
-
-        if not os.path.exists(soffice_path):
-            raise FileNotFoundError("LibreOffice (soffice) introuvable. Vérifie son installation ou ajoute le chemin dans le PATH.")
-
-        subprocess.run([
-            soffice_path,
-            "--headless",
-            "--convert-to", "pdf",
-            "--outdir", sortie_dir,
-            docx_path
-        ], check=True)
-
-        if os.path.exists(docx_path):
-            os.remove(docx_path)
-
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"Le fichier PDF attendu n'a pas été généré : {pdf_path}")
-
-    except Exception as e:
-        st.error(f"Erreur de conversion PDF avec LibreOffice : {e}")
-
-# Remplir les templates Word et convertir en PDF
-def remplir_et_convertir(fichier_template, dossier_sortie, donnees_liste, horodatage, progress_bar=None, compteur_txt=None):
-    os.makedirs(dossier_sortie, exist_ok=True)
-    premier_pdf = None
-    total = len(donnees_liste)
-
-    for i, donnees in enumerate(donnees_liste):
-        tpl = DocxTemplate(fichier_template)
-        for cle, valeur in donnees.items():
-            if pd.isna(valeur):
-                donnees[cle] = ""
-            elif isinstance(valeur, (datetime, pd.Timestamp)):
-                donnees[cle] = valeur.strftime("%d/%m/%Y")
-            else:
-                donnees[cle] = str(valeur)
-
-        tpl.render(donnees)
-        matricule = str(donnees.get("Matricule", f"{i+1}")).strip()
-        nom_base = f"accuseReception_{matricule}_{horodatage}"
-        fichier_docx = os.path.join(dossier_sortie, f"{nom_base}.docx")
-        fichier_pdf = os.path.join(dossier_sortie, f"{nom_base}.pdf")
-
-        tpl.save(fichier_docx)
-        convert_with_libreoffice(fichier_docx, fichier_pdf)
-
-        if i == 0:
-            premier_pdf = fichier_pdf
-
-        if progress_bar:
-            progress_bar.progress((i + 1) / total)
+# Remplir les templates Word et convertir en PDF avec le générateur commun (voir generateur.GenerateurLot),
+# lignes lues en flux dans fichier_excel pendant la génération
+# archive reçoit chaque PDF dès qu'il est prêt (ArchiveZip, ou DocumentFusionne pour l'envoi à l'imprimeur)
+def remplir_et_convertir(generateur_lot, dossier_sortie, fichier_excel, nom_fichier, horodatage, progress_bar=None, compteur_txt=None, archive=None):
+    def progression(nb_traites, total):
+        if progress_bar and total:
+            progress_bar.progress(min(nb_traites / total, 1.0))
         if compteur_txt:
-            compteur_txt.text(f"📄 Fichiers générés : {i + 1} / {total}")
-
-    return premier_pdf
-
-def creer_zip_depuis_dossier(dossier_path):
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, _, files in os.walk(dossier_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, start=dossier_path)
-                zipf.write(file_path, arcname=arcname)
-    zip_buffer.seek(0)
-    return zip_buffer
-
-# Convertir PDF en texte pour affichage
-def convertir_en_pdf_et_lire(pdf_path):
-    with open(pdf_path, "rb") as f:
-        reader = PdfReader(f)
-        return "\n\n".join(page.extract_text() or "" for page in reader.pages)
+            compteur_txt.text(f"📄 Fichiers générés : {nb_traites} / {total or '?'}")
+
+    resultat = generateur_lot.generer(fichier_excel, dossier_sortie, horodatage, nom_fichier, validation=False,  # Fichier déjà vérifié
+                                      progression=progression, sur_fichier=archive.ajouter if archive else None)
+    for message in resultat.messages_erreurs():
+        st.error(message)
+    return resultat
+
+# Afficher l'aperçu PDF : lu en flux par la route de téléchargement de la session (lancement par serveur.py),
+# sans relire le fichier à chaque relance
+def afficher_apercu(zone, chemin_pdf):
+    if not chemin_pdf or not os.path.exists(chemin_pdf):
+        return
+    with zone:
+        st.subheader("🔎 Aperçu du premier accusé (PDF)")
+        if telechargements.route_active:
+            st.markdown(f'<iframe src="{telechargements.lien(chemin_pdf, en_ligne=True)}" width="100%" height="600" type="application/pdf"></iframe>',
+                        unsafe_allow_html=True)
+        else:
+            with open(chemin_pdf, "rb") as f:
+                base64_pdf = base64.b64encode(f.read()).decode("utf-8")
+            st.markdown(f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="600" type="application/pdf"></iframe>',
+                        unsafe_allow_html=True)
 
 # UI Streamlit
 st.set_page_config(page_title="Accusés de réception", layout="centered")
 st.title("📄 Générateur d'accusés de réception")
 
 verifier_et_creer_repertoires()
+nb_workers = st.sidebar.number_input("Processus de génération", min_value=1, max_value=64, value=NB_WORKERS_DEFAUT)
+moteur_pdf_direct = st.sidebar.checkbox("PDF direct (sans Word pour les templates compatibles)", value=pdf_direct.ACTIF_PAR_DEFAUT,
+                                        disabled=not pdf_direct.DISPONIBLE)
+# Envoi à l'imprimeur : courriers fusionnés en quelques gros PDF (avec signets et index) au lieu d'un PDF par matricule
+impression = st.sidebar.checkbox("PDF unique pour l'imprimeur")
+taille_volume = st.sidebar.number_input("Courriers par volume (0 = un seul fichier)", min_value=0, value=TAILLE_VOLUME_DEFAUT,
+                                        step=100, disabled=not impression)
 uploaded_file = st.file_uploader("Téléversez un fichier Excel", type=["xlsx", "xls"])
 
 if uploaded_file:
-    if "zip_buffer" not in st.session_state or "horodatage" not in st.session_state or uploaded_file.name != st.session_state.get("nom_fichier"):
-        with st.spinner("Traitement du fichier..."):
-            # Sauvegarde temporaire
-            temp_file_path = definir_chemin("temp_uploaded.xlsx")
-            with open(temp_file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-
-            # Préparation des chemins
-            horodatage = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
-            template_word = definir_chemin("template", "template.docx")
-            dossier_sortie = definir_chemin("accuse_recep", f"accuses_reception_{horodatage}")
-
-            # Champs requis
-            champs_attendus = [
-                "Date_Liq", "Matricule", "Identité_Allocataire", "Identité_Destinataire_bailleur",
-                "Adresse_Ligne_2", "Adresse_Ligne_3", "Adresse_Ligne_4", "Adresse_Ligne_5",
-                "Adresse_Ligne_6", "Adresse_Ligne_7", "Adresse_Ligne_2_Alloc", "Adresse_Ligne_3_Alloc",
-                "Adresse_Ligne_4_Alloc", "Adresse_Ligne_5_Alloc", "Adresse_Ligne_6_Alloc",
-                "Libellé_Allocataire", "Nom_Prénom_Allocataire"
-            ]
-
-            donnees_liste = extraire_donnees(temp_file_path, champs_attendus)
-            if donnees_liste:
-                progress_bar = st.progress(0)
-                compteur_txt = st.empty()
-
-                premier_pdf = remplir_et_convertir(template_word, dossier_sortie, donnees_liste, horodatage, progress_bar, compteur_txt)
-
-                deplacer_fichier(temp_file_path, uploaded_file.name)
-
-                st.success(f"✅ Documents générés dans : `{dossier_sortie}`")
-
-                # Stockage dans session_state
-                st.session_state.zip_buffer = creer_zip_depuis_dossier(dossier_sortie)
-                st.session_state.zip_filename = f"accuses_reception_{horodatage}.zip"
-                st.session_state.nom_fichier = uploaded_file.name
-                st.session_state.horodatage = horodatage
-                st.session_state.premier_pdf = premier_pdf
-
-    # Bouton de téléchargement (aucune régénération ici)
-    st.download_button(
-        label="📦 Télécharger tous les accusés (.zip)",
-        data=st.session_state.zip_buffer,
-        file_name=st.session_state.zip_filename,
-        mime="application/zip"
-    )
-
-    # Affichage PDF si supporté
-    if preview_pdf_active and st.session_state.get("premier_pdf"):
-        st.subheader("🔎 Aperçu du premier accusé généré (PDF)")
-        try:
-            with open(st.session_state["premier_pdf"], "rb") as f:
-                base64_pdf = base64.b64encode(f.read()).decode("utf-8")
-                pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="600" type="application/pdf"></iframe>'
-                st.markdown(pdf_display, unsafe_allow_html=True)
-        except Exception as e:
-            st.warning(f"Impossible d'afficher le PDF : {e}")
-    elif not preview_pdf_active:
+    zone_apercu = st.container()  # L'aperçu s'affiche au-dessus de la progression, avant la génération complète
+    template_word = definir_chemin("template", "template.docx")
+    generateur_lot = GenerateurLot(template_word, CHAMPS_APPLICATION, convertir_pdf=True, nb_workers=nb_workers,
+                                   pdf_direct=moteur_pdf_direct, dossier_archive=definir_chemin("archive"),
+                                   dossier_templates=definir_chemin("template"))
+    # Résultat identifié par le contenu du fichier (pas son nom) : un fichier modifié puis renvoyé sous le même nom
+    # est régénéré, le même fichier envoyé par une autre session ou un autre onglet réutilise le résultat existant
+    cle = cle_resultat(uploaded_file.getvalue(), generateur_lot.fichiers_templates(), champs=CHAMPS_APPLICATION,
+                       pdf_direct=moteur_pdf_direct, taille_volume=taille_volume if impression else None)
+    if st.session_state.get("cle_resultat") != cle:
+        with st.spinner("Traitement du fichier..."), cache_resultats.verrou(cle):
+            entree = cache_resultats.chercher(cle)
+            if entree:
+                st.session_state.apercu_pdf = entree["infos"]["apercu_pdf"]
+                afficher_apercu(zone_apercu, st.session_state.apercu_pdf)
+                st.info(f"♻️ Fichier déjà traité le {entree['date'].replace('T', ' à ')} : documents réutilisés depuis `{entree['dossier']}`")
+                # Zip refait dans le dossier de la session à partir des documents du résultat
+                zip_filename = entree["infos"]["zip_filename"]
+                with ArchiveZip(os.path.join(telechargements.dossier_session(), zip_filename)) as archive:
+                    for fichier in entree["fichiers"]:
+                        archive.ajouter(fichier)
+                st.session_state.zip_path = archive.chemin_zip
+                st.session_state.zip_filename = zip_filename
+                st.session_state.cle_resultat = cle
+            else:
+                with espace_travail("accuse_upload_") as dossier_travail:
+                    # Sauvegarde temporaire dans un espace propre à ce traitement (une session n'écrase pas le fichier d'une autre)
+                    temp_file_path = os.path.join(dossier_travail, os.path.basename(uploaded_file.name))
+                    with open(temp_file_path, "wb") as f:
+                        f.write(uploaded_file.getbuffer())
+
+                    # Préparation des chemins : dossier et suffixe des documents fixés par le nom du fichier et le jour,
+                    # un fichier corrigé puis renvoyé ne régénère que les lignes modifiées (voir manifeste.py)
+                    jour = datetime.now().strftime("%d-%m-%Y")
+                    horodatage = datetime.now().strftime("%d-%m-%Y_%H-%M-%S")
+                    identifiant = f"{horodatage}_{uuid.uuid4().hex[:6]}"  # Zip et volumes propres à ce traitement
+                    nom_excel = os.path.splitext(os.path.basename(uploaded_file.name))[0]
+                    dossier_sortie = definir_chemin("accuse_recep", f"accuses_reception_{nom_excel}_{jour}")
+
+                    # Fichier vérifié en entier avant le lot sur les seules colonnes contrôlées (doublons, dates, balises
+                    # sans colonne, LibreOffice), puis relu en flux par l'aperçu et la génération
+                    rapport = generateur_lot.valider(temp_file_path, uploaded_file.name)
+                    for message in rapport.erreurs:
+                        st.error(message)
+                    for message in rapport.avertissements:
+                        st.warning(message)
+                    if rapport.valide:
+                        # Aperçu de la première ligne avant de lancer le lot (mis en cache par fichier et template)
+                        st.session_state.apercu_pdf = None
+                        if preview_pdf_active:
+                            try:
+                                st.session_state.apercu_pdf = apercu_pdf(
+                                    cle_apercu(uploaded_file.getvalue(), generateur_lot.fichiers_templates(), uploaded_file.name),
+                                    lambda: extraire_donnees(temp_file_path),
+                                    generateur_lot.choisir_template(uploaded_file.name),  # Template choisi pour la ligne 1
+                                    definir_chemin("static", "apercus"), moteur_pdf_direct=moteur_pdf_direct)
+                                afficher_apercu(zone_apercu, st.session_state.apercu_pdf)
+                            except Exception as e:
+                                st.warning(f"Impossible de préparer l'aperçu : {e}")
+
+                        progress_bar = st.progress(0)
+                        compteur_txt = st.empty()
+
+                        # Zip sur disque dans le dossier de la session, alimenté pendant la génération. Un seul traitement
+                        # à la fois par dossier de sortie (même nom de fichier le même jour, contenus différents)
+                        zip_filename = f"accuses_reception_{identifiant}.zip"
+                        chemin_zip = os.path.join(telechargements.dossier_session(), zip_filename)
+                        with cache_resultats.verrou(dossier_sortie), ArchiveZip(chemin_zip) as archive:
+                            if impression:
+                                # Chaque PDF rejoint le volume en cours dès sa conversion ; seuls les volumes et l'index sont gardés
+                                with DocumentFusionne(dossier_sortie, f"accuses_reception_{identifiant}", taille_volume=taille_volume, supprimer_sources=True) as fusion:
+                                    resultat = remplir_et_convertir(generateur_lot, os.path.join(dossier_sortie, "courriers"), temp_file_path, uploaded_file.name, jour, progress_bar, compteur_txt, fusion)
+                                documents = fusion.fichiers + [fusion.chemin_index]
+                                for volume in documents:
+                                    archive.ajouter(volume)
+                            else:
+                                resultat = remplir_et_convertir(generateur_lot, dossier_sortie, temp_file_path, uploaded_file.name, jour, progress_bar, compteur_txt, archive)
+                                documents = resultat.fichiers
+
+                        generateur_lot.archiver(temp_file_path, uploaded_file.name)
+
+                        st.success(f"✅ Documents générés dans : `{dossier_sortie}`")
+                        if resultat.ignores:
+                            st.info(f"⏭️ {resultat.ignores} document(s) déjà à jour, non régénéré(s)")
+
+                        # Stockage dans session_state
+                        st.session_state.zip_path = archive.chemin_zip
+                        st.session_state.zip_filename = zip_filename
+                        st.session_state.cle_resultat = cle
+                        # Réutilisable par les autres sessions seulement sans ligne en erreur à reprendre ; enregistré dans
+                        # tous les cas pour que les documents et l'aperçu soient supprimés à leur tour (taille limitée).
+                        # Dossier partagé par les envois du même fichier dans la journée : seuls ces fichiers lui reviennent.
+                        # Le zip reste à la session (supprimé avec elle)
+                        cache_resultats.enregistrer(cle, dossier_sortie, documents,
+                                                    reutilisable=not resultat.erreurs, annexes=[st.session_state.apercu_pdf],
+                                                    zip_filename=zip_filename,
+                                                    apercu_pdf=st.session_state.apercu_pdf, nb_documents=len(resultat.fichiers))
+    else:
+        afficher_apercu(zone_apercu, st.session_state.get("apercu_pdf"))
+
+    # Téléchargement (aucune régénération ici) : le zip est lu en flux sur disque par le serveur, quelle que soit
+    # sa taille, et seulement par la session qui l'a demandé (voir telechargements.py)
+    if st.session_state.get("zip_path") and os.path.exists(st.session_state.zip_path):
+        if telechargements.route_active:
+            lien = telechargements.lien(st.session_state.zip_path, st.session_state.zip_filename)
+            st.markdown(
+                f'<a href="{lien}" download="{st.session_state.zip_filename}">📦 Télécharger tous les accusés (.zip)</a>',
+                unsafe_allow_html=True
+            )
+        else:
+            with open(st.session_state.zip_path, "rb") as f:
+                st.download_button(
+                    label="📦 Télécharger tous les accusés (.zip)",
+                    data=f,
+                    file_name=st.session_state.zip_filename,
+                    mime="application/zip"
+                )
+
+    if not preview_pdf_active:
         st.info("La prévisualisation PDF est désactivée sur ce système.")
-
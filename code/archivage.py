@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+
+# Formats déjà compressés : les recompresser ne fait rien gagner, ils sont stockés tels quels dans le zip
+EXTENSIONS_COMPRESSEES = {".pdf", ".docx", ".xlsx", ".zip", ".png", ".jpg", ".jpeg"}
+
+# Archive zip écrite sur disque au fil de la génération : chaque document y est ajouté dès qu'il est produit,
+# la mémoire utilisée ne dépend pas du nombre de documents
+class ArchiveZip:
+    def __init__(self, chemin_zip):
+        os.makedirs(os.path.dirname(chemin_zip), exist_ok=True)
+        self.chemin_zip = chemin_zip
+        # Le zip n'apparaît sous son nom qu'une fois complet ; nom provisoire propre à chaque archive en cours
+        self._chemin_partiel = f"{chemin_zip}.{uuid.uuid4().hex[:8]}.partiel"
+        self._zip = zipfile.ZipFile(self._chemin_partiel, "w", allowZip64=True)
+        self._noms = set()
+
+    def ajouter(self, chemin, nom_archive=None):
+        nom_archive = nom_archive or os.path.basename(chemin)
+        if nom_archive in self._noms:
+            return
+        compression = zipfile.ZIP_STORED if os.path.splitext(chemin)[1].lower() in EXTENSIONS_COMPRESSEES else zipfile.ZIP_DEFLATED
+        self._zip.write(chemin, arcname=nom_archive, compress_type=compression)
+        self._noms.add(nom_archive)
+
+    def fermer(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+            os.replace(self._chemin_partiel, self.chemin_zip)
+        return self.chemin_zip
+
+    # Génération interrompue : le zip incomplet est supprimé
+    def abandonner(self):
+        if self._zip is not None:
+            self._zip.close()
+            self._zip = None
+            os.remove(self._chemin_partiel)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_exception, *exc):
+        if type_exception is None:
+            self.fermer()
+        else:
+            self.abandonner()
+
+# Créer sur disque le zip de tout un dossier de sortie
+def creer_zip_depuis_dossier(dossier_path, chemin_zip):
+    with ArchiveZip(chemin_zip) as archive:
+        for root, dirs, files in os.walk(dossier_path):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]  # Espaces de travail des lots en cours
+            for file in files:
+                if file.startswith("."):
+                    continue  # Fichiers techniques (manifeste)
+                file_path = os.path.join(root, file)
+                archive.ajouter(file_path, os.path.relpath(file_path, start=dossier_path))
+    return chemin_zip
+
+# Espace de travail propre à un traitement (fichier téléversé, documents en cours...), supprimé à la fin
+# dossier : à placer sur le même disque que la destination pour que la publication soit un simple renommage
+@contextmanager
+def espace_travail(prefixe="accuse_", dossier=None):
+    chemin = tempfile.mkdtemp(prefix=prefixe, dir=dossier)
+    try:
+        yield chemin
+    finally:
+        shutil.rmtree(chemin, ignore_errors=True)
+
+# Réserver un nom libre dans un dossier sans boucle de recherche : création exclusive (O_EXCL) du nom d'origine,
+# sinon du nom suffixé par l'horodatage et un identifiant aléatoire. Deux traitements ne peuvent obtenir le même nom.
+def reserver_nom(dossier, nom):
+    base, ext = os.path.splitext(nom)
+    for candidat in (nom, f"{base}_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}{ext}"):
+        chemin = os.path.join(dossier, candidat)
+        try:
+            os.close(os.open(chemin, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return chemin
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"Impossible de réserver un nom pour {nom} dans {dossier}")
+
+# Publier un fichier à un emplacement réservé : renommage atomique sur le même disque,
+# sinon copie sous un nom provisoire puis renommage (le fichier n'apparaît jamais à moitié copié)
+def publier_fichier(source, destination):
+    try:
+        os.replace(source, destination)
+    except OSError:
+        provisoire = f"{destination}.{uuid.uuid4().hex[:8]}.partiel"
+        shutil.copy2(source, provisoire)
+        os.replace(provisoire, destination)
+        os.remove(source)
+    return destination
+
+# Déplacer des fichiers traités vers le dossier d'archive en une passe (noms réservés puis publiés)
+# sources : chemins, ou couples (chemin, nom d'archive) ; retourne les chemins d'archive dans le même ordre
+def archiver_fichiers(sources, dossier_archive):
+    os.makedirs(dossier_archive, exist_ok=True)
+    sources = [source if isinstance(source, tuple) else (source, None) for source in sources]
+    destinations = [reserver_nom(dossier_archive, nom or os.path.basename(chemin)) for chemin, nom in sources]
+    for (chemin, _), destination in zip(sources, destinations):
+        try:
+            publier_fichier(chemin, destination)
+        except OSError:
+            os.remove(destination)  # Libérer le nom réservé
+            raise
+    return destinations
+
+# Déplacer un fichier traité vers le dossier d'archive (suffixe unique si le nom est déjà pris)
+def archiver_fichier(source, dossier_archive, nom_original=None):
+    return archiver_fichiers([(source, nom_original)], dossier_archive)[0]
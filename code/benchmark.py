@@ -0,0 +1,194 @@
+# Benchmark de la chaîne lecture -> rendu -> conversion -> zip -> archivage
+#
+# Génère des exports Excel synthétiques avec les colonnes réelles et un template d'exemple,
+# mesure chaque étape séparément (durée, pic mémoire) et écrit les résultats en JSON.
+# Avec --memoire, le rendu se fait dans le processus du benchmark (un seul worker) : les pics mesurés
+# couvrent alors tout le travail, pas seulement le processus parent d'un pool.
+#
+#   python code/benchmark.py --tailles 10 1000 --convertisseur factice
+#   python code/benchmark.py --comparer resultats_avant.json resultats_apres.json
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from docx import Document
+from openpyxl import Workbook
+
+from archivage import archiver_fichier, creer_zip_depuis_dossier
+from conversion import CONVERTISSEURS
+from generateur import CHAMPS_ACCUSE, CHAMPS_ALLOCATAIRE, TYPES_CHAMPS, extraire_donnees
+from moteur import generer_documents
+
+try:
+    import resource  # Pic de mémoire résidente (Linux / macOS)
+except ImportError:
+    resource = None
+
+TAILLES_DEFAUT = [10, 1000, 10000, 100000]
+
+# Colonnes de l'export des impayés (mêmes noms que dans l'application Streamlit)
+CHAMPS_BENCHMARK = CHAMPS_ACCUSE + CHAMPS_ALLOCATAIRE
+
+# Créer un export Excel synthétique de nb_lignes lignes (en-têtes avec espaces, comme les exports réels)
+def creer_excel_synthetique(chemin, nb_lignes, graine=42):
+    alea = random.Random(graine)
+    classeur = Workbook(write_only=True)
+    feuille = classeur.create_sheet()
+    feuille.append([champ.replace("_", " ") for champ in CHAMPS_BENCHMARK])
+    debut = datetime(2024, 1, 1)
+    for i in range(nb_lignes):
+        feuille.append([
+            debut + timedelta(days=alea.randint(0, 365)),
+            1000000 + i,
+            f"ALLOCATAIRE {i}",
+            f"BAILLEUR {alea.randint(1, 500)} & ASSOCIES",
+            *[f"{alea.randint(1, 200)} RUE DU TEST {j}" if alea.random() > 0.2 else None for j in range(6)],
+            *[f"{alea.randint(1, 200)} AVENUE ALLOC {j}" if alea.random() > 0.3 else None for j in range(5)],
+            "MONSIEUR" if i % 2 else "MADAME",
+            f"NOM{i} PRENOM{i}",
+        ])
+    classeur.save(chemin)
+
+# Créer un template Word d'exemple utilisant tous les champs (syntaxe docxtpl)
+def creer_template_exemple(chemin):
+    document = Document()
+    document.sections[0].header.paragraphs[0].text = "Réf. {{ Matricule }}"
+    for champ in CHAMPS_BENCHMARK[3:10]:
+        document.add_paragraph(f"{{{{ {champ} }}}}")
+    document.add_paragraph("Objet : accusé de réception de votre déclaration d'impayés")
+    document.add_paragraph(
+        "{{ Libellé_Allocataire }} {{ Nom_Prénom_Allocataire }}, nous accusons réception le {{ Date_Liq }} "
+        "de la déclaration concernant {{ Identité_Allocataire }} (matricule {{ Matricule }})."
+    )
+    for i in range(20):
+        document.add_paragraph("Texte fixe du courrier, paragraphe %d. " % i * 4)
+    tableau = document.add_table(rows=5, cols=1)
+    for i, champ in enumerate(CHAMPS_BENCHMARK[10:15]):
+        tableau.cell(i, 0).text = f"{{{{ {champ} }}}}"
+    document.save(chemin)
+
+# Pic de mémoire résidente du processus (RUSAGE_SELF) ou du plus gros processus enfant terminé (RUSAGE_CHILDREN :
+# LibreOffice, workers arrêtés)
+def _rss_max(qui="self"):
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF if qui == "self" else resource.RUSAGE_CHILDREN).ru_maxrss
+    return rss if platform.system() == "Darwin" else rss * 1024  # Ko sous Linux, octets sous macOS
+
+# Mesurer une étape : durée, pic d'allocations Python (tracemalloc) et pic de mémoire résidente
+def mesurer(nom, fonction, mesures, suivre_memoire):
+    if suivre_memoire:
+        tracemalloc.start()
+    debut = time.perf_counter()
+    valeur = fonction()
+    duree = time.perf_counter() - debut
+    pic = None
+    if suivre_memoire:
+        pic = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    mesures[nom] = {"secondes": round(duree, 4), "pic_memoire_python_octets": pic, "rss_max_octets": _rss_max(),
+                    "rss_max_enfants_octets": _rss_max("enfants")}
+    print(f"  {nom:<12} {duree:9.3f} s" + (f"  pic {pic / 1e6:8.1f} Mo" if pic is not None else ""))
+    return valeur
+
+def executer_taille(nb_lignes, dossier_travail, fichier_template, nb_workers, convertisseur, suivre_memoire):
+    print(f"▶ {nb_lignes} lignes")
+    fichier_excel = os.path.join(dossier_travail, f"export_{nb_lignes}.xlsx")
+    dossier_sortie = os.path.join(dossier_travail, f"sortie_{nb_lignes}")
+    creer_excel_synthetique(fichier_excel, nb_lignes)
+    mesures = {}
+
+    lignes = mesurer("lecture", lambda: extraire_donnees(fichier_excel, CHAMPS_BENCHMARK, TYPES_CHAMPS).charger(), mesures, suivre_memoire)
+    resultat = mesurer("rendu", lambda: generer_documents(
+        fichier_template, dossier_sortie, lignes, "bench", nb_workers=nb_workers, incremental=False), mesures, suivre_memoire)
+    erreurs = mesurer("conversion", lambda: CONVERTISSEURS[convertisseur](resultat.fichiers, dossier_sortie), mesures, suivre_memoire)
+    mesurer("zip", lambda: creer_zip_depuis_dossier(dossier_sortie, dossier_sortie + ".zip"), mesures, suivre_memoire)
+    mesurer("archivage", lambda: archiver_fichier(fichier_excel, os.path.join(dossier_travail, "archive")), mesures, suivre_memoire)
+
+    return {
+        "lignes": nb_lignes,
+        "documents": len(resultat.fichiers),
+        "erreurs": len(resultat.erreurs) + len(erreurs),
+        "etapes": mesures,
+        "total_secondes": round(sum(m["secondes"] for m in mesures.values()), 4),
+    }
+
+def _version():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# Afficher l'évolution des durées entre deux fichiers de résultats
+def comparer(fichier_avant, fichier_apres):
+    with open(fichier_avant, encoding="utf-8") as f:
+        avant = {r["lignes"]: r for r in json.load(f)["resultats"]}
+    with open(fichier_apres, encoding="utf-8") as f:
+        apres = {r["lignes"]: r for r in json.load(f)["resultats"]}
+    for nb_lignes in sorted(set(avant) & set(apres)):
+        print(f"▶ {nb_lignes} lignes")
+        for etape, mesure in apres[nb_lignes]["etapes"].items():
+            reference = avant[nb_lignes]["etapes"].get(etape)
+            if reference and reference["secondes"]:
+                ecart = (mesure["secondes"] - reference["secondes"]) / reference["secondes"] * 100
+                print(f"  {etape:<12} {reference['secondes']:9.3f} s -> {mesure['secondes']:9.3f} s  ({ecart:+.1f} %)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la génération des accusés de réception")
+    parser.add_argument("--tailles", type=int, nargs="+", default=TAILLES_DEFAUT, help="Nombres de lignes à tester")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de processus de génération")
+    parser.add_argument("--convertisseur", choices=sorted(CONVERTISSEURS), default="libreoffice",
+                        help="Convertisseur PDF ('factice' sur les postes sans LibreOffice)")
+    parser.add_argument("--memoire", action="store_true", help="Suivre le pic d'allocations Python (ralentit les mesures)")
+    parser.add_argument("--sortie", default=f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json",
+                        help="Fichier JSON de résultats")
+    parser.add_argument("--garder", action="store_true", help="Conserver le dossier de travail")
+    parser.add_argument("--comparer", nargs=2, metavar=("AVANT", "APRES"), help="Comparer deux fichiers de résultats")
+    args = parser.parse_args()
+
+    if args.comparer:
+        comparer(*args.comparer)
+        return
+    if args.memoire and args.workers != 1:
+        # tracemalloc et RUSAGE_SELF ne voient pas les workers du pool, toujours en marche pendant les mesures
+        print("ℹ️ --memoire : rendu dans le processus du benchmark (--workers 1) pour mesurer toute la mémoire")
+        args.workers = 1
+
+    dossier_travail = tempfile.mkdtemp(prefix="benchmark_accuses_")
+    try:
+        fichier_template = os.path.join(dossier_travail, "template.docx")
+        creer_template_exemple(fichier_template)
+        resultats = [executer_taille(n, dossier_travail, fichier_template, args.workers, args.convertisseur, args.memoire)
+                     for n in args.tailles]
+    finally:
+        if args.garder:
+            print(f"📂 Dossier de travail conservé : {dossier_travail}")
+        else:
+            shutil.rmtree(dossier_travail, ignore_errors=True)
+
+    rapport = {
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "version": _version(),
+        "python": sys.version.split()[0],
+        "plateforme": platform.platform(),
+        "processeurs": os.cpu_count(),
+        "workers": args.workers,
+        "convertisseur": args.convertisseur,
+        "resultats": resultats,
+    }
+    with open(args.sortie, "w", encoding="utf-8") as f:
+        json.dump(rapport, f, ensure_ascii=False, indent=2)
+    print(f"✅ Résultats écrits dans {args.sortie}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from mesures import definir_jauge, incrementer
+
+# Budget de lignes partagé par les générations lancées en même temps (workers du surveillant) : nombre maximal
+# de lignes en cours, c'est-à-dire lues dans un fichier Excel et pas encore rendues, converties et enregistrées.
+# generer_documents réserve la place d'un lot avant de le lire : tant que le budget est plein, la lecture attend
+# (contre-pression) et la mémoire occupée par les lignes reste bornée, quel que soit le nombre de fichiers déposés.
+class BudgetLignes:
+    def __init__(self, max_lignes):
+        self.max_lignes = max(1, max_lignes)
+        self.en_cours = 0
+        self.attentes = 0  # Réservations qui n'ont pas tenu dans le budget (ralentissements)
+        self.duree_attente = 0.0  # Secondes cumulées d'attente de place
+        self._condition = threading.Condition()
+
+    # Réserver nb lignes (au plus max_lignes : voir generer_documents, lots ramenés à la taille du budget).
+    # attendre=False : rend False tout de suite si la place manque ; sinon attend qu'elle se libère,
+    # sauf annulation (threading.Event) : rend alors False
+    def reserver(self, nb, attendre=True, annulation=None):
+        with self._condition:
+            if self.en_cours + nb > self.max_lignes:
+                self.attentes += 1
+                incrementer("accuse_attentes_lignes_total")
+                if not attendre:
+                    return False
+                debut = time.perf_counter()
+                while self.en_cours + nb > self.max_lignes:
+                    if annulation is not None and annulation.is_set():
+                        self.duree_attente += time.perf_counter() - debut
+                        return False
+                    self._condition.wait(0.5)
+                self.duree_attente += time.perf_counter() - debut
+            self.en_cours += nb
+            definir_jauge("accuse_lignes_en_cours", self.en_cours)
+            return True
+
+    def liberer(self, nb):
+        if nb <= 0:
+            return
+        with self._condition:
+            self.en_cours = max(0, self.en_cours - nb)
+            definir_jauge("accuse_lignes_en_cours", self.en_cours)
+            self._condition.notify_all()
@@ -0,0 +1,160 @@
+# Génération en ligne de commande, sans interface graphique (tâches planifiées sur un serveur)
+#
+# Traite plusieurs fichiers Excel, ou tous ceux d'un dossier, dans un même processus : le template préparé,
+# le pool de processus de génération et les profils LibreOffice sont réutilisés d'un fichier à l'autre.
+#
+#   python code/cli.py exports/ --template template/accuse.docx --sortie accuse_recep --archive archive --pdf
+#   python code/cli.py a.xlsx b.xlsx --template accuse.docx --sortie sortie --workers 8 --syntaxe texte
+#   python code/cli.py export_mixte.xlsx --templates template/ --sortie sortie   (template choisi ligne par ligne)
+#   python code/cli.py exports/ --template accuse.docx --sortie sortie --pdf --verifier   (essai à blanc, rien n'est écrit)
+#   python code/cli.py export.xlsx --template accuse.docx --sortie sortie --pdf --fusion   (volumes pour l'imprimeur)
+import argparse
+import os
+import sys
+import time
+from datetime import date
+
+from conversion import CONVERTISSEURS
+from fusion import TAILLE_VOLUME_DEFAUT, DocumentFusionne
+from generateur import CHAMPS_ACCUSE, CHAMPS_ALLOCATAIRE, GenerateurLot, est_fichier_excel
+from moteur import rendre_docxtpl, rendre_texte
+from publication import DOSSIER_LOCAL_DEFAUT, MODES_PUBLICATION, DepotLocal
+from registre import CHAMP_TYPE_COURRIER
+from validation import ErreurValidation
+
+# Syntaxe du template : balises Jinja (docxtpl) ou balises {{ champ }} simples (mise en forme des runs conservée)
+SYNTAXES = {"jinja": rendre_docxtpl, "texte": rendre_texte}
+
+# Fichiers Excel désignés par la ligne de commande : fichiers donnés tels quels, dossiers parcourus (sans sous-dossiers)
+def lister_fichiers(entrees):
+    fichiers = []
+    for entree in entrees:
+        if os.path.isdir(entree):
+            fichiers.extend(os.path.join(entree, nom) for nom in sorted(os.listdir(entree))
+                            if os.path.isfile(os.path.join(entree, nom)) and est_fichier_excel(nom))
+        elif os.path.isfile(entree):
+            fichiers.append(entree)
+        else:
+            raise FileNotFoundError(f"Fichier ou dossier introuvable : {entree}")
+    return fichiers
+
+# Générer les documents d'un fichier puis l'archiver ; retourne le nombre de lignes en erreur.
+# fusion : (format, taille_volume) pour fusionner aussi les documents du fichier en volumes (dossier "fusion" de la sortie)
+def traiter_fichier(generateur_lot, fichier_excel, dossier_sortie, suffixe, archiver, fusion=None):
+    debut = time.perf_counter()
+    if fusion:
+        format_sortie, taille_volume = fusion
+        nom_base = f"{os.path.splitext(os.path.basename(fichier_excel))[0]}_{suffixe}"
+        with DocumentFusionne(os.path.join(dossier_sortie, "fusion"), nom_base, format_sortie, taille_volume) as document:
+            resultat = generateur_lot.generer(fichier_excel, dossier_sortie, suffixe, sur_fichier=document.ajouter)
+        print(f"  📚 {document.nb_documents} courrier(s) fusionné(s) en {len(document.fichiers)} volume(s), index : {document.chemin_index}")
+    else:
+        resultat = generateur_lot.generer(fichier_excel, dossier_sortie, suffixe)
+    for message in resultat.messages_erreurs():
+        print(f"  ❌ {message}", file=sys.stderr)
+    print(f"  ✅ {len(resultat.fichiers)} document(s), {resultat.ignores} déjà à jour, "
+          f"{len(resultat.erreurs)} erreur(s) en {time.perf_counter() - debut:.1f} s")
+    if archiver:
+        print(f"  📦 Archivé : {generateur_lot.archiver(fichier_excel)}")
+    return len(resultat.erreurs)
+
+# Essai à blanc : vérifier le fichier en entier sans rien générer ni archiver ; retourne le nombre de problèmes bloquants
+def verifier_fichier(generateur_lot, fichier_excel):
+    rapport = generateur_lot.valider(fichier_excel)
+    print(f"  {rapport}")
+    return len(rapport.erreurs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Génération des accusés de réception en ligne de commande")
+    parser.add_argument("entrees", nargs="+", help="Fichiers Excel ou dossiers contenant les fichiers à traiter")
+    parser.add_argument("--template", help="Template Word (template par défaut avec --templates)")
+    parser.add_argument("--templates", help="Dossier de templates : type de courrier choisi par la colonne "
+                                            f"{CHAMP_TYPE_COURRIER} ou par le nom du fichier Excel")
+    parser.add_argument("--sortie", help="Dossier des documents générés (obligatoire sauf avec --verifier)")
+    parser.add_argument("--archive", help="Dossier où déplacer les fichiers traités (par défaut : ils restent en place)")
+    parser.add_argument("--workers", type=int, default=None, help="Nombre de processus de génération")
+    parser.add_argument("--syntaxe", choices=sorted(SYNTAXES), default="jinja", help="Syntaxe des balises du template")
+    parser.add_argument("--allocataire", action="store_true",
+                        help="Exiger aussi les colonnes de l'allocataire (template de l'application Streamlit)")
+    parser.add_argument("--pdf", action="store_true", help="Convertir les documents en PDF")
+    parser.add_argument("--pdf-direct", action="store_true", help="Moteur PDF direct pour les templates compatibles")
+    parser.add_argument("--convertisseur", choices=sorted(CONVERTISSEURS), default="libreoffice",
+                        help="Convertisseur PDF ('factice' sur les postes sans LibreOffice)")
+    parser.add_argument("--suffixe", default=date.today().strftime("%d-%m-%Y"), help="Suffixe des noms de documents")
+    parser.add_argument("--tout-regenerer", action="store_true", help="Régénérer aussi les documents déjà à jour")
+    parser.add_argument("--publication", choices=("direct",) + MODES_PUBLICATION, default="direct",
+                        help="direct : écriture dans --sortie ; dossier ou zip : génération dans un dossier local "
+                             "puis publication en bloc dans --sortie (dossier synchronisé, partage réseau)")
+    parser.add_argument("--dossier-local", default=os.path.join(DOSSIER_LOCAL_DEFAUT, "cli"),
+                        help="Dossier de travail local avec --publication dossier ou zip")
+    parser.add_argument("--fusion", action="store_true",
+                        help="Fusionner aussi les documents de chaque fichier en volumes avec signets et index "
+                             "(PDF avec --pdf, Word sinon), pour l'envoi à l'imprimeur")
+    parser.add_argument("--taille-volume", type=int, default=TAILLE_VOLUME_DEFAUT,
+                        help="Courriers par volume avec --fusion (0 : un seul fichier)")
+    parser.add_argument("--verifier", action="store_true",
+                        help="Essai à blanc : vérifier les fichiers (doublons, dates, balises, LibreOffice) sans rien générer")
+    parser.add_argument("--sans-verification", action="store_true",
+                        help="Générer sans vérifier d'abord le fichier entier (les lignes en erreur sont signalées une à une)")
+    args = parser.parse_args()
+    if not args.template and not args.templates:
+        parser.error("--template ou --templates est obligatoire")
+    if not args.sortie and not args.verifier:
+        parser.error("--sortie est obligatoire")
+    if args.taille_volume < 0:
+        parser.error("--taille-volume doit être positif (0 : un seul fichier)")
+
+    try:
+        fichiers = lister_fichiers(args.entrees)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if not fichiers:
+        print("Aucun fichier Excel à traiter.")
+        return 0
+
+    generateur_lot = GenerateurLot(
+        args.template, CHAMPS_ACCUSE + CHAMPS_ALLOCATAIRE if args.allocataire else CHAMPS_ACCUSE,
+        fonction_rendu=SYNTAXES[args.syntaxe], convertir_pdf=args.pdf, nb_workers=args.workers,
+        convertisseur=CONVERTISSEURS[args.convertisseur], pdf_direct=args.pdf_direct,
+        incremental=not args.tout_regenerer, dossier_archive=args.archive, dossier_templates=args.templates,
+        validation=not args.sans_verification,
+        depot=DepotLocal(args.dossier_local, args.publication) if args.publication != "direct" else None)
+    try:
+        generateur_lot.preparer()  # Template invalide : arrêt avant le premier fichier
+    except Exception as e:
+        print(f"❌ Template inutilisable ({args.template}) : {e}", file=sys.stderr)
+        return 2
+    if generateur_lot.registre is not None:
+        registre = generateur_lot.registre
+        for identifiant in registre.modeles:
+            print(f"📄 {identifiant} : {', '.join(sorted(registre.champs[identifiant])) or 'aucun champ'}")
+        for identifiant, erreur in registre.erreurs.items():
+            print(f"⚠️ Template ignoré {identifiant} : {erreur}", file=sys.stderr)
+
+    echecs = 0
+    lignes_en_erreur = 0
+    for numero, fichier_excel in enumerate(fichiers, 1):
+        print(f"▶ [{numero}/{len(fichiers)}] {fichier_excel}")
+        try:
+            if args.verifier:
+                lignes_en_erreur += verifier_fichier(generateur_lot, fichier_excel)
+            else:
+                lignes_en_erreur += traiter_fichier(generateur_lot, fichier_excel, args.sortie, args.suffixe, bool(args.archive),
+                                                    ("pdf" if args.pdf else "docx", args.taille_volume) if args.fusion else None)
+        except ErreurValidation as e:
+            # Problèmes trouvés avant la génération : aucun document écrit, le fichier reste en place
+            print(f"  🚫 {e}", file=sys.stderr)
+            echecs += 1
+        except Exception as e:
+            # Fichier illisible ou colonnes manquantes : il reste en place et les fichiers suivants sont traités
+            print(f"  ❌ {e}", file=sys.stderr)
+            echecs += 1
+
+    if args.verifier:
+        print(f"{len(fichiers)} fichier(s) vérifié(s), {lignes_en_erreur} problème(s) bloquant(s), aucun document généré")
+    else:
+        print(f"{len(fichiers) - echecs} fichier(s) traité(s), {echecs} en échec, {lignes_en_erreur} ligne(s) en erreur")
+    return 1 if echecs or lignes_en_erreur else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from multiprocessing.util import Finalize
+from pathlib import Path
+
+# Chemin de secours si soffice n'est pas dans le PATH
+CHEMIN_SOFFICE_DEFAUT = r"C:\Program Files (x86)\LibreOffice 4\program\soffice.exe"  # Modifie ce chemin si besoin
+
+# Nombre maximal de fichiers passés à un même appel de soffice (limite de longueur de la ligne de commande sous Windows)
+TAILLE_LOT_SOFFICE = 200
+
+# Localiser l'exécutable LibreOffice
+def trouver_soffice():
+    soffice_path = shutil.which("soffice") or CHEMIN_SOFFICE_DEFAUT
+    if not os.path.exists(soffice_path):
+        raise FileNotFoundError("LibreOffice (soffice) introuvable. Vérifie son installation ou ajoute le chemin dans le PATH.")
+    return soffice_path
+
+# Profil du processus en cours : (pid, dossier), pid vérifié car un processus créé par fork hérite de la variable
+_profil = None
+
+# Profil LibreOffice propre au processus : plusieurs soffice peuvent tourner en parallèle
+# (et à côté d'un LibreOffice ouvert par l'utilisateur) sans se bloquer sur le même profil.
+# Le dossier est supprimé à la sortie du processus (Finalize : atexit n'est pas appelé dans les workers d'un pool)
+def profil_libreoffice():
+    global _profil
+    if _profil is None or _profil[0] != os.getpid():
+        dossier_profil = Path(tempfile.gettempdir()) / f"accuse_reception_lo_{os.getpid()}"
+        Finalize(None, shutil.rmtree, args=(str(dossier_profil),), kwargs={"ignore_errors": True}, exitpriority=0)
+        _profil = (os.getpid(), dossier_profil)
+    return f"-env:UserInstallation={_profil[1].as_uri()}"
+
+# Chemin du PDF produit par LibreOffice pour un fichier Word donné
+def chemin_pdf(docx_path, sortie_dir):
+    return os.path.join(sortie_dir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf")
+
+# Convertir un lot de fichiers Word en PDF avec le moins d'appels possible à LibreOffice
+# Retourne un dictionnaire {fichier_docx: message d'erreur} pour les fichiers non convertis
+def convertir_lot_libreoffice(fichiers_docx, sortie_dir, progression=None):
+    fichiers_docx = list(fichiers_docx)
+    erreurs = {}
+    try:
+        soffice_path = trouver_soffice()
+    except FileNotFoundError as e:
+        return {docx_path: str(e) for docx_path in fichiers_docx}
+
+    nb_traites = 0
+    for debut in range(0, len(fichiers_docx), TAILLE_LOT_SOFFICE):
+        lot = fichiers_docx[debut:debut + TAILLE_LOT_SOFFICE]
+        erreur_lot = None
+        try:
+            subprocess.run([
+                soffice_path,
+                profil_libreoffice(),
+                "--headless",
+                "--convert-to", "pdf",
+                "--outdir", sortie_dir,
+                *lot
+            ], check=True, capture_output=True)
+        except (subprocess.CalledProcessError, OSError) as e:
+            erreur_lot = e
+
+        # Vérification fichier par fichier : un document en échec ne fait pas échouer tout le lot
+        for docx_path in lot:
+            pdf_path = chemin_pdf(docx_path, sortie_dir)
+            if os.path.exists(pdf_path):
+                if os.path.exists(docx_path):
+                    os.remove(docx_path)
+            else:
+                message = f"Le fichier PDF attendu n'a pas été généré : {pdf_path}"
+                if erreur_lot is not None:
+                    message += f" ({erreur_lot})"
+                erreurs[docx_path] = message
+
+        nb_traites += len(lot)
+        if progression:
+            progression(nb_traites, len(fichiers_docx))
+
+    return erreurs
+
+# PDF minimal d'une page, utilisé par le convertisseur factice
+PDF_FACTICE = (
+    b"%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n"
+    b"2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n"
+    b"3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]>>endobj\n"
+    b"trailer<</Root 1 0 R>>\n%%EOF\n"
+)
+
+# Convertisseur de remplacement pour les postes sans LibreOffice (benchmarks, développement) :
+# même contrat que convertir_lot_libreoffice, écrit un PDF vide à la place de chaque document
+def convertir_lot_factice(fichiers_docx, sortie_dir, progression=None):
+    fichiers_docx = list(fichiers_docx)
+    for nb_traites, docx_path in enumerate(fichiers_docx, start=1):
+        with open(chemin_pdf(docx_path, sortie_dir), "wb") as f:
+            f.write(PDF_FACTICE)
+        os.remove(docx_path)
+        if progression:
+            progression(nb_traites, len(fichiers_docx))
+    return {}
+
+# Convertisseurs disponibles, choisis par nom (variable d'environnement ACCUSE_CONVERTISSEUR)
+CONVERTISSEURS = {
+    "libreoffice": convertir_lot_libreoffice,
+    "factice": convertir_lot_factice,
+}
+
+# Convertisseur d'après son nom (lève ValueError avec les noms possibles si le nom est inconnu)
+def choisir_convertisseur(nom):
+    convertisseur = CONVERTISSEURS.get(nom)
+    if convertisseur is None:
+        raise ValueError(f"Convertisseur inconnu : {nom!r} (variable ACCUSE_CONVERTISSEUR). "
+                         f"Valeurs possibles : {', '.join(sorted(CONVERTISSEURS))}")
+    return convertisseur
+
+CONVERTISSEUR_DEFAUT = choisir_convertisseur(os.environ.get("ACCUSE_CONVERTISSEUR", "libreoffice"))
+
+# Vérifier qu'un convertisseur peut fonctionner sur ce poste, sans rien convertir (lève FileNotFoundError)
+def verifier_convertisseur(convertisseur):
+    if convertisseur is convertir_lot_libreoffice:
+        trouver_soffice()
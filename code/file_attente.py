@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Durée pendant laquelle la taille et la date de modification d'un fichier doivent rester identiques
+# avant qu'il soit considéré comme complètement copié
+DELAI_STABILITE = 5  # secondes
+
+# Statuts d'un travail : detecte -> pret -> en_cours -> termine / echec
+STATUTS_ACTIFS = ("detecte", "pret", "en_cours")
+
+# File de travaux persistante (SQLite) : les fichiers détectés survivent à un redémarrage du surveillant
+class FileAttente:
+    def __init__(self, chemin_base):
+        os.makedirs(os.path.dirname(chemin_base), exist_ok=True)
+        self._verrou = threading.Lock()
+        self._connexion = sqlite3.connect(chemin_base, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connexion.execute("PRAGMA journal_mode=WAL")
+        self._connexion.executescript("""
+            CREATE TABLE IF NOT EXISTS travaux (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chemin TEXT NOT NULL,
+                statut TEXT NOT NULL,
+                taille INTEGER,
+                mtime REAL,
+                vu_le REAL NOT NULL,
+                tentatives INTEGER NOT NULL DEFAULT 0,
+                erreur TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS travaux_actifs ON travaux(chemin)
+                WHERE statut IN ('detecte', 'pret', 'en_cours');
+        """)
+
+    def _executer(self, requete, parametres=()):
+        with self._verrou:
+            return self._connexion.execute(requete, parametres).fetchall()
+
+    # Enregistrer un fichier détecté ; ignoré s'il est déjà en file
+    def ajouter(self, chemin):
+        chemin = os.path.abspath(chemin)
+        self._executer(
+            "INSERT OR IGNORE INTO travaux (chemin, statut, taille, mtime, vu_le) VALUES (?, 'detecte', NULL, NULL, ?)",
+            (chemin, time.time()))
+
+    # Passer à 'pret' les fichiers dont la taille et la date de modification n'ont pas bougé depuis delai secondes
+    def verifier_stabilite(self, delai=DELAI_STABILITE):
+        maintenant = time.time()
+        for id_travail, chemin, taille, mtime, vu_le in self._executer(
+                "SELECT id, chemin, taille, mtime, vu_le FROM travaux WHERE statut = 'detecte'"):
+            try:
+                stat = os.stat(chemin)
+            except FileNotFoundError:
+                self._executer("DELETE FROM travaux WHERE id = ?", (id_travail,))
+                continue
+            if (stat.st_size, stat.st_mtime) != (taille, mtime):
+                self._executer("UPDATE travaux SET taille = ?, mtime = ?, vu_le = ? WHERE id = ?",
+                               (stat.st_size, stat.st_mtime, maintenant, id_travail))
+            elif maintenant - vu_le >= delai:
+                self._executer("UPDATE travaux SET statut = 'pret' WHERE id = ?", (id_travail,))
+
+    # Réserver le prochain travail prêt ; retourne (id, chemin) ou None
+    def prendre(self):
+        with self._verrou:
+            self._connexion.execute("BEGIN IMMEDIATE")
+            try:
+                ligne = self._connexion.execute(
+                    "SELECT id, chemin FROM travaux WHERE statut = 'pret' ORDER BY id LIMIT 1").fetchone()
+                if ligne:
+                    self._connexion.execute(
+                        "UPDATE travaux SET statut = 'en_cours', tentatives = tentatives + 1 WHERE id = ?", (ligne[0],))
+                self._connexion.execute("COMMIT")
+            except Exception:
+                self._connexion.execute("ROLLBACK")
+                raise
+        return ligne
+
+    def terminer(self, id_travail):
+        self._executer("UPDATE travaux SET statut = 'termine', erreur = NULL WHERE id = ?", (id_travail,))
+
+    def echouer(self, id_travail, message):
+        self._executer("UPDATE travaux SET statut = 'echec', erreur = ? WHERE id = ?", (message, id_travail))
+
+    # Au démarrage : les travaux interrompus par un arrêt du surveillant sont remis en file
+    def reprendre(self):
+        self._executer("UPDATE travaux SET statut = 'pret' WHERE statut = 'en_cours'")
+
+    # Nombre de travaux en attente ou en cours
+    def profondeur(self):
+        return self._executer(
+            f"SELECT COUNT(*) FROM travaux WHERE statut IN ({','.join('?' * len(STATUTS_ACTIFS))})", STATUTS_ACTIFS)[0][0]
+
+    def fermer(self):
+        with self._verrou:
+            self._connexion.close()
@@ -0,0 +1,410 @@
+import csv
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import zipfile
+from array import array
+from xml.sax.saxutils import quoteattr
+
+# PyPDF2 et lxml (python-docx) ne sont importés qu'à la création d'un document fusionné
+
+# Nombre de courriers par volume (fichier fusionné) pour les envois à l'imprimeur ; 0 : un seul fichier
+TAILLE_VOLUME_DEFAUT = 500
+
+# Matricule d'un document d'après son nom (voir moteur.nom_fichier_accuse)
+MATRICULE_DANS_NOM = re.compile(r"^accuseReception_(.+?)_")
+
+def matricule_du_fichier(chemin):
+    nom = os.path.splitext(os.path.basename(chemin))[0]
+    correspondance = MATRICULE_DANS_NOM.match(nom)
+    return correspondance.group(1) if correspondance else nom
+
+
+# Nom d'un signet Word d'après le matricule
+def _nom_signet(nom):
+    return re.sub(r"\W", "_", f"M_{nom}")[:40]
+
+# Volume PDF écrit au fil de l'eau : les objets de chaque courrier (pages, polices, images) sont renumérotés et écrits
+# à la suite dans le fichier dès son ajout ; seuls restent en mémoire la position de chaque objet (table xref),
+# les numéros des pages et les signets, écrits à la fermeture avec le catalogue
+class _VolumePdf:
+    CATALOGUE, PAGES, SIGNETS = 1, 2, 3
+
+    def __init__(self, chemin):
+        self.chemin = chemin
+        self._fichier = open(chemin + ".partiel", "wb")
+        self._fichier.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._positions = array("q", [-1, -1, -1])  # Position de chaque objet (numéro - 1) ; les 3 premiers écrits à la fin
+        self._pages = array("q")
+        self._signets = []  # (titre, numéro de la première page du courrier)
+
+    def _reserver(self):
+        self._positions.append(-1)
+        return len(self._positions)
+
+    def _ecrire(self, numero, objet):
+        self._positions[numero - 1] = self._fichier.tell()
+        self._fichier.write(f"{numero} 0 obj\n".encode())
+        objet.write_to_stream(self._fichier, None)
+        self._fichier.write(b"\nendobj\n")
+
+    # Ajouter toutes les pages d'un PDF ; retourne le numéro de sa première page dans le volume
+    def ajouter(self, chemin, signet):
+        from PyPDF2 import PdfReader
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+        lecteur = PdfReader(chemin)
+        pages = list(lecteur.pages)  # Attributs hérités (ressources, format) déjà recopiés dans chaque page
+        numeros = {}  # (numéro, génération) dans le courrier -> numéro dans le volume
+        a_ecrire, vus = [], set()
+        for page in pages:
+            numeros[(page.indirect_reference.idnum, page.indirect_reference.generation)] = self._reserver()
+
+        def renumeroter(objet):
+            if isinstance(objet, IndirectObject):
+                cle = (objet.idnum, objet.generation)
+                if cle not in numeros:
+                    numeros[cle] = self._reserver()
+                    a_ecrire.append(cle)
+                return IndirectObject(numeros[cle], 0, None)
+            if isinstance(objet, (DictionaryObject, ArrayObject)) and id(objet) not in vus:
+                vus.add(id(objet))
+                for cle, valeur in list(objet.items() if isinstance(objet, DictionaryObject) else enumerate(objet)):
+                    objet[cle] = renumeroter(valeur)
+            return objet
+
+        premiere_page = len(self._pages) + 1
+        for page in pages:
+            page[NameObject("/Parent")] = IndirectObject(self.PAGES, 0, None)
+            numero = numeros[(page.indirect_reference.idnum, page.indirect_reference.generation)]
+            self._ecrire(numero, renumeroter(page))
+            self._pages.append(numero)
+            while a_ecrire:
+                idnum, generation = a_ecrire.pop()
+                self._ecrire(numeros[(idnum, generation)], renumeroter(lecteur.get_object(IndirectObject(idnum, generation, lecteur))))
+        if pages:
+            self._signets.append((signet, self._pages[premiere_page - 1]))
+        return premiere_page
+
+    def fermer(self):
+        from PyPDF2.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+                                    create_string_object)
+        ref = lambda numero: IndirectObject(numero, 0, None)
+        numeros_signets = [self._reserver() for _ in self._signets]
+        for rang, ((titre, page), numero) in enumerate(zip(self._signets, numeros_signets)):
+            signet = DictionaryObject({NameObject("/Title"): create_string_object(titre), NameObject("/Parent"): ref(self.SIGNETS),
+                                       NameObject("/Dest"): ArrayObject([ref(page), NameObject("/Fit")])})
+            if rang:
+                signet[NameObject("/Prev")] = ref(numeros_signets[rang - 1])
+            if rang + 1 < len(numeros_signets):
+                signet[NameObject("/Next")] = ref(numeros_signets[rang + 1])
+            self._ecrire(numero, signet)
+        racine_signets = DictionaryObject({NameObject("/Type"): NameObject("/Outlines"), NameObject("/Count"): NumberObject(len(numeros_signets))})
+        if numeros_signets:
+            racine_signets[NameObject("/First")] = ref(numeros_signets[0])
+            racine_signets[NameObject("/Last")] = ref(numeros_signets[-1])
+        self._ecrire(self.SIGNETS, racine_signets)
+        self._ecrire(self.PAGES, DictionaryObject({NameObject("/Type"): NameObject("/Pages"), NameObject("/Count"): NumberObject(len(self._pages)),
+                                                   NameObject("/Kids"): ArrayObject(ref(numero) for numero in self._pages)}))
+        self._ecrire(self.CATALOGUE, DictionaryObject({NameObject("/Type"): NameObject("/Catalog"), NameObject("/Pages"): ref(self.PAGES),
+                                                       NameObject("/Outlines"): ref(self.SIGNETS), NameObject("/PageMode"): NameObject("/UseOutlines")}))
+        debut_xref = self._fichier.tell()
+        self._fichier.write(f"xref\n0 {len(self._positions) + 1}\n0000000000 65535 f \n".encode())
+        self._fichier.write("".join(f"{position:010d} 00000 n \n" for position in self._positions).encode())
+        self._fichier.write(f"trailer\n<< /Size {len(self._positions) + 1} /Root 1 0 R >>\nstartxref\n{debut_xref}\n%%EOF\n".encode())
+        self._fichier.close()
+        os.replace(self.chemin + ".partiel", self.chemin)
+
+    def abandonner(self):
+        self._fichier.close()
+        os.remove(self.chemin + ".partiel")
+
+# Espaces de noms des documents Word (paquet OPC)
+NS_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_RELATIONS = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_TYPES = "http://schemas.openxmlformats.org/package/2006/content-types"
+NS_WP = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+
+# Parties propres au document entier (styles, numérotations, thème...) : reprises du premier courrier du volume.
+# Les autres parties d'un courrier (en-têtes, pieds de page, images) sont recopiées avec lui
+PARTIES_COMMUNES = {"styles", "stylesWithEffects", "numbering", "settings", "theme", "fontTable", "webSettings",
+                    "customXml", "footnotes", "endnotes", "glossaryDocument", "people"}
+
+def _w(nom):
+    return f"{{{NS_W}}}{nom}"
+
+def _chemin_relations(partie):
+    dossier, nom = posixpath.split(partie)
+    return posixpath.join(dossier, "_rels", f"{nom}.rels")
+
+# Relations d'une partie d'un paquet : [(Id, Type, Target, TargetMode)]
+def _lire_relations(paquet, partie):
+    from lxml import etree
+    try:
+        contenu = paquet.read(_chemin_relations(partie))
+    except KeyError:
+        return []
+    return [(r.get("Id"), r.get("Type"), r.get("Target"), r.get("TargetMode")) for r in etree.fromstring(contenu)]
+
+def _xml_relations(relations):
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="{NS_RELATIONS}">'
+            + "".join(f'<Relationship Id={quoteattr(i)} Type={quoteattr(t)} Target={quoteattr(c)}'
+                      + (f' TargetMode={quoteattr(m)}' if m else "") + "/>" for i, t, c, m in relations)
+            + "</Relationships>").encode("utf-8")
+
+# Chemin dans le paquet de la cible d'une relation de la partie donnée
+def _cible(partie, cible):
+    return cible[1:] if cible.startswith("/") else posixpath.normpath(posixpath.join(posixpath.dirname(partie), cible))
+
+# Types de contenu d'un paquet : par extension et par partie
+def _types_contenu(paquet):
+    from lxml import etree
+    racine = etree.fromstring(paquet.read("[Content_Types].xml"))
+    defauts = {e.get("Extension").lower(): e.get("ContentType") for e in racine if e.tag == f"{{{NS_TYPES}}}Default"}
+    surcharges = {e.get("PartName").lstrip("/"): e.get("ContentType") for e in racine if e.tag == f"{{{NS_TYPES}}}Override"}
+    return defauts, surcharges
+
+# Volume Word écrit au fil de l'eau : le corps de chaque courrier est écrit dans un fichier temporaire (une section
+# par courrier, en-têtes et images recopiés, un signet par matricule), puis recopié dans le .docx à la fermeture.
+# Seul le dernier courrier reste en mémoire : sa fin de section n'est connue qu'à l'arrivée du suivant.
+# Une image ou un en-tête identique d'un courrier à l'autre (logo) n'est écrit qu'une fois
+class _VolumeWord:
+    def __init__(self, chemin, modele):
+        from lxml import etree
+        self.chemin = chemin
+        self._zip = zipfile.ZipFile(chemin + ".partiel", "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._corps = tempfile.TemporaryFile()
+        self._relations = []  # Relations de word/document.xml
+        self._copies = {}  # Empreinte d'une partie recopiée -> son nom dans le volume
+        self._nb_dessins = 0
+        self._nb_documents = 0
+        self._en_attente = None  # Dernier courrier : (éléments du corps, section)
+        self._section_finale = None
+        with zipfile.ZipFile(modele) as paquet:
+            self._defauts, surcharges = _types_contenu(paquet)
+            self._surcharges = {"word/document.xml": surcharges.get("word/document.xml")}
+            exclues = {"[Content_Types].xml", "word/document.xml", _chemin_relations("word/document.xml")}
+            for identifiant, type_relation, cible, mode in _lire_relations(paquet, "word/document.xml"):
+                if type_relation.rsplit("/", 1)[-1] in PARTIES_COMMUNES:
+                    self._relations.append((identifiant, type_relation, cible, mode))
+                elif mode != "External":
+                    exclues.update({_cible("word/document.xml", cible), _chemin_relations(_cible("word/document.xml", cible))})
+            for info in paquet.infolist():
+                if info.filename not in exclues:
+                    self._zip.writestr(info, paquet.read(info))
+                    if info.filename in surcharges:
+                        self._surcharges[info.filename] = surcharges[info.filename]
+            racine = etree.fromstring(paquet.read("word/document.xml"))
+        enveloppe = etree.Element(racine.tag, attrib=dict(racine.attrib), nsmap=racine.nsmap)
+        etree.SubElement(enveloppe, _w("body")).text = "CORPS"
+        self._debut, self._fin = etree.tostring(enveloppe, xml_declaration=True, encoding="UTF-8", standalone=True).split(b"CORPS")
+        # Déclarations d'espaces de noms déjà portées par la racine, retirées de chaque élément écrit
+        self._declarations = [f' xmlns:{prefixe}="{uri}"'.encode() for prefixe, uri in racine.nsmap.items() if prefixe]
+
+    # Recopier une partie d'un courrier (et celles qu'elle référence) dans le dossier word/fusion du volume
+    def _copier(self, paquet, partie, surcharges):
+        contenu = paquet.read(partie)
+        relations = [(identifiant, type_relation,
+                      cible if mode == "External" else posixpath.basename(self._copier(paquet, _cible(partie, cible), surcharges)), mode)
+                     for identifiant, type_relation, cible, mode in _lire_relations(paquet, partie)]
+        xml_relations = _xml_relations(relations) if relations else b""
+        empreinte = hashlib.sha256(contenu + b"\0" + xml_relations).hexdigest()
+        if empreinte not in self._copies:
+            nom = f"word/fusion/{len(self._copies) + 1}_{posixpath.basename(partie)}"
+            self._zip.writestr(nom, contenu)
+            if xml_relations:
+                self._zip.writestr(_chemin_relations(nom), xml_relations)
+            if partie in surcharges:
+                self._surcharges[nom] = surcharges[partie]
+            self._copies[empreinte] = nom
+        return self._copies[empreinte]
+
+    def ajouter(self, chemin, signet):
+        from lxml import etree
+        with zipfile.ZipFile(chemin) as paquet:
+            defauts, surcharges = _types_contenu(paquet)
+            for extension, type_contenu in defauts.items():
+                self._defauts.setdefault(extension, type_contenu)
+            identifiants = {}
+            for identifiant, type_relation, cible, mode in _lire_relations(paquet, "word/document.xml"):
+                if type_relation.rsplit("/", 1)[-1] in PARTIES_COMMUNES:
+                    continue
+                nouvel_identifiant = f"rIdF{len(self._relations) + 1}"
+                if mode != "External":
+                    cible = self._copier(paquet, _cible("word/document.xml", cible), surcharges)[len("word/"):]
+                self._relations.append((nouvel_identifiant, type_relation, cible, mode))
+                identifiants[identifiant] = nouvel_identifiant
+            corps = etree.fromstring(paquet.read("word/document.xml")).find(_w("body"))
+        for element in corps.iter():
+            for attribut, valeur in element.attrib.items():
+                if attribut.startswith(f"{{{NS_R}}}") and valeur in identifiants:
+                    element.set(attribut, identifiants[valeur])
+            if element.tag == f"{{{NS_WP}}}docPr":
+                self._nb_dessins += 1  # Identifiants des images uniques dans tout le volume
+                element.set("id", str(self._nb_dessins))
+        section = corps.find(_w("sectPr"))
+        elements = [element for element in corps if element.tag != _w("sectPr")]
+        premier = next((element for element in elements if element.tag == _w("p")), None)
+        if premier is not None:
+            self._nb_documents += 1
+            position = 1 if len(premier) and premier[0].tag == _w("pPr") else 0
+            fin = etree.Element(_w("bookmarkEnd"), {_w("id"): str(100000 + self._nb_documents)})
+            debut = etree.Element(_w("bookmarkStart"), {_w("id"): str(100000 + self._nb_documents), _w("name"): _nom_signet(signet)})
+            premier.insert(position, fin)
+            premier.insert(position, debut)
+        self._ecrire_en_attente(saut_de_section=True)
+        self._en_attente = (elements, section)
+
+    # Écrire le courrier en attente ; suivi d'un autre courrier, sa section est terminée dans son dernier paragraphe
+    # (nouvelle page), sinon elle devient la section finale du document
+    def _ecrire_en_attente(self, saut_de_section):
+        from lxml import etree
+        if self._en_attente is None:
+            return
+        elements, section = self._en_attente
+        self._en_attente = None
+        if not saut_de_section:
+            self._section_finale = section
+        elif section is not None:
+            type_section = section.find(_w("type"))
+            if type_section is not None:
+                type_section.set(_w("val"), "nextPage")
+            if not elements or elements[-1].tag != _w("p"):
+                elements.append(etree.Element(_w("p")))
+            proprietes = elements[-1].find(_w("pPr"))
+            if proprietes is None:
+                proprietes = etree.Element(_w("pPr"))
+                elements[-1].insert(0, proprietes)
+            for ancienne in proprietes.findall(_w("sectPr")):
+                proprietes.remove(ancienne)
+            proprietes.append(section)
+        for element in elements:
+            self._corps.write(self._serialiser(element))
+
+    def _serialiser(self, element):
+        from lxml import etree
+        xml = etree.tostring(element)
+        fin_balise = xml.index(b">")
+        balise = xml[:fin_balise]
+        for declaration in self._declarations:
+            balise = balise.replace(declaration, b"")
+        return balise + xml[fin_balise:]
+
+    def fermer(self):
+        self._ecrire_en_attente(saut_de_section=False)
+        self._corps.seek(0)
+        with self._zip.open("word/document.xml", "w", force_zip64=True) as f:
+            f.write(self._debut)
+            shutil.copyfileobj(self._corps, f)
+            if self._section_finale is not None:
+                f.write(self._serialiser(self._section_finale))
+            f.write(self._fin)
+        self._corps.close()
+        self._zip.writestr(_chemin_relations("word/document.xml"), _xml_relations(self._relations))
+        self._zip.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Types xmlns="{NS_TYPES}">'
+            + "".join(f'<Default Extension={quoteattr(e)} ContentType={quoteattr(t)}/>' for e, t in self._defauts.items())
+            + "".join(f'<Override PartName={quoteattr("/" + p)} ContentType={quoteattr(t)}/>' for p, t in self._surcharges.items() if t)
+            + "</Types>").encode("utf-8"))
+        self._zip.close()
+        os.replace(self.chemin + ".partiel", self.chemin)
+
+    def abandonner(self):
+        self._corps.close()
+        self._zip.close()
+        os.remove(self.chemin + ".partiel")
+
+# Fusion des courriers au fil de la génération : chaque document est ajouté au volume en cours dès qu'il est produit,
+# avec un signet (PDF) ou un signet Word par matricule, et une ligne dans l'index CSV.
+# Les volumes sont écrits sur disque au fur et à mesure (voir _VolumePdf et _VolumeWord) : la mémoire ne dépend ni
+# du nombre de courriers ni de la taille des volumes. taille_volume : courriers par volume (0 : un seul fichier).
+# ajouter(chemin) a la même forme que ArchiveZip.ajouter et s'utilise comme sur_fichier de generer_documents.
+class DocumentFusionne:
+    def __init__(self, dossier_sortie, nom_base, format_sortie="pdf", taille_volume=TAILLE_VOLUME_DEFAUT, supprimer_sources=False):
+        if format_sortie not in ("pdf", "docx"):
+            raise ValueError(f"Format de fusion inconnu : {format_sortie} (pdf ou docx)")
+        if taille_volume < 0:
+            raise ValueError(f"Taille de volume invalide : {taille_volume} (0 pour un seul fichier)")
+        try:  # Bibliothèque de fusion vérifiée dès la création, avant la génération
+            if format_sortie == "pdf":
+                import PyPDF2
+            else:
+                import lxml
+        except ImportError:
+            raise ValueError("PyPDF2 est nécessaire pour fusionner les PDF" if format_sortie == "pdf"
+                             else "lxml (python-docx) est nécessaire pour fusionner les documents Word")
+        os.makedirs(dossier_sortie, exist_ok=True)
+        self.dossier_sortie = dossier_sortie
+        self.nom_base = nom_base
+        self.format_sortie = format_sortie
+        self.taille_volume = taille_volume
+        self.supprimer_sources = supprimer_sources  # Ne garder que les volumes (les sources sont retirées une fois fusionnées)
+        self.fichiers = []  # Volumes terminés
+        self.nb_documents = 0
+        self._volume = None
+        self._nb_dans_volume = 0
+        self.chemin_index = os.path.join(dossier_sortie, f"{nom_base}_index.csv")
+        self._index = open(self.chemin_index + ".partiel", "w", newline="", encoding="utf-8-sig")
+        self._ecrivain_index = csv.writer(self._index, delimiter=";")
+        self._ecrivain_index.writerow(["volume", "rang", "page", "matricule", "document"])
+
+    def _chemin_volume(self, numero):
+        if not self.taille_volume:
+            return os.path.join(self.dossier_sortie, f"{self.nom_base}.{self.format_sortie}")
+        return os.path.join(self.dossier_sortie, f"{self.nom_base}_vol{numero:03d}.{self.format_sortie}")
+
+    def ajouter(self, chemin, signet=None):
+        signet = signet or matricule_du_fichier(chemin)
+        if self._volume is None:
+            chemin_volume = self._chemin_volume(len(self.fichiers) + 1)
+            # Volume Word : styles et mise en page repris du premier courrier
+            self._volume = _VolumePdf(chemin_volume) if self.format_sortie == "pdf" else _VolumeWord(chemin_volume, chemin)
+        page = self._volume.ajouter(chemin, signet)
+        self._nb_dans_volume += 1
+        self.nb_documents += 1
+        self._ecrivain_index.writerow([os.path.basename(self._volume.chemin), self._nb_dans_volume,
+                                       page or "", signet, os.path.basename(chemin)])
+        if self.supprimer_sources:
+            os.remove(chemin)
+        if self.taille_volume and self._nb_dans_volume >= self.taille_volume:
+            self._terminer_volume()
+
+    def _terminer_volume(self):
+        if self._volume is None:
+            return
+        self._volume.fermer()
+        self.fichiers.append(self._volume.chemin)
+        self._volume = None
+        self._nb_dans_volume = 0
+
+    def fermer(self):
+        if self._index is not None:
+            self._terminer_volume()
+            self._index.close()
+            self._index = None
+            os.replace(self.chemin_index + ".partiel", self.chemin_index)
+        return self.fichiers
+
+    # Génération interrompue : le volume en cours et l'index sont abandonnés, les volumes complets restent
+    def abandonner(self):
+        if self._index is not None:
+            if self._volume is not None:
+                self._volume.abandonner()
+                self._volume = None
+            self._index.close()
+            self._index = None
+            os.remove(self.chemin_index + ".partiel")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_exception, *exc):
+        if type_exception is None:
+            self.fermer()
+        else:
+            self.abandonner()
@@ -0,0 +1,184 @@
+import os
+import threading
+
+from archivage import archiver_fichier
+from conversion import CONVERTISSEUR_DEFAUT
+from lecture import LecteurExcel, TableLignes, importer_bibliotheques
+from modeles import ModeleJinja, ModeleTexte, charger_modele
+from moteur import TAILLE_LOT_DEFAUT, generer_documents, rendre_docxtpl, rendre_texte
+from registre import RegistreModeles, est_template
+from validation import ErreurValidation, RapportValidation, valider_lignes
+
+# Point d'entrée commun des interfaces (Streamlit, NiceGUI, script, surveillant de dossier) :
+# colonnes attendues, lecture du fichier Excel, génération des documents et archivage du fichier traité
+
+# Colonnes attendues dans les exports des impayés (noms canoniques, voir modeles.normaliser_nom_champ)
+CHAMPS_ACCUSE = [
+    "Date_Liq", "Matricule", "Identité_Allocataire", "Identité_Destinataire_bailleur",
+    "Adresse_Ligne_2", "Adresse_Ligne_3", "Adresse_Ligne_4", "Adresse_Ligne_5",
+    "Adresse_Ligne_6", "Adresse_Ligne_7",
+]
+# Colonnes supplémentaires du courrier adressé aussi à l'allocataire (template de l'application Streamlit)
+CHAMPS_ALLOCATAIRE = [
+    "Adresse_Ligne_2_Alloc", "Adresse_Ligne_3_Alloc", "Adresse_Ligne_4_Alloc", "Adresse_Ligne_5_Alloc",
+    "Adresse_Ligne_6_Alloc", "Libellé_Allocataire", "Nom_Prénom_Allocataire",
+]
+TYPES_CHAMPS = {"Date_Liq": "date", "Matricule": "entier"}
+
+# Fonctions de rendu selon la syntaxe du template, et classe de template préparé correspondante
+RENDUS = {rendre_docxtpl: ModeleJinja, rendre_texte: ModeleTexte}
+
+# Fichiers Excel à traiter (hors fichiers de verrouillage "~$..." créés par Excel)
+def est_fichier_excel(chemin):
+    nom = os.path.basename(chemin)
+    return nom.endswith((".xlsx", ".xls")) and not nom.startswith("~$")
+
+# Ouvrir un fichier Excel en lecture en flux (lève ValueError si des colonnes manquent)
+def extraire_donnees(fichier_excel, champs=CHAMPS_ACCUSE, types_champs=TYPES_CHAMPS, champs_facultatifs=()):
+    return LecteurExcel(fichier_excel, champs, types_champs=types_champs, champs_facultatifs=champs_facultatifs)
+
+# Déplacer un fichier traité vers le dossier d'archive (nom unique)
+def deplacer_fichier(fichier, dossier_archive, nom_original=None):
+    return archiver_fichier(fichier, dossier_archive, nom_original)
+
+# Génération par lots : template, colonnes et options configurés une fois, puis autant de fichiers Excel que voulu.
+# Le template préparé, le pool de processus et le convertisseur sont réutilisés d'un fichier à l'autre.
+# dossier_templates : tous les templates du dossier sont disponibles, choisis ligne par ligne (voir registre.py) ;
+# fichier_template est alors le template par défaut (facultatif)
+class GenerateurLot:
+    def __init__(self, fichier_template, champs=CHAMPS_ACCUSE, types_champs=TYPES_CHAMPS, fonction_rendu=rendre_docxtpl,
+                 convertir_pdf=False, nb_workers=None, taille_lot=TAILLE_LOT_DEFAUT, convertisseur=CONVERTISSEUR_DEFAUT,
+                 pdf_direct=False, incremental=True, dossier_archive=None, dossier_templates=None, validation=True,
+                 depot=None, budget=None):
+        self.fichier_template = fichier_template
+        self.champs = list(champs)
+        self.types_champs = types_champs
+        self.fonction_rendu = fonction_rendu
+        self.registre = None
+        if dossier_templates:
+            self.registre = RegistreModeles(dossier_templates, fichier_template, RENDUS.get(fonction_rendu, ModeleJinja))
+        self.options = {
+            "fonction_rendu": fonction_rendu, "convertir_pdf": convertir_pdf, "nb_workers": nb_workers,
+            "taille_lot": taille_lot, "convertisseur": convertisseur, "pdf_direct": pdf_direct, "incremental": incremental,
+            "budget": budget,
+        }
+        self.dossier_archive = dossier_archive
+        self.validation = validation  # Vérifier tout le fichier avant d'écrire le premier document (voir validation.py)
+        self.depot = depot  # Dépôt local : génération sur le disque local puis publication en bloc (voir publication.py)
+        self.budget = budget  # Lignes en cours partagées par les générations simultanées (voir budget.py)
+
+    # Compiler le template dans le processus appelant : une erreur de template apparaît avant la lecture du fichier.
+    # Avec un registre, le dossier est parcouru à nouveau (templates ajoutés ou modifiés depuis le dernier fichier)
+    def preparer(self):
+        if self.registre is not None:
+            self.registre.decouvrir()
+            if not self.fichier_template:
+                return None
+        return charger_modele(self.fichier_template, RENDUS.get(self.fonction_rendu, ModeleJinja))
+
+    # Préparer le template et charger les bibliothèques de lecture en tâche de fond, pendant que l'interface s'affiche
+    def prechauffer(self):
+        def prechauffage():
+            try:
+                self.preparer()
+            except Exception:
+                pass  # Template absent ou invalide : l'erreur sera signalée par la génération elle-même
+            importer_bibliotheques()
+        fil = threading.Thread(target=prechauffage, name="prechauffage", daemon=True)
+        fil.start()
+        return fil
+
+    # Avec un registre, la colonne de type de courrier est lue si le fichier la contient
+    def ouvrir(self, fichier_excel):
+        champs_facultatifs = [self.registre.champ_type] if self.registre is not None else ()
+        return extraire_donnees(fichier_excel, self.champs, self.types_champs, champs_facultatifs)
+
+    # Templates dont dépend le résultat d'un fichier : template par défaut et tous ceux du dossier des templates
+    def fichiers_templates(self):
+        fichiers = set()
+        if self.fichier_template and os.path.isfile(self.fichier_template):
+            fichiers.add(os.path.abspath(self.fichier_template))
+        if self.registre is not None and os.path.isdir(self.registre.dossier):
+            fichiers.update(os.path.abspath(os.path.join(self.registre.dossier, nom))
+                            for nom in os.listdir(self.registre.dossier) if est_template(nom))
+        return sorted(fichiers)
+
+    def _selecteur(self, nom_fichier):
+        return self.registre.selecteur(os.path.basename(nom_fichier) if nom_fichier else None)
+
+    # Choix du template de chaque ligne d'un fichier Excel, le même que pour la génération (aperçu du premier courrier) :
+    # registre parcouru à nouveau, sinon fichier_template pour toutes les lignes
+    def choisir_template(self, nom_fichier=None):
+        if self.registre is None:
+            return lambda donnees: self.fichier_template
+        self.registre.decouvrir()
+        return self._selecteur(nom_fichier)
+
+    # Vérifier un fichier Excel (chemin : seules les colonnes contrôlées sont gardées en mémoire) ou des lignes
+    # déjà chargées (TableLignes), sans rien générer : rapport de tous les problèmes trouvés (voir validation.py)
+    def valider(self, source, nom_fichier=None):
+        if self.registre is not None:
+            self.registre.decouvrir()
+        if isinstance(source, str):
+            try:
+                lecteur = self.ouvrir(source)
+            except ValueError as e:
+                rapport = RapportValidation(nom_fichier or source)
+                rapport.ajouter(str(e))  # Colonnes manquantes : les lignes ne peuvent pas être vérifiées
+                return rapport
+            colonnes = lecteur.colonnes
+            controlees = [c for c in colonnes if c == "Matricule" or c in self.types_champs
+                          or (self.registre is not None and c == self.registre.champ_type)]
+            table = lecteur.charger(controlees or colonnes[:1])
+        else:
+            table, colonnes = source, list(source.positions)
+        nom_fichier = nom_fichier or table.fichier_excel
+        rapport = valider_lignes(
+            table, colonnes, self.fichier_template, RENDUS.get(self.fonction_rendu, ModeleJinja), self.types_champs,
+            self._selecteur(nom_fichier) if self.registre is not None else None,
+            self.registre.champ_type if self.registre is not None else None,
+            self.options["convertisseur"] if self.options["convertir_pdf"] else None, self.options["pdf_direct"])
+        rapport.fichier = nom_fichier or ""
+        return rapport
+
+    # Générer les documents d'un fichier Excel (chemin) ou de lignes déjà lues ; les options de generer_documents
+    # (progression, annulation, sur_fichier, taille_lot...) peuvent être précisées pour cet appel.
+    # nom_fichier : nom du fichier Excel d'origine pour le choix du template, si source n'est pas un chemin.
+    # Un fichier Excel est d'abord vérifié en entier sur les seules colonnes contrôlées : ErreurValidation (rien n'est
+    # écrit) s'il a un problème bloquant, sinon il est relu en flux pour la génération (mémoire stable, premier
+    # document écrit sans attendre la fin de la lecture). Des lignes déjà chargées (TableLignes) sont vérifiées telles quelles.
+    # Avec un dépôt local, les documents sont publiés dans dossier_sortie à la fin du lot (chemins finaux dans le résultat)
+    def generer(self, source, dossier_sortie, suffixe, nom_fichier=None, validation=None, **options):
+        lignes = self.ouvrir(source) if isinstance(source, str) else source
+        if self.validation if validation is None else validation:
+            if isinstance(lignes, LecteurExcel):
+                rapport = self.valider(lignes.fichier_excel, nom_fichier)
+            elif isinstance(lignes, TableLignes):
+                rapport = self.valider(lignes, nom_fichier)
+            else:
+                rapport = None  # Itérable de lignes : déjà vérifié par l'appelant
+            if rapport is not None and not rapport.valide:
+                if isinstance(lignes, LecteurExcel):
+                    lignes.fermer()
+                raise ErreurValidation(rapport)
+        self.preparer()
+        if self.registre is not None:
+            options["choisir_template"] = self._selecteur(nom_fichier or getattr(lignes, "fichier_excel", None))
+        lot = self.depot.ouvrir(dossier_sortie) if self.depot is not None else None
+        try:
+            resultat = generer_documents(self.fichier_template, lot.dossier if lot else dossier_sortie, lignes, suffixe,
+                                         **{**self.options, **options, **(lot.options() if lot else {})})
+        except BaseException:
+            if lot is not None:
+                lot.abandonner()
+            raise
+        finally:
+            if isinstance(lignes, LecteurExcel):
+                lignes.fermer()
+        if lot is not None:
+            emplacements = lot.publier()
+            resultat.fichiers = [emplacements.get(fichier, fichier) for fichier in resultat.fichiers]
+        return resultat
+
+    def archiver(self, fichier, nom_original=None):
+        return deplacer_fichier(fichier, self.dossier_archive, nom_original)
@@ -0,0 +1,218 @@
+import time
+import zipfile
+from collections.abc import Mapping
+
+from modeles import normaliser_nom_champ
+
+# Nombre de lignes lues puis normalisées ensemble (en colonnes, avec pandas)
+TAILLE_BLOC_LECTURE = 500
+
+# Format des dates dans les documents
+FORMAT_DATE = "%d/%m/%Y"
+
+# Nettoyage par défaut des noms de colonnes : même nom canonique que les balises des templates
+nettoyer_entete = normaliser_nom_champ
+
+# pandas et openpyxl ne sont importés qu'à la première lecture : les interfaces s'affichent sans les attendre.
+# importer_bibliotheques() les charge d'avance, en tâche de fond pendant l'affichage de l'interface
+def importer_bibliotheques():
+    import pandas
+    import openpyxl
+
+# Normaliser un bloc de lignes colonne par colonne : valeurs vides, dates et nombres convertis en texte
+# types_champs associe à un champ "date", "entier" ou "texte" (par défaut : texte, dates reconnues à leur type)
+def normaliser_bloc(df, types_champs=None):
+    import pandas as pd
+    types_champs = types_champs or {}
+    for colonne in df.columns:
+        serie = df[colonne]
+        vide = serie.isna()
+        type_champ = types_champs.get(colonne, "texte")
+        if type_champ == "date" or pd.api.types.is_datetime64_any_dtype(serie):
+            # Dates écrites en texte : ISO (2024-03-04) lues année-mois-jour, les autres jour en premier (04/03/2024)
+            texte_iso = serie.map(lambda v: isinstance(v, str)).astype(bool) & serie.astype(str).str.match(r"\s*\d{4}-\d{1,2}-\d{1,2}")
+            dates = pd.to_datetime(serie.where(~texte_iso), errors="coerce", dayfirst=True, format="mixed")
+            if texte_iso.any():
+                dates[texte_iso] = pd.to_datetime(serie[texte_iso].str.strip(), errors="coerce", format="ISO8601")
+            texte = dates.dt.strftime(FORMAT_DATE).where(dates.notna(), serie.astype(str))
+        elif type_champ == "entier":
+            # Seuls les nombres lus comme tels (1234.0) sont ramenés à un entier ; un texte reste tel quel ("0042")
+            nombres = pd.to_numeric(serie.where(~serie.map(lambda v: isinstance(v, str)).astype(bool)), errors="coerce")
+            entiers = nombres.notna() & (nombres % 1 == 0)
+            texte = serie.astype(str)
+            texte[entiers] = nombres[entiers].astype("int64").astype(str)
+        else:
+            texte = serie.astype(str)
+        df[colonne] = texte.where(~vide, "")
+    return df
+
+# Ligne d'un fichier Excel : vue en lecture seule sur un tuple de valeurs. Les noms de colonnes (et leur position)
+# sont partagés par toutes les lignes du fichier au lieu d'être répétés dans un dictionnaire par ligne.
+# S'utilise comme un dict (get, [], items...) par les templates, le manifeste et les interfaces
+class Ligne(Mapping):
+    __slots__ = ("_positions", "_valeurs")
+
+    def __init__(self, positions, valeurs):
+        self._positions = positions
+        self._valeurs = valeurs
+
+    def __getitem__(self, champ):
+        return self._valeurs[self._positions[champ]]
+
+    def get(self, champ, defaut=None):
+        position = self._positions.get(champ)
+        return defaut if position is None else self._valeurs[position]
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __repr__(self):
+        return f"Ligne({dict(self)!r})"
+
+    # Envoi aux processus de génération : les positions, communes à un lot, ne sont transmises qu'une fois par lot
+    def __reduce__(self):
+        return Ligne, (self._positions, self._valeurs)
+
+# Lignes d'un fichier gardées en mémoire par colonnes (une liste de valeurs par champ) : nombre de lignes,
+# accès par numéro et parcours sans créer un dictionnaire par ligne (voir LecteurExcel.charger)
+class TableLignes:
+    def __init__(self, colonnes, fichier_excel=None):
+        self.fichier_excel = fichier_excel  # Fichier d'origine (choix du template, rapports)
+        self.positions = {champ: i for i, champ in enumerate(colonnes)}
+        self.valeurs = [[] for _ in colonnes]
+
+    def etendre(self, colonnes_valeurs):
+        for colonne, valeurs in zip(self.valeurs, colonnes_valeurs):
+            colonne.extend(valeurs)
+
+    def colonne(self, champ):
+        return self.valeurs[self.positions[champ]]
+
+    def __len__(self):
+        return len(self.valeurs[0]) if self.valeurs else 0
+
+    def __getitem__(self, index):
+        return Ligne(self.positions, tuple(colonne[index] for colonne in self.valeurs))
+
+    def __iter__(self):
+        for valeurs in zip(*self.valeurs):
+            yield Ligne(self.positions, valeurs)
+
+# Lecture en flux d'un fichier Excel : l'en-tête est normalisé et vérifié une seule fois à l'ouverture,
+# puis seules les colonnes attendues sont lues (par position) au fil de l'itération, par blocs normalisés en texte.
+# champs_facultatifs : colonnes lues si le fichier les contient (type de courrier...), sans erreur si elles manquent
+class LecteurExcel:
+    def __init__(self, fichier_excel, champs_attendus, normaliser_entete=nettoyer_entete, types_champs=None, champs_facultatifs=()):
+        self.fichier_excel = fichier_excel
+        self.champs_attendus = [normaliser_entete(champ) for champ in champs_attendus]
+        self.champs_facultatifs = [normaliser_entete(champ) for champ in champs_facultatifs]
+        self.types_champs = types_champs
+        self.normaliser_entete = normaliser_entete
+        self.total = None  # Nombre de lignes annoncé par le classeur (estimation, peut rester inconnu)
+        self._classeur = None
+        self.durees = {"lecture": 0.0, "normalisation": 0.0}  # Secondes cumulées, hors traitement des lignes par l'appelant
+
+        if not zipfile.is_zipfile(fichier_excel):
+            # Ancien format binaire .xls non lisible en flux par openpyxl : lecture pandas des seules colonnes utiles
+            import pandas as pd
+            entetes = [normaliser_entete(c) for c in pd.read_excel(fichier_excel, nrows=0).columns]
+            self._verifier_entetes(entetes)
+        else:
+            from openpyxl import load_workbook
+            self._classeur = load_workbook(fichier_excel, read_only=True, data_only=True)
+            feuille = self._classeur.active
+            premiere_ligne = next(feuille.iter_rows(max_row=1, values_only=True), ())
+            entetes = [normaliser_entete(c) if c is not None else "" for c in premiere_ligne]
+            try:
+                self._verifier_entetes(entetes)
+            except ValueError:
+                self.fermer()
+                raise
+            if feuille.max_row:
+                self.total = max(feuille.max_row - 1, 0)
+
+    def _verifier_entetes(self, entetes):
+        champs_manquants = [champ for champ in self.champs_attendus if champ not in entetes]
+        if champs_manquants:
+            raise ValueError(f"Champs manquants : {', '.join(champs_manquants)}")
+        self.colonnes = self.champs_attendus + [champ for champ in self.champs_facultatifs
+                                                if champ in entetes and champ not in self.champs_attendus]
+        self.indices = [entetes.index(champ) for champ in self.colonnes]
+        self.positions = {champ: i for i, champ in enumerate(self.colonnes)}  # Partagées par les lignes lues
+
+    def fermer(self):
+        if self._classeur is not None:
+            self._classeur.close()
+            self._classeur = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fermer()
+
+    # Lignes du fichier une à une (vues Ligne), lues et normalisées par blocs
+    def __iter__(self):
+        blocs = self._blocs()
+        try:
+            for colonnes in blocs:
+                for valeurs in zip(*colonnes):
+                    yield Ligne(self.positions, valeurs)
+        finally:
+            blocs.close()
+
+    # Tout le fichier en mémoire, par colonnes : nombre de lignes exact et parcours répété sans relire le fichier.
+    # champs : seulement ces colonnes (vérification du fichier entier sans garder les autres en mémoire)
+    def charger(self, champs=None):
+        champs = list(champs) if champs is not None else self.colonnes
+        positions = [self.positions[champ] for champ in champs]
+        table = TableLignes(champs, self.fichier_excel)
+        for colonnes in self._blocs():
+            table.etendre([colonnes[position] for position in positions])
+        return table
+
+    # Blocs de lignes normalisés, chacun sous forme d'une liste de valeurs par colonne (dans l'ordre de self.colonnes)
+    def _blocs(self):
+        if self._classeur is None:
+            yield from self._blocs_pandas()
+            return
+        import pandas as pd
+        try:
+            feuille = self._classeur.active
+            bloc = []
+            debut = time.perf_counter()
+            for valeurs in feuille.iter_rows(min_row=2, values_only=True):
+                ligne = [valeurs[i] if i < len(valeurs) else None for i in self.indices]
+                if any(v is not None for v in ligne):  # Ignore les lignes vides (mises en forme en fin de feuille)
+                    bloc.append(ligne)
+                if len(bloc) == TAILLE_BLOC_LECTURE:
+                    self.durees["lecture"] += time.perf_counter() - debut
+                    yield self._colonnes(pd.DataFrame(bloc, columns=self.colonnes))
+                    bloc = []
+                    debut = time.perf_counter()
+            self.durees["lecture"] += time.perf_counter() - debut
+            if bloc:
+                yield self._colonnes(pd.DataFrame(bloc, columns=self.colonnes))
+        finally:
+            self.fermer()
+
+    def _blocs_pandas(self):
+        import pandas as pd
+        debut = time.perf_counter()
+        df = pd.read_excel(self.fichier_excel, usecols=self.indices)
+        # pandas rend les colonnes dans l'ordre du fichier : elles sont renommées d'après leur position
+        df.columns = [self.colonnes[k] for k in sorted(range(len(self.indices)), key=self.indices.__getitem__)]
+        df = df[self.colonnes].dropna(how="all")
+        self.durees["lecture"] += time.perf_counter() - debut
+        for debut in range(0, len(df), TAILLE_BLOC_LECTURE):
+            yield self._colonnes(df.iloc[debut:debut + TAILLE_BLOC_LECTURE].copy())
+
+    def _colonnes(self, bloc):
+        debut = time.perf_counter()
+        bloc = normaliser_bloc(bloc, self.types_champs)
+        colonnes = [bloc[champ].tolist() for champ in self.colonnes]
+        self.durees["normalisation"] += time.perf_counter() - debut
+        return colonnes
@@ -1,74 +1,62 @@
-from nicegui import ui, events
+import time
+DEBUT = time.perf_counter()  # Référence du délai de démarrage (voir mesures.premiere_fenetre)
+
+from nicegui import app, ui, events
 import os
-import pandas as pd
-from datetime import date, datetime
-from docxtpl import DocxTemplate
-from PyPDF2 import PdfReader
-import shutil
+import sys
+from datetime import date
 import tempfile
-import platform
+import multiprocessing
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from apercu import apercu_texte, cle_apercu
+from archivage import espace_travail
+from generateur import CHAMPS_ACCUSE, GenerateurLot
+from mesures import premiere_fenetre
+from publication import depot_local
+from resultats import CacheResultats, cle_resultat
+from validation import ErreurValidation
 
 # Configuration des chemins
 DOSSIER_BASE = os.path.join(os.path.expanduser("~"), "OneDrive - Cafdoc", "Documents", "DEVS", "Appli_Accuse_Reception")
 definir_chemin = lambda *chemins: os.path.join(DOSSIER_BASE, *chemins)
-SYSTEME = platform.system()
-preview_pdf_active = SYSTEME == "Windows"
+
+# Nombre maximal de fichiers traités en même temps sur l'instance partagée (les suivants attendent leur tour)
+MAX_TRAVAUX_SIMULTANES = int(os.environ.get("ACCUSE_MAX_TRAVAUX", "2"))
+executeur_travaux = ThreadPoolExecutor(max_workers=MAX_TRAVAUX_SIMULTANES)
+limite_travaux = asyncio.Semaphore(MAX_TRAVAUX_SIMULTANES)
+
+# Lots plus petits qu'en traitement de masse pour une barre de progression fluide
+TAILLE_LOT_INTERACTIF = 10
+
+# Générateur commun, configuré une fois pour tous les fichiers déposés (templates préparés gardés en cache) :
+# tous les templates du dossier sont disponibles, celui-ci est utilisé quand la ligne n'indique pas de type de courrier.
+# Les documents sont produits sur le disque local puis publiés en bloc dans le dossier OneDrive (voir publication.py)
+TEMPLATE_WORD = definir_chemin("template", "13. Accusé de réception déclaration d'impayés.docx")
+generateur_lot = GenerateurLot(TEMPLATE_WORD, CHAMPS_ACCUSE, taille_lot=TAILLE_LOT_INTERACTIF, dossier_archive=definir_chemin("archive"),
+                               dossier_templates=definir_chemin("template"), depot=depot_local("nicegui", defaut="dossier"))
+
+# Résultats partagés par toutes les sessions : un fichier identique déjà traité le même jour n'est ni relu ni régénéré
+cache_resultats = CacheResultats(definir_chemin("accuse_recep"))
+
+# Aperçus texte en cache sur le disque local, par fichier téléversé et template
+DOSSIER_APERCUS = os.path.join(tempfile.gettempdir(), "accuse_reception_apercus")
 
 # Vérifier ou créer les dossiers nécessaires
 def verifier_et_creer_repertoires():
     for dossier in ["template", "accuse_recep", "archive"]:
         os.makedirs(definir_chemin(dossier), exist_ok=True)
 
-# Déplacer fichier vers dossier archive
-def deplacer_fichier(temp_path, nom_original):
-    archive_path = definir_chemin("archive", nom_original)
-    if os.path.exists(archive_path):
-        base, ext = os.path.splitext(archive_path)
-        i = 1
-        while os.path.exists(f"{base}_{i}{ext}"):
-            i += 1
-        archive_path = f"{base}_{i}{ext}"
-    shutil.move(temp_path, archive_path)
-
-# Extraire données
-def extraire_donnees(fichier_excel, champs_attendus):
-    df = pd.read_excel(fichier_excel)
-    df.columns = [col.strip().replace(' ', '_') for col in df.columns]
-    champs_manquants = [champ for champ in champs_attendus if champ not in df.columns]
-    if champs_manquants:
-        raise ValueError(f"Champs manquants : {', '.join(champs_manquants)}")
-    return df[champs_attendus].to_dict(orient="records")
-
-# Remplir les templates Word
-def remplir_template(fichier_template, dossier_sortie, donnees_liste, dateDuJour):
-    os.makedirs(dossier_sortie, exist_ok=True)
-    premier_fichier = None
-    for i, donnees in enumerate(donnees_liste):
-        tpl = DocxTemplate(fichier_template)
-        for cle, valeur in donnees.items():
-            if pd.isna(valeur):
-                donnees[cle] = ""
-            elif isinstance(valeur, (datetime, pd.Timestamp)):
-                donnees[cle] = valeur.strftime("%d/%m/%Y")
-            else:
-                donnees[cle] = str(valeur)
-
-        tpl.render(donnees)
-        matricule = str(donnees.get("Matricule", f"{i+1}")).strip()
-        fichier_sortie = os.path.join(dossier_sortie, f"accuseReception_{matricule}_{dateDuJour.replace('/', '-')}.docx")
-        tpl.save(fichier_sortie)
-        if i == 0:
-            premier_fichier = fichier_sortie
-    return premier_fichier
-
-# Convertir le Word en texte pour affichage
-def lire_contenu_word(docx_path):
+# Aperçu texte de la première ligne, avec le template que la génération lui choisira (type de courrier, nom du
+# fichier), rendu avant le traitement complet (None si le fichier est illisible)
+def preparer_apercu(temp_path, octets, nom_fichier):
     try:
-        import docx
-        doc = docx.Document(docx_path)
-        return '\n\n'.join([para.text for para in doc.paragraphs])
-    except:
-        return "(Impossible de lire le contenu)"
+        return apercu_texte(cle_apercu(octets, generateur_lot.fichiers_templates(), nom_fichier),
+                            lambda: generateur_lot.ouvrir(temp_path), generateur_lot.choisir_template(nom_fichier),
+                            DOSSIER_APERCUS)
+    except Exception:
+        return None  # L'erreur sera signalée par le traitement lui-même
 
 # Configuration du thème et styles personnalisés
 def setup_custom_styles():
@@ -171,8 +159,7 @@ def afficher_preview(contenu, output_container):
             with ui.scroll_area().classes('h-96 w-full'):
                 ui.textarea(value=contenu, readonly=True, placeholder='Contenu du document...').classes('w-full min-h-full bg-white border-0 text-sm leading-relaxed')
 
-def afficher_statistiques(donnees, output_container):
-    nb_documents = len(donnees)
+def afficher_statistiques(nb_documents, output_container):
     with output_container:
         with ui.card().classes('card-shadow p-6 mb-4 bg-gradient-to-r from-purple-500 to-pink-500 text-white'):
             with ui.row().classes('w-full items-center justify-between'):
@@ -181,33 +168,154 @@ def afficher_statistiques(donnees, output_container):
                     ui.label(str(nb_documents)).classes('text-3xl font-bold')
                 ui.icon('description', size='3rem').classes('opacity-80')
 
-def handle_upload(e: events.UploadEventArguments):
-    output.clear()
-    afficher_message("🔄 Traitement du fichier en cours...", 'processing', output)
+# État d'un traitement, partagé entre le thread de génération et l'interface
+class Travail:
+    def __init__(self):
+        self.nb_traites = 0
+        self.total = None
+        self.annulation = threading.Event()
+
+    def progression(self, nb_traites, total):
+        self.nb_traites = nb_traites
+        self.total = total
+
+    def annuler(self):
+        self.annulation.set()
+
+def afficher_progression(travail, output_container):
+    with output_container:
+        with ui.card().classes('card-shadow p-4 mb-4 bg-gradient-to-r from-yellow-400 to-orange-500 text-white'):
+            with ui.row().classes('w-full items-center gap-4'):
+                ui.icon('hourglass_empty').classes('pulse-animation text-2xl')
+                libelle = ui.label('🔄 Traitement du fichier en cours...').classes('text-lg font-medium')
+                ui.button('Annuler', icon='cancel', on_click=travail.annuler).props('flat color=white')
+            barre = ui.linear_progress(value=0, show_value=False).classes('mt-2')
+
+        def actualiser():
+            if travail.annulation.is_set():
+                libelle.text = '⏹️ Annulation en cours...'
+            elif travail.total:
+                barre.value = min(travail.nb_traites / travail.total, 1)
+                libelle.text = f'🔄 Documents générés : {travail.nb_traites} / {travail.total}'
+            elif travail.nb_traites:
+                libelle.text = f'🔄 Documents générés : {travail.nb_traites}'
+
+        return ui.timer(0.5, actualiser)
+
+# Clé du résultat d'un fichier téléversé : contenu du fichier, templates et jour (suffixe et dossier de sortie)
+def cle_fichier(octets):
+    return cle_resultat(octets, generateur_lot.fichiers_templates(), champs=CHAMPS_ACCUSE,
+                        suffixe=date.today().strftime("%d-%m-%Y"))
+
+# Traitement complet d'un fichier, exécuté hors de la boucle d'événements de NiceGUI.
+# Retourne (resultat, dossier_sortie, entree) ; resultat vaut None si un traitement identique (même clé, lancé
+# entre-temps par une autre session) a déjà produit les documents : son entrée de cache est alors retournée
+def traiter_fichier(temp_path, nom_fichier, travail, cle):
     dateDuJour = date.today().strftime("%d/%m/%Y")
-    template_word = definir_chemin("template", "13. Accusé de réception déclaration d'impayés.docx")
     dossier_sortie = definir_chemin("accuse_recep", f"accuses_reception_{dateDuJour.replace('/', '-')}")
-    champs_attendus = ["Date_Liq", "Matricule", "Identité_Allocataire", "Identité_Destinataire_bailleur", "Adresse_Ligne_2", "Adresse_Ligne_3", "Adresse_Ligne_4", "Adresse_Ligne_5", "Adresse_Ligne_6", "Adresse_Ligne_7"]
-    try:
-        temp_path = os.path.join(tempfile.gettempdir(), e.name)
+    with cache_resultats.verrou(cle):
+        entree = cache_resultats.chercher(cle)
+        if entree:
+            return None, entree["dossier"], entree
+        resultat = generateur_lot.generer(temp_path, dossier_sortie, dateDuJour.replace('/', '-'),
+                                          progression=travail.progression, annulation=travail.annulation)
+        if not resultat.annule:  # Fichier non traité en entier : il n'est pas archivé
+            generateur_lot.archiver(temp_path, nom_fichier)
+            # Avec des lignes en erreur, les documents ne sont pas réutilisés mais restent soumis à l'éviction
+            cache_resultats.enregistrer(cle, dossier_sortie, resultat.fichiers, reutilisable=not resultat.erreurs,
+                                        nb_documents=len(resultat.fichiers) + resultat.ignores)
+    return resultat, dossier_sortie, entree
+
+# Fichier identique déjà traité : les documents existants sont réutilisés, rien n'est relu ni régénéré
+def afficher_deja_traite(entree, output_container):
+    nb_documents = entree["infos"]["nb_documents"]
+    afficher_statistiques(nb_documents, output_container)
+    afficher_message(f"♻️ Fichier déjà traité le {entree['date'].replace('T', ' à ')} : {nb_documents} document(s) "
+                     f"dans le dossier :\n{entree['dossier']}", 'info', output_container)
+
+async def handle_upload(e: events.UploadEventArguments, output):
+    output.clear()
+    travail = Travail()
+    if limite_travaux.locked():
+        afficher_message("⏳ D'autres traitements sont en cours, le fichier est en file d'attente...", 'info', output)
+    with espace_travail("accuse_upload_") as dossier_travail:
+        # Fichier téléversé dans un espace propre à ce traitement : deux envois du même nom ne s'écrasent pas
+        temp_path = os.path.join(dossier_travail, os.path.basename(e.name))
+        octets = e.content.read()
         with open(temp_path, "wb") as f:
-            f.write(e.content.read())
-        donnees = extraire_donnees(temp_path, champs_attendus)
-        premier_fichier = remplir_template(template_word, dossier_sortie, donnees, dateDuJour)
-        deplacer_fichier(temp_path, e.name)
-        output.clear()
-        afficher_statistiques(donnees, output)
-        afficher_message(f"✅ {len(donnees)} document(s) généré(s) avec succès dans le dossier :\n{dossier_sortie}", 'success', output)
-        if premier_fichier:
-            contenu = lire_contenu_word(premier_fichier)
+            f.write(octets)
+        # L'aperçu n'attend pas la fin du lot (ni son tour dans la file) : il est affiché dès qu'il est prêt
+        boucle = asyncio.get_running_loop()
+        contenu = await boucle.run_in_executor(None, preparer_apercu, temp_path, octets, e.name)
+        if contenu is not None:
+            afficher_preview(contenu, output)
+        # Déjà traité (même contenu, par cette session ou une autre) : pas de passage par la file d'attente
+        cle = await boucle.run_in_executor(None, cle_fichier, octets)
+        entree = await boucle.run_in_executor(None, cache_resultats.chercher, cle)
+        if entree:
+            output.clear()
+            afficher_deja_traite(entree, output)
+            if contenu is not None:
+                afficher_preview(contenu, output)
+            return
+        async with limite_travaux:
+            output.clear()
+            minuteur = afficher_progression(travail, output)
+            if contenu is not None:
+                afficher_preview(contenu, output)
+            try:
+                resultat, dossier_sortie, entree = await boucle.run_in_executor(
+                    executeur_travaux, traiter_fichier, temp_path, e.name, travail, cle)
+            except ErreurValidation as err:
+                # Fichier vérifié en entier avant la génération : aucun document écrit, tous les problèmes listés
+                output.clear()
+                afficher_message(f"🚫 Fichier non traité, à corriger : {err.rapport.fichier}", 'error', output)
+                for message in err.rapport.erreurs:
+                    afficher_message(f"❌ {message}", 'error', output)
+                return
+            except Exception as err:
+                output.clear()
+                afficher_message(f"❌ Erreur lors du traitement : {str(err)}", 'error', output)
+                return
+            finally:
+                minuteur.deactivate()
+
+    output.clear()
+    if resultat is None:
+        afficher_deja_traite(entree, output)
+        if contenu is not None:
             afficher_preview(contenu, output)
-    except Exception as err:
-        output.clear()
-        afficher_message(f"❌ Erreur lors du traitement : {str(err)}", 'error', output)
+        return
+    afficher_statistiques(len(resultat.fichiers), output)
+    if resultat.annule:
+        afficher_message(f"⏹️ Traitement annulé : {len(resultat.fichiers)} document(s) généré(s) dans le dossier :\n{dossier_sortie}", 'info', output)
+    else:
+        afficher_message(f"✅ {len(resultat.fichiers)} document(s) généré(s) avec succès dans le dossier :\n{dossier_sortie}", 'success', output)
+    if resultat.ignores:
+        afficher_message(f"⏭️ {resultat.ignores} document(s) déjà à jour, non régénéré(s)", 'info', output)
+    for message in resultat.messages_erreurs():
+        afficher_message(f"❌ {message}", 'error', output)
+    if contenu is not None:
+        afficher_preview(contenu, output)
+
+# Une interface par client : chaque utilisateur suit ses propres traitements
+@ui.page('/')
+def page_principale():
+    upload, output = create_main_interface()
+    upload.on_upload(lambda e: handle_upload(e, output))
+    ui.page_title('Générateur d\'Accusés de Réception')
+    ui.add_head_html('<link rel="icon" href="data:image/svg+xml,<svg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 100 100%22><text y=%22.9em%22 font-size=%2290%22>📄</text></svg>">')
+
+# Serveur prêt : délai de démarrage enregistré, puis template et bibliothèques de lecture préparés en tâche de fond
+# (le premier fichier déposé n'attend plus leur chargement)
+def au_demarrage():
+    premiere_fenetre("nicegui", DEBUT)
+    generateur_lot.prechauffer()
 
-upload, output = create_main_interface()
-upload.on_upload(handle_upload)
-ui.page_title('Générateur d\'Accusés de Réception')
-ui.add_head_html('<link rel="icon" href="data:image/svg+xml,<svg xmlns=%22http://www.w3.org/2000/svg%22 viewBox=%220 0 100 100%22><text y=%22.9em%22 font-size=%2290%22>📄</text></svg>">')
-ui.run(title="Générateur d'Accusés de Réception", favicon='📄', host='0.0.0.0', port=8080)
+app.on_startup(au_demarrage)
 
+if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Nécessaire pour le pool de processus dans l'exécutable PyInstaller (avant sa création)
+# Pas de rechargement automatique dans l'exécutable : il relancerait tout le script dans un second processus
+ui.run(title="Générateur d'Accusés de Réception", favicon='📄', host='0.0.0.0', port=8080,
+       reload=not getattr(sys, "frozen", False))
@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import threading
+
+# Nom du manifeste, un par dossier de sortie
+NOM_MANIFESTE = ".manifeste.jsonl"
+
+_verrou_ecriture = threading.Lock()
+
+# Manifeste d'un dossier de sortie : pour chaque document, l'empreinte des données et du template qui l'ont produit.
+# Une nouvelle génération saute les lignes dont le document existe déjà et n'a pas changé.
+# dossier_publication : dossier où les documents sont publiés après la génération (voir publication.py),
+# où un document déjà produit est aussi cherché
+class Manifeste:
+    def __init__(self, dossier_sortie, dossier_publication=None):
+        self.dossier_sortie = dossier_sortie
+        self.dossiers_documents = [dossier for dossier in (dossier_sortie, dossier_publication) if dossier]
+        self.chemin = os.path.join(dossier_sortie, NOM_MANIFESTE)
+        self.entrees = {}
+        if os.path.exists(self.chemin):
+            with open(self.chemin, encoding="utf-8") as f:
+                for ligne in f:
+                    try:
+                        entree = json.loads(ligne)
+                    except ValueError:
+                        continue  # Ligne tronquée par un arrêt brutal : le document sera régénéré
+                    self.entrees[entree["cle"]] = entree  # La dernière entrée d'une clé fait foi
+
+    # Empreinte d'une ligne : valeurs des champs + empreinte du template + mode de rendu
+    @staticmethod
+    def empreinte(donnees, empreinte_modele, mode_rendu):
+        contenu = json.dumps([empreinte_modele, mode_rendu, sorted(donnees.items())], ensure_ascii=False, default=str)
+        return hashlib.sha256(contenu.encode("utf-8")).hexdigest()
+
+    # Nom du document déjà produit pour cette clé et cette empreinte, s'il existe toujours
+    def fichier_a_jour(self, cle, empreinte):
+        entree = self.entrees.get(cle)
+        if entree and entree["empreinte"] == empreinte:
+            for dossier in self.dossiers_documents:
+                fichier = os.path.join(dossier, entree["fichier"])
+                if os.path.exists(fichier):
+                    return fichier
+        return None
+
+    # Ajouter des entrées (cle, matricule, empreinte, fichier) à la suite du manifeste
+    def enregistrer(self, entrees):
+        if not entrees:
+            return
+        lignes = []
+        for cle, matricule, empreinte, fichier in entrees:
+            entree = {"cle": cle, "matricule": matricule, "empreinte": empreinte, "fichier": os.path.basename(fichier)}
+            self.entrees[cle] = entree
+            lignes.append(json.dumps(entree, ensure_ascii=False) + "\n")
+        with _verrou_ecriture, open(self.chemin, "a", encoding="utf-8") as f:
+            f.write("".join(lignes))
@@ -0,0 +1,143 @@
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Dossier local des mesures : journal structuré (JSON Lines) et fichier de métriques au format Prometheus
+DOSSIER_MESURES = os.environ.get("ACCUSE_DOSSIER_MESURES") or os.path.join(
+    os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "Appli_Accuse_Reception", "mesures")
+FICHIER_JOURNAL = "generation.jsonl"
+FICHIER_METRIQUES = "metriques.prom"
+
+# Étapes mesurées pour chaque lot de génération
+ETAPES = ("lecture", "normalisation", "rendu", "enregistrement", "conversion", "archive")
+
+# Objectif de délai entre le lancement d'une interface et l'affichage de sa première fenêtre (secondes)
+OBJECTIF_PREMIERE_FENETRE = float(os.environ.get("ACCUSE_OBJECTIF_DEMARRAGE", "2"))
+
+journal = logging.getLogger("accuse_reception")
+_verrou = threading.Lock()
+_configure = False
+
+# Compteurs cumulés depuis le démarrage du processus et jauges courantes, exportés dans metriques.prom
+_compteurs = {}
+_jauges = {}
+
+# Une ligne JSON par événement : {"horodatage", "niveau", "evenement", ...champs}
+class FormatJson(logging.Formatter):
+    def format(self, record):
+        evenement = {
+            "horodatage": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "niveau": record.levelname,
+            "evenement": record.getMessage(),
+            "pid": record.process,
+        }
+        evenement.update(getattr(record, "champs", {}))
+        return json.dumps(evenement, ensure_ascii=False, default=str)
+
+def _configurer():
+    global _configure
+    with _verrou:
+        if _configure:
+            return
+        os.makedirs(DOSSIER_MESURES, exist_ok=True)
+        gestionnaire = logging.handlers.RotatingFileHandler(
+            os.path.join(DOSSIER_MESURES, FICHIER_JOURNAL), maxBytes=50 * 1024 * 1024, backupCount=5, encoding="utf-8")
+        gestionnaire.setFormatter(FormatJson())
+        journal.addHandler(gestionnaire)
+        journal.setLevel(logging.INFO)
+        journal.propagate = False
+        _configure = True
+
+# Écrire un événement structuré dans le journal
+def evenement(nom, **champs):
+    _configurer()
+    journal.info(nom, extra={"champs": champs})
+
+def _cle(nom, etiquettes):
+    return nom, tuple(sorted(etiquettes.items()))
+
+def incrementer(nom, valeur=1, **etiquettes):
+    with _verrou:
+        cle = _cle(nom, etiquettes)
+        _compteurs[cle] = _compteurs.get(cle, 0) + valeur
+
+def definir_jauge(nom, valeur, **etiquettes):
+    with _verrou:
+        _jauges[_cle(nom, etiquettes)] = valeur
+
+# Réécrire le fichier de métriques (remplacement atomique : un collecteur ne lit jamais un fichier à moitié écrit)
+def ecrire_metriques():
+    _configurer()
+    lignes = []
+    with _verrou:
+        for type_metrique, valeurs in (("counter", _compteurs), ("gauge", _jauges)):
+            for nom in sorted({cle[0] for cle in valeurs}):
+                lignes.append(f"# TYPE {nom} {type_metrique}")
+                for (nom_valeur, etiquettes), valeur in sorted(valeurs.items()):
+                    if nom_valeur == nom:
+                        texte_etiquettes = ",".join(f'{k}="{v}"' for k, v in etiquettes)
+                        lignes.append(f"{nom}{{{texte_etiquettes}}} {valeur}" if etiquettes else f"{nom} {valeur}")
+        chemin = os.path.join(DOSSIER_MESURES, FICHIER_METRIQUES)
+        chemin_temporaire = f"{chemin}.{os.getpid()}.tmp"
+        with open(chemin_temporaire, "w", encoding="utf-8") as f:
+            f.write("\n".join(lignes) + "\n")
+        os.replace(chemin_temporaire, chemin)
+
+# Délai de démarrage d'une interface, depuis debut (time.perf_counter() relevé en tête du script), comparé à l'objectif
+def premiere_fenetre(interface, debut):
+    duree = time.perf_counter() - debut
+    evenement("premiere_fenetre", interface=interface, duree=round(duree, 3), objectif=OBJECTIF_PREMIERE_FENETRE,
+              objectif_atteint=duree <= OBJECTIF_PREMIERE_FENETRE)
+    definir_jauge("accuse_premiere_fenetre_secondes", round(duree, 3), interface=interface)
+    ecrire_metriques()
+    return duree
+
+# Mesures d'un lot de génération : durée cumulée par étape et compteurs de lignes
+class MesuresLot:
+    def __init__(self, **contexte):
+        self.contexte = contexte
+        self.debut = time.perf_counter()
+        self.durees = dict.fromkeys(ETAPES, 0.0)
+        self.lignes = 0
+        self.documents = 0
+        self.erreurs = 0
+        self.ignores = 0
+
+    def ajouter(self, etape, duree):
+        self.durees[etape] += duree
+
+    @contextmanager
+    def etape(self, nom):
+        debut = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.ajouter(nom, time.perf_counter() - debut)
+
+    # Durées d'un document (secondes) : une ligne de journal par document
+    def document(self, ligne, matricule, erreur=False, **durees):
+        evenement("document", ligne=ligne, matricule=matricule, erreur=erreur, **{k: round(v, 4) for k, v in durees.items()})
+
+    # Fin du lot : événement de synthèse dans le journal et mise à jour des métriques
+    def terminer(self):
+        duree_totale = time.perf_counter() - self.debut
+        evenement("lot_termine", duree=round(duree_totale, 3), lignes=self.lignes, documents=self.documents,
+                  erreurs=self.erreurs, ignores=self.ignores,
+                  etapes={k: round(v, 3) for k, v in self.durees.items()}, **self.contexte)
+        incrementer("accuse_lots_total")
+        incrementer("accuse_lignes_total", self.lignes)
+        incrementer("accuse_documents_total", self.documents)
+        incrementer("accuse_erreurs_total", self.erreurs)
+        incrementer("accuse_lignes_ignorees_total", self.ignores)
+        for etape, duree in self.durees.items():
+            incrementer("accuse_etape_secondes_total", round(duree, 4), etape=etape)
+            definir_jauge("accuse_dernier_lot_etape_secondes", round(duree, 4), etape=etape)
+        definir_jauge("accuse_dernier_lot_secondes", round(duree_totale, 4))
+        definir_jauge("accuse_dernier_lot_lignes", self.lignes)
+        definir_jauge("accuse_dernier_lot_horodatage", int(time.time()))
+        ecrire_metriques()
@@ -0,0 +1,200 @@
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+
+# python-docx, docxtpl et jinja2 ne sont importés qu'à la préparation du premier template (démarrage plus rapide)
+
+# Parties du paquet Word susceptibles de contenir des balises Jinja (corps, en-têtes, pieds de page, notes, propriétés)
+PARTIES_JINJA = re.compile(r"^(word/(document|header\d*|footer\d*|footnotes)\.xml|docProps/core\.xml)$")
+
+# Balises {%tc ... %} : elles demandent la correction des tableaux de docxtpl, non gérée par le rendu préparé
+BALISE_COLONNE = re.compile(r"\{%-?\s*tc\s")
+
+# Cache des templates préparés, par chemin et type de template (un cache par processus), borné :
+# au-delà de TAILLE_CACHE_MODELES templates, le moins récemment utilisé est libéré
+TAILLE_CACHE_MODELES = int(os.environ.get("ACCUSE_CACHE_MODELES", "32"))
+_cache_modeles = OrderedDict()
+_verrou_cache = threading.Lock()
+
+# Empreinte SHA-256 du contenu d'un template
+def empreinte_octets(octets):
+    return hashlib.sha256(octets).hexdigest()
+
+# Empreinte d'un fichier template, recalculée seulement si sa date de modification ou sa taille a changé
+_empreintes_fichiers = {}
+
+def empreinte_fichier(chemin):
+    stat = os.stat(chemin)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cle = os.path.abspath(chemin)
+    entree = _empreintes_fichiers.get(cle)
+    if entree is None or entree[0] != signature:
+        with open(chemin, "rb") as f:
+            entree = (signature, empreinte_octets(f.read()))
+        _empreintes_fichiers[cle] = entree
+    return entree[1]
+
+# Template docxtpl préparé une seule fois : parties du paquet gardées en mémoire, XML nettoyé et compilé par Jinja
+class ModeleJinja:
+    def __init__(self, chemin, octets, empreinte):
+        from docxtpl import DocxTemplate
+        from jinja2 import Environment, meta
+        self.chemin = chemin
+        self.octets = octets
+        self.empreinte = empreinte
+        self._outils = DocxTemplate(io.BytesIO(octets))  # Réutilisé pour patch_xml / resolve_listing
+        self._secours = False
+        self.parties = []
+        self.champs = set()  # Variables utilisées par le template (hors variables définies dans le template)
+
+        environnement = Environment(autoescape=True)
+        with zipfile.ZipFile(io.BytesIO(octets)) as paquet:
+            for info in paquet.infolist():
+                contenu = paquet.read(info)
+                if PARTIES_JINJA.match(info.filename):
+                    xml = self._outils.patch_xml(contenu.decode("utf-8"))
+                    if BALISE_COLONNE.search(xml):
+                        self._secours = True
+                    if "{{" in xml or "{%" in xml:
+                        xml = re.sub(r"<w:p([ >])", r"\n<w:p\1", xml)
+                        arbre = environnement.parse(xml)  # Analysé une fois : champs relevés puis compilation
+                        self.champs |= meta.find_undeclared_variables(arbre)
+                        contenu = environnement.from_string(arbre)
+                self.parties.append((info, contenu))
+
+    # Même post-traitement que DocxTemplate.render_xml_part
+    def _finaliser_xml(self, xml):
+        xml = re.sub(r"\n<w:p([ >])", r"<w:p\1", xml)
+        xml = xml.replace("{_{", "{{").replace("}_}", "}}").replace("{_%", "{%").replace("%_}", "%}")
+        return self._outils.resolve_listing(xml).encode("utf-8")
+
+    # Rendu puis écriture du document ; renvoie la durée de chacune des deux étapes (secondes)
+    def enregistrer(self, contexte, fichier_sortie):
+        debut = time.perf_counter()
+        if self._secours:
+            from docxtpl import DocxTemplate
+            tpl = DocxTemplate(io.BytesIO(self.octets))
+            tpl.render(contexte, autoescape=True)
+            milieu = time.perf_counter()
+            tpl.save(fichier_sortie)
+            return {"rendu": milieu - debut, "enregistrement": time.perf_counter() - milieu}
+
+        parties = [(info, contenu if isinstance(contenu, bytes) else self._finaliser_xml(contenu.render(contexte)))
+                   for info, contenu in self.parties]
+        milieu = time.perf_counter()
+        with zipfile.ZipFile(fichier_sortie, "w", zipfile.ZIP_DEFLATED) as paquet:
+            for info, contenu in parties:
+                paquet.writestr(info, contenu)
+        return {"rendu": milieu - debut, "enregistrement": time.perf_counter() - milieu}
+
+# Balise de substitution {{ champ }} (espaces facultatifs autour du nom)
+BALISE_CHAMP = re.compile(r"\{\{\s*([^{}]+?)\s*\}\}")
+
+# Nom canonique d'un champ, commun aux en-têtes Excel et aux balises des templates : "Date Liq" -> "Date_Liq"
+def normaliser_nom_champ(nom):
+    return re.sub(r"\s+", "_", str(nom).strip())
+
+# Parties du paquet Word dont les paragraphes sont indexés : corps (tableaux compris), en-têtes et pieds de page
+TYPES_PARTIES_TEXTE = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.header+xml",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.footer+xml",
+}
+
+# Découper le texte d'un paragraphe en segments par run : texte fixe (str) ou champ (nom, balise d'origine)
+# Une balise coupée sur plusieurs runs est remplacée dans le run où elle commence, avec sa mise en forme
+def _indexer_paragraphe(paragraphe):
+    from docx.text.run import Run
+    runs = [Run(r, None) for r in paragraphe.xpath("./w:r | ./w:hyperlink/w:r")]
+    textes = [run.text for run in runs]
+    texte = "".join(textes)
+    balises = list(BALISE_CHAMP.finditer(texte)) if "{{" in texte else []
+    if not balises:
+        return []
+
+    bornes = []
+    debut = 0
+    for texte_run in textes:
+        bornes.append((debut, debut + len(texte_run)))
+        debut += len(texte_run)
+    segments = [[] for _ in runs]
+    modifies = set()
+
+    def repartir(a, b):
+        for i, (debut_run, fin_run) in enumerate(bornes):
+            if debut_run < b and a < fin_run:
+                segments[i].append(texte[max(a, debut_run):min(b, fin_run)])
+
+    curseur = 0
+    for balise in balises:
+        repartir(curseur, balise.start())
+        for i, (debut_run, fin_run) in enumerate(bornes):
+            if debut_run < balise.end() and balise.start() < fin_run:
+                modifies.add(i)
+            if debut_run <= balise.start() < fin_run:
+                segments[i].append((normaliser_nom_champ(balise.group(1)), balise.group(0)))
+        curseur = balise.end()
+    repartir(curseur, len(texte))
+
+    return [(runs[i], segments[i]) for i in sorted(modifies)]
+
+# Template python-docx à balises {{ champ }} : les runs contenant des balises sont indexés au chargement,
+# puis chaque document ne réécrit que ces runs, en une passe et sans perdre leur mise en forme
+class ModeleTexte:
+    def __init__(self, chemin, octets, empreinte):
+        from docx import Document
+        from docx.oxml.ns import qn
+        self.chemin = chemin
+        self.empreinte = empreinte
+        self.document = Document(io.BytesIO(octets))
+        self._verrou = threading.Lock()  # Le document est partagé : un seul rendu à la fois
+        self.runs = []
+        for part in self.document.part.package.iter_parts():
+            if part.content_type in TYPES_PARTIES_TEXTE:
+                for paragraphe in part.element.iter(qn("w:p")):
+                    self.runs.extend(_indexer_paragraphe(paragraphe))
+
+    @property
+    def champs(self):
+        return {segment[0] for _, segments in self.runs for segment in segments if isinstance(segment, tuple)}
+
+    def enregistrer(self, contexte, fichier_sortie):
+        with self._verrou:
+            debut = time.perf_counter()
+            for run, segments in self.runs:
+                run.text = "".join(
+                    segment if isinstance(segment, str) else contexte.get(segment[0], segment[1])
+                    for segment in segments
+                )
+            milieu = time.perf_counter()
+            self.document.save(fichier_sortie)
+            return {"rendu": milieu - debut, "enregistrement": time.perf_counter() - milieu}
+
+# Charger un template préparé depuis le cache, en le reconstruisant si le fichier a changé (date de modification ou contenu)
+def charger_modele(chemin, classe=ModeleJinja):
+    stat = os.stat(chemin)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cle = (os.path.abspath(chemin), classe)
+    with _verrou_cache:
+        entree = _cache_modeles.get(cle)
+        if entree and entree[0] == signature:
+            _cache_modeles.move_to_end(cle)
+            return entree[1]
+
+        with open(chemin, "rb") as f:
+            octets = f.read()
+        empreinte = empreinte_octets(octets)
+        if entree and entree[1].empreinte == empreinte:
+            modele = entree[1]  # Fichier touché mais contenu identique : on garde la version compilée
+        else:
+            modele = classe(chemin, octets, empreinte)
+        _cache_modeles[cle] = (signature, modele)
+        _cache_modeles.move_to_end(cle)
+        while len(_cache_modeles) > TAILLE_CACHE_MODELES:
+            _cache_modeles.popitem(last=False)
+        return modele
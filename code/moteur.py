@@ -0,0 +1,364 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from archivage import espace_travail, publier_fichier
+from conversion import CONVERTISSEUR_DEFAUT, chemin_pdf
+from manifeste import Manifeste
+from mesures import MesuresLot, evenement
+from modeles import ModeleTexte, charger_modele, empreinte_fichier
+from pdf_direct import HorsGabarit, preparer_fond, rendre_pdf_direct
+from registre import identifiant_modele
+
+# Nombre de processus de génération : variable d'environnement ACCUSE_NB_WORKERS, sinon (absente ou invalide) un par cœur
+def _nb_workers_defaut():
+    try:
+        nb_workers = int(os.environ.get("ACCUSE_NB_WORKERS", "0"))
+    except ValueError:
+        nb_workers = 0
+    return nb_workers if nb_workers > 0 else os.cpu_count() or 1
+
+NB_WORKERS_DEFAUT = _nb_workers_defaut()
+
+# Nombre de lignes confiées à un processus en une seule tâche (rendu, enregistrement puis conversion groupée)
+TAILLE_LOT_DEFAUT = 50
+
+# Pools de processus partagés entre les lots successifs pour ne pas relancer les workers à chaque fichier.
+# Un pool par nombre de workers demandé : deux générations simultanées de réglages différents (sessions Streamlit)
+# ont chacune le leur, et un pool encore utilisé n'est jamais arrêté
+_pools = {}
+_verrou_pool = threading.Lock()
+
+# Résultat d'une génération : fichiers produits dans l'ordre des lignes et erreurs ligne par ligne
+class ResultatGeneration:
+    def __init__(self, total):
+        self.total = total
+        self.fichiers = []
+        self.erreurs = []  # Liste de (numéro de ligne, matricule, message)
+        self.annule = False
+        self.ignores = 0  # Lignes déjà à jour dans le dossier de sortie, non régénérées
+        self.mesures = None  # Durées par étape et compteurs du lot (voir mesures.MesuresLot)
+
+    @property
+    def premier_fichier(self):
+        return self.fichiers[0] if self.fichiers else None
+
+    # Messages d'erreur prêts à afficher, un par ligne en échec
+    def messages_erreurs(self):
+        return [f"Ligne {ligne} (matricule {matricule or '?'}) : {message}" for ligne, matricule, message in self.erreurs]
+
+# Nom de fichier déterministe : matricule de la ligne, sinon son numéro, puis type de courrier s'il n'est pas
+# celui du template par défaut (un même matricule peut recevoir plusieurs types de courrier, voir registre.py)
+def nom_fichier_accuse(donnees, index, suffixe, type_courrier=None):
+    matricule = str(donnees.get("Matricule", "") or f"{index + 1}").strip()
+    if type_courrier:
+        return f"accuseReception_{matricule}_{type_courrier}_{suffixe}"
+    return f"accuseReception_{matricule}_{suffixe}"
+
+# Rendu d'un document au format docxtpl à partir du template préparé (chargé une fois par processus)
+def rendre_docxtpl(fichier_template, donnees, fichier_sortie):
+    return charger_modele(fichier_template).enregistrer(donnees, fichier_sortie)
+
+# Rendu d'un document à balises {{ champ }} simples, en conservant la mise en forme des runs (voir modeles.ModeleTexte)
+def rendre_texte(fichier_template, donnees, fichier_sortie):
+    return charger_modele(fichier_template, ModeleTexte).enregistrer(donnees, fichier_sortie)
+
+# Traitement d'un lot de lignes dans un processus : rendu, enregistrement puis conversion PDF groupée
+# lot : (index, données, template, nom du document, rendu PDF direct) par ligne, préparé par generer_documents
+# Les valeurs des lignes sont déjà normalisées en texte (voir lecture.normaliser_bloc)
+# Renvoie les lignes traitées et leurs durées : rendu / enregistrement par document, conversion pour tout le lot
+# Rendu PDF direct (voir pdf_direct.py) pour les lignes dont le template s'y prête ; hors gabarit, Word + conversion
+# Le lot est produit dans un espace de travail du dossier de sortie : chaque document n'y apparaît, par renommage,
+# qu'une fois terminé (jamais de fichier à moitié écrit, même si plusieurs traitements visent le même dossier)
+def _traiter_lot(fonction_rendu, dossier_sortie, convertir_pdf, lot, convertisseur=CONVERTISSEUR_DEFAUT):
+    resultats = {}
+    fichiers_docx = {}
+    durees = {"documents": {}, "conversion": 0.0}
+    with espace_travail(".lot_", dossier_sortie) as espace:
+        for index, donnees, fichier_template, nom, direct in lot:
+            matricule = donnees.get("Matricule", "")
+            fichier_docx = os.path.join(espace, nom + ".docx")
+            if direct:
+                fichier_pdf = chemin_pdf(fichier_docx, espace)
+                try:
+                    durees["documents"][index] = rendre_pdf_direct(fichier_template, donnees, fichier_pdf)
+                    resultats[index] = (matricule, fichier_pdf, None)
+                    continue
+                except HorsGabarit:
+                    pass
+            try:
+                debut = time.perf_counter()
+                durees_document = fonction_rendu(fichier_template, donnees, fichier_docx)
+                # Une fonction de rendu qui ne distingue pas les étapes est comptée entièrement en rendu
+                durees["documents"][index] = durees_document or {"rendu": time.perf_counter() - debut}
+                fichiers_docx[index] = fichier_docx
+                resultats[index] = (matricule, fichier_docx, None)
+            except Exception as e:
+                resultats[index] = (matricule, None, f"Erreur de génération : {e}")
+
+        if convertir_pdf and fichiers_docx:
+            debut = time.perf_counter()
+            erreurs = convertisseur(fichiers_docx.values(), espace)
+            durees["conversion"] = time.perf_counter() - debut
+            for index, fichier_docx in fichiers_docx.items():
+                matricule = resultats[index][0]
+                if fichier_docx in erreurs:
+                    resultats[index] = (matricule, None, f"Erreur de conversion PDF avec LibreOffice : {erreurs[fichier_docx]}")
+                else:
+                    resultats[index] = (matricule, chemin_pdf(fichier_docx, espace), None)
+
+        # Publication du lot : les documents terminés sont renommés dans le dossier de sortie
+        # (chaque nom est unique dans la génération : les lignes de même nom sont écartées par generer_documents)
+        for index, (matricule, fichier, erreur) in resultats.items():
+            if fichier:
+                try:
+                    resultats[index] = (matricule, publier_fichier(fichier, os.path.join(dossier_sortie, os.path.basename(fichier))), None)
+                except OSError as e:
+                    resultats[index] = (matricule, None, f"Erreur de publication : {e}")
+
+    return [(index, *resultats[index]) for index, *_ in lot], durees
+
+def _obtenir_pool(nb_workers):
+    with _verrou_pool:
+        if nb_workers not in _pools:
+            _pools[nb_workers] = ProcessPoolExecutor(max_workers=nb_workers)
+        return _pools[nb_workers]
+
+# Pool cassé (worker tombé) : remplacé au prochain lot, sauf s'il l'a déjà été par une autre génération
+def _oublier_pool(nb_workers, pool):
+    with _verrou_pool:
+        if _pools.get(nb_workers) is pool:
+            del _pools[nb_workers]
+
+# Lancer un lot dans le pool ; un pool cassé entre-temps par une autre génération est remplacé une fois
+def _soumettre(nb_workers, *args):
+    pool = _obtenir_pool(nb_workers)
+    try:
+        return pool, pool.submit(_traiter_lot, *args)
+    except BrokenProcessPool:
+        _oublier_pool(nb_workers, pool)
+        pool = _obtenir_pool(nb_workers)
+        return pool, pool.submit(_traiter_lot, *args)
+
+# Découper un itérable de lignes en lots numérotés, au fur et à mesure de la lecture
+def _lots(donnees_liste, taille_lot):
+    lot = []
+    for index, donnees in enumerate(donnees_liste):
+        lot.append((index, donnees))
+        if len(lot) == taille_lot:
+            yield lot
+            lot = []
+    if lot:
+        yield lot
+
+# Clé d'identification du rendu dans le manifeste : fonction de rendu et format de sortie
+def _mode_rendu(fonction_rendu, convertir_pdf):
+    return f"{fonction_rendu.__module__}.{fonction_rendu.__qualname__}:{'pdf' if convertir_pdf else 'docx'}"
+
+# Générer tous les documents en répartissant les lignes sur plusieurs processus
+# donnees_liste peut être une liste ou un itérable lu en flux : au plus 2 lots par worker sont en mémoire à la fois
+# progression(nb_traites, total) est appelée dans le processus appelant à chaque lot terminé (total peut être None)
+# annulation (threading.Event) arrête la génération : plus aucun lot n'est lancé et les lots en attente sont abandonnés
+# incremental : les lignes dont le document existe déjà avec les mêmes données et le même template sont sautées
+# sur_fichier(chemin) est appelée dans l'ordre des lignes pour chaque document disponible (archive zip au fil de l'eau...)
+# convertisseur : fonction de conversion PDF par lot (voir conversion.CONVERTISSEURS)
+# pdf_direct : avec convertir_pdf, produit les PDF sans passer par Word quand le template s'y prête (voir pdf_direct.py)
+# dossier_publication : dossier final où les documents seront publiés après la génération (voir publication.py),
+# où les documents déjà à jour sont aussi cherchés
+# choisir_template(donnees) donne le template de chaque ligne (voir registre.RegistreModeles.selecteur) ; il lève
+# ValueError si aucun ne convient (ligne en erreur). Sans choisir_template, toutes les lignes utilisent fichier_template
+# budget (budget.BudgetLignes) : nombre de lignes en cours partagé avec les autres générations simultanées
+# Les durées de chaque étape sont journalisées et publiées à la fin (voir mesures.py) et restent dans resultat.mesures
+def generer_documents(fichier_template, dossier_sortie, donnees_liste, suffixe, fonction_rendu=rendre_docxtpl,
+                      convertir_pdf=False, nb_workers=None, taille_lot=TAILLE_LOT_DEFAUT, progression=None,
+                      annulation=None, incremental=True, sur_fichier=None, convertisseur=CONVERTISSEUR_DEFAUT,
+                      pdf_direct=False, choisir_template=None, dossier_publication=None, budget=None):
+    os.makedirs(dossier_sortie, exist_ok=True)
+    nb_workers = max(1, nb_workers or NB_WORKERS_DEFAUT)
+    total = len(donnees_liste) if hasattr(donnees_liste, "__len__") else getattr(donnees_liste, "total", None)
+    resultat = ResultatGeneration(0)
+    manifeste = Manifeste(dossier_sortie, dossier_publication) if incremental else None
+    mode_rendu = _mode_rendu(fonction_rendu, convertir_pdf)
+
+    # Templates rencontrés : empreinte, mode de rendu et type de courrier, calculés une fois par template
+    # (le fond PDF direct est préparé à la première ligne qui utilise le template)
+    modeles = {}
+
+    def decrire_modele(chemin):
+        if chemin not in modeles:
+            mode = mode_rendu
+            if convertir_pdf and pdf_direct:
+                try:
+                    preparer_fond(chemin, convertisseur)
+                    mode += ":direct"
+                except ValueError as e:
+                    evenement("pdf_direct_indisponible", template=chemin, raison=str(e))
+            modeles[chemin] = (empreinte_fichier(chemin) if incremental else None, mode,
+                               None if fichier_template and os.path.abspath(chemin) == os.path.abspath(fichier_template)
+                               else identifiant_modele(chemin))
+        return modeles[chemin]
+
+    if fichier_template:
+        mode_rendu = decrire_modele(fichier_template)[1]
+    mesures = resultat.mesures = MesuresLot(dossier_sortie=dossier_sortie, mode_rendu=mode_rendu, nb_workers=nb_workers)
+
+    # Numéro de la ligne qui a pris chaque nom de document : deux lignes de même nom (matricule en double, génération
+    # sans vérification) écriraient le même fichier, la seconde est mise en erreur avant le rendu
+    lignes_par_nom = {}
+
+    # Choisir le template de chaque ligne, puis séparer les lignes déjà à jour d'après le manifeste de celles à (re)générer
+    def preparer(lot):
+        a_generer, deja_faits, empreintes = [], [], {}
+        for index, donnees in lot:
+            try:
+                chemin = choisir_template(donnees) if choisir_template else fichier_template
+            except ValueError as e:
+                deja_faits.append((index, donnees.get("Matricule", ""), None, str(e)))
+                continue
+            empreinte_modele, mode, type_courrier = decrire_modele(chemin)
+            cle = nom_fichier_accuse(donnees, index, suffixe, type_courrier)
+            if cle in lignes_par_nom:
+                deja_faits.append((index, donnees.get("Matricule", ""), None,
+                                   f"Document {cle} déjà produit par la ligne {lignes_par_nom[cle]} (matricule en double)"))
+                continue
+            lignes_par_nom[cle] = index + 1
+            if manifeste is None:
+                a_generer.append((index, donnees, chemin, cle, mode.endswith(":direct")))
+                continue
+            empreinte = Manifeste.empreinte(donnees, empreinte_modele, mode)
+            fichier = manifeste.fichier_a_jour(cle, empreinte)
+            if fichier:
+                deja_faits.append((index, donnees.get("Matricule", ""), fichier, None))
+            else:
+                a_generer.append((index, donnees, chemin, cle, mode.endswith(":direct")))
+                empreintes[index] = (cle, empreinte)
+        return a_generer, deja_faits, empreintes
+
+    def enregistrer(lignes_lot, deja_faits, empreintes, durees=None):
+        if durees:
+            mesures.ajouter("conversion", durees["conversion"])
+            for index, matricule, fichier, erreur in lignes_lot:
+                durees_document = durees["documents"].get(index, {})
+                for etape, duree in durees_document.items():
+                    mesures.ajouter(etape, duree)
+                mesures.document(index + 1, matricule, erreur=bool(erreur), **durees_document)
+        if manifeste is not None:
+            manifeste.enregistrer([(empreintes[index][0], matricule, empreintes[index][1], fichier)
+                                   for index, matricule, fichier, erreur in lignes_lot if not erreur])
+        for index, matricule, fichier, erreur in sorted(lignes_lot + deja_faits, key=lambda r: r[0]):
+            if erreur:
+                resultat.erreurs.append((index + 1, matricule, erreur))
+            else:
+                resultat.fichiers.append(fichier)
+                if sur_fichier:
+                    with mesures.etape("archive"):
+                        sur_fichier(fichier)
+        resultat.ignores += sum(1 for *_, erreur in deja_faits if not erreur)  # Hors lignes sans template
+        resultat.total += len(lignes_lot) + len(deja_faits)
+        if progression:
+            progression(resultat.total, max(total, resultat.total) if total is not None else None)
+
+    def terminer():
+        mesures.lignes = resultat.total
+        mesures.documents = len(resultat.fichiers) - resultat.ignores
+        mesures.erreurs = len(resultat.erreurs)
+        mesures.ignores = resultat.ignores
+        for etape, duree in getattr(donnees_liste, "durees", {}).items():
+            mesures.ajouter(etape, duree)  # Lecture et normalisation mesurées par le lecteur Excel
+        mesures.contexte["annule"] = resultat.annule
+        mesures.terminer()
+        return resultat
+
+    def est_annule():
+        if annulation is not None and annulation.is_set():
+            resultat.annule = True
+        return resultat.annule
+
+    # Budget de lignes partagé (voir budget.py) : lots ramenés à la taille du budget, place d'un lot réservée avant
+    # sa lecture et rendue une fois le lot enregistré. reservees : lignes encore réservées par cet appel
+    reservees = 0
+    if budget is not None:
+        taille_lot = min(taille_lot, budget.max_lignes)
+
+    def reserver(attendre=True):
+        nonlocal reservees
+        if budget is None:
+            return True
+        if not budget.reserver(taille_lot, attendre, annulation):
+            return False
+        reservees += taille_lot
+        return True
+
+    def liberer(nb):
+        nonlocal reservees
+        if budget is not None and nb:
+            budget.liberer(nb)
+            reservees -= nb
+
+    def recuperer(pool, tache, a_generer, deja_faits, empreintes, nb_lignes):
+        try:
+            if tache is None:
+                enregistrer([], deja_faits, empreintes)
+                return
+            try:
+                lignes_lot, durees = tache.result()
+            except Exception as e:
+                # Un worker tombé ne doit pas interrompre les autres lots
+                if isinstance(e, BrokenProcessPool):
+                    _oublier_pool(nb_workers, pool)
+                enregistrer([(index, str(donnees.get("Matricule", "")), None, f"Erreur du processus de génération : {e}")
+                             for index, donnees, *_ in a_generer], deja_faits, empreintes)
+                return
+            enregistrer(lignes_lot, deja_faits, empreintes, durees)
+        finally:
+            liberer(nb_lignes)
+
+    lots = _lots(donnees_liste, taille_lot)
+    try:
+        if nb_workers == 1:
+            while not est_annule() and reserver():
+                lot = next(lots, None)
+                if lot is None:
+                    liberer(taille_lot)
+                    break
+                liberer(taille_lot - len(lot))
+                a_generer, deja_faits, empreintes = preparer(lot)
+                lignes_lot, durees = _traiter_lot(fonction_rendu, dossier_sortie, convertir_pdf, a_generer, convertisseur) if a_generer else ([], None)
+                enregistrer(lignes_lot, deja_faits, empreintes, durees)
+                liberer(len(lot))
+            return terminer()
+
+        # File bornée entre la lecture et les processus (rendu puis conversion de chaque lot) : au plus 2 lots par
+        # worker et, avec un budget, seulement les lots qui y tiennent. Budget plein : les lots déjà lancés par cet
+        # appel sont récupérés d'abord (ils rendent leur place) ; sans lot lancé, la lecture attend la place rendue
+        # par les autres fichiers. Les résultats sont récupérés dans l'ordre des lots : les fichiers restent dans l'ordre des lignes
+        en_cours = deque()
+        while not est_annule():
+            while not reserver(attendre=not en_cours) and not est_annule():
+                recuperer(*en_cours.popleft())
+            if resultat.annule:
+                break
+            lot = next(lots, None)
+            if lot is None:
+                liberer(taille_lot)
+                break
+            liberer(taille_lot - len(lot))
+            a_generer, deja_faits, empreintes = preparer(lot)
+            pool = tache = None
+            if a_generer:
+                pool, tache = _soumettre(nb_workers, fonction_rendu, dossier_sortie, convertir_pdf, a_generer, convertisseur)
+            en_cours.append((pool, tache, a_generer, deja_faits, empreintes, len(lot)))
+            if len(en_cours) >= 2 * nb_workers:
+                recuperer(*en_cours.popleft())
+        while en_cours:
+            pool, tache, a_generer, deja_faits, empreintes, nb_lignes = en_cours.popleft()
+            if est_annule() and (tache is None or tache.cancel()):
+                liberer(nb_lignes)
+                continue
+            recuperer(pool, tache, a_generer, deja_faits, empreintes, nb_lignes)
+        return terminer()
+    finally:
+        liberer(reservees)
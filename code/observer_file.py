@@ -1,61 +1,189 @@
 import os
 import time
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from datetime import date
-from traitement import deplacer_fichier, extraire_donnees, remplir_template
+from file_attente import FileAttente
+from budget import BudgetLignes
+from mesures import definir_jauge, ecrire_metriques, evenement, incrementer
+from generateur import CHAMPS_ACCUSE, TYPES_CHAMPS, GenerateurLot, est_fichier_excel
+from moteur import rendre_texte
+from publication import depot_local
+
+# Nombre de fichiers Excel traités en même temps par le surveillant
+NB_TRAVAUX_SIMULTANES = int(os.environ.get("ACCUSE_MAX_TRAVAUX", "2"))
+
+# Nombre maximal de lignes en cours (lues et pas encore enregistrées), tous fichiers confondus : au-delà,
+# la lecture des fichiers attend que des lots se terminent (voir budget.py)
+MAX_LIGNES_EN_COURS = int(os.environ.get("ACCUSE_MAX_LIGNES_EN_COURS", "1000"))
 
 # Fonction pour définir les chemins dynamiquement
 def definir_chemins():
     base_dir = os.path.join(os.path.expanduser("~"), "OneDrive - Cafdoc", "Documents", "DEVS", "Appli_Accuse_Reception")
+    # La file d'attente reste sur le disque local : une base SQLite ne doit pas être synchronisée par OneDrive
+    dossier_local = os.path.join(os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "Appli_Accuse_Reception")
     return {
         "dossier_a_surveiller": os.path.join(base_dir, "a traiter"),
         "template_word": os.path.join(base_dir, "template", "13. Accusé de réception déclaration d'impayés.docx"),
         "dossier_sortie": os.path.join(base_dir, "accuse_recep", f"accuses_reception_{date.today().strftime('%d-%m-%Y')}"),
-        "dossier_traite": os.path.join(base_dir, "archive")
+        "dossier_traite": os.path.join(base_dir, "archive"),
+        "file_attente": os.path.join(dossier_local, "file_attente.sqlite3")
     }
 
+# Ralentissement d'une ressource (lignes, fichiers), signalé à son début et à sa fin : console, journal et métriques
+class Ralentissement:
+    def __init__(self, ressource, message):
+        self.ressource = ressource
+        self.message = message
+        self.debut = None
+
+    def mettre_a_jour(self, actif, **details):
+        if actif and self.debut is None:
+            self.debut = time.perf_counter()
+            print(f"⏳ {self.message.format(**details)}")
+            evenement("ralentissement_debut", ressource=self.ressource, **details)
+            incrementer("accuse_ralentissements_total", ressource=self.ressource)
+        elif not actif and self.debut is not None:
+            duree = round(time.perf_counter() - self.debut, 3)
+            self.debut = None
+            print(f"▶️ Fin du ralentissement ({self.ressource}) après {duree} s")
+            evenement("ralentissement_fin", ressource=self.ressource, duree=duree)
+        definir_jauge("accuse_ralentissement", int(self.debut is not None), ressource=self.ressource)
+
 class MoniteurDossier(FileSystemEventHandler):
-    def __init__(self, dossier_a_surveiller, template_word, dossier_sortie, champs_attendus, dateDuJour, dossier_traite):
+    def __init__(self, dossier_a_surveiller, template_word, dossier_sortie, champs_attendus, dateDuJour, dossier_traite, types_champs=TYPES_CHAMPS, file_attente=None, budget=None):
         self.dossier_a_surveiller = dossier_a_surveiller
         self.template_word = template_word
         self.dossier_sortie = dossier_sortie
         self.champs_attendus = champs_attendus
         self.dateDuJour = dateDuJour
         self.dossier_traite = dossier_traite  # Dossier où déplacer les fichiers traités
-    
+        self.types_champs = types_champs
+        self.file_attente = file_attente
+        self.budget = budget
+        self.actifs = 0  # Fichiers en cours de traitement par les workers
+        self._verrou_actifs = threading.Lock()
+        # Générateur commun (templates à balises simples), partagé par les workers : templates préparés une seule fois.
+        # Les autres templates du dossier de template_word sont choisis par type de courrier (voir registre.py).
+        # Documents produits sur le disque local puis publiés en bloc dans le dossier OneDrive (voir publication.py).
+        # Le budget de lignes est partagé par les workers : les fichiers sont lus en flux, lot par lot, tant qu'il reste de la place
+        self.generateur = GenerateurLot(template_word, champs_attendus, types_champs, fonction_rendu=rendre_texte,
+                                        dossier_archive=dossier_traite, dossier_templates=os.path.dirname(template_word),
+                                        depot=depot_local("surveillance", defaut="dossier"), budget=budget)
+
+    # Le thread de watchdog se contente d'enregistrer le fichier dans la file : le traitement est fait par les workers
     def on_created(self, event):
         if event.is_directory:
             return
-        
-        if event.src_path.endswith(".xlsx") or event.src_path.endswith('.xls'):
+
+        if est_fichier_excel(event.src_path):
             print(f"📂 Nouveau fichier détecté : {event.src_path}")
-            
-            # Extraire les données et remplir le template
-            donnees_liste = extraire_donnees(event.src_path, self.champs_attendus)
-            if donnees_liste:
-                remplir_template(self.template_word, self.dossier_sortie, donnees_liste, self.dateDuJour)
-                # Déplacer le fichier traité vers le répertoire 'dossier_traite'
-                deplacer_fichier(event.src_path)
-            else:
-                print(f"❌ Erreur dans l'extraction des données du fichier : {event.src_path}")
+            self.file_attente.ajouter(event.src_path)
+
+    # Fichier copié sous un nom temporaire puis renommé dans le dossier surveillé
+    def on_moved(self, event):
+        if not event.is_directory and est_fichier_excel(event.dest_path):
+            print(f"📂 Nouveau fichier détecté : {event.dest_path}")
+            self.file_attente.ajouter(event.dest_path)
+
+    # Extraire les données et remplir le template pour un fichier de la file
+    def traiter_fichier(self, chemin):
+        if not os.path.exists(chemin):
+            raise FileNotFoundError(f"Fichier introuvable : {chemin}")
+        resultat = self.generateur.generer(chemin, self.dossier_sortie, self.dateDuJour.replace('/', '-'))
+        for message in resultat.messages_erreurs():
+            print(f"❌ {message}")
+        # Déplacer le fichier traité vers le répertoire 'dossier_traite'
+        self.generateur.archiver(chemin)
+
+    # Boucle d'un worker : prendre le prochain fichier prêt, le traiter, recommencer
+    def vider_file(self, arret):
+        while not arret.is_set():
+            travail = self.file_attente.prendre()
+            if travail is None:
+                arret.wait(1)
+                continue
+            id_travail, chemin = travail
+            profondeur = self.file_attente.profondeur()
+            print(f"⚙️ Traitement de {chemin} ({profondeur} fichier(s) en file)")
+            evenement("travail_debut", travail=id_travail, fichier=chemin, profondeur_file=profondeur)
+            debut = time.perf_counter()
+            with self._verrou_actifs:
+                self.actifs += 1
+            try:
+                self.traiter_fichier(chemin)
+                self.file_attente.terminer(id_travail)
+                evenement("travail_termine", travail=id_travail, fichier=chemin, duree=round(time.perf_counter() - debut, 3))
+                incrementer("accuse_travaux_total", statut="termine")
+            except Exception as e:
+                print(f"❌ {e}")
+                self.file_attente.echouer(id_travail, str(e))
+                evenement("travail_echoue", travail=id_travail, fichier=chemin, erreur=str(e))
+                incrementer("accuse_travaux_total", statut="echoue")
+            finally:
+                with self._verrou_actifs:
+                    self.actifs -= 1
 
 # Fonction pour surveiller un répertoire
-def surveiller_repertoire(dossier_a_surveiller, template_word, dossier_sortie, champs_attendus, dateDuJour, dossier_traite):
-    event_handler = MoniteurDossier(dossier_a_surveiller, template_word, dossier_sortie, champs_attendus, dateDuJour, dossier_traite)
+# Ressources bornées quel que soit le nombre de fichiers déposés : les fichiers attendent dans la file SQLite (sur disque),
+# au plus nb_travaux sont traités en même temps et au plus max_lignes lignes sont en mémoire, tous fichiers confondus
+def surveiller_repertoire(dossier_a_surveiller, template_word, dossier_sortie, champs_attendus, dateDuJour, dossier_traite, types_champs=TYPES_CHAMPS, chemin_file_attente=None, nb_travaux=NB_TRAVAUX_SIMULTANES, max_lignes=MAX_LIGNES_EN_COURS):
+    file_attente = FileAttente(chemin_file_attente or os.path.join(dossier_a_surveiller, ".file_attente.sqlite3"))
+    file_attente.reprendre()  # Travaux interrompus lors du dernier arrêt
+    budget = BudgetLignes(max_lignes)
+    event_handler = MoniteurDossier(dossier_a_surveiller, template_word, dossier_sortie, champs_attendus, dateDuJour, dossier_traite, types_champs, file_attente, budget)
+
+    # Fichiers déposés pendant que le surveillant était arrêté
+    for nom in os.listdir(dossier_a_surveiller):
+        chemin = os.path.join(dossier_a_surveiller, nom)
+        if os.path.isfile(chemin) and est_fichier_excel(chemin):
+            file_attente.ajouter(chemin)
+
     observer = Observer()
     observer.schedule(event_handler, dossier_a_surveiller, recursive=False)
     observer.start()
 
-    print(f"👀 Surveillance du répertoire {dossier_a_surveiller} pour de nouveaux fichiers...")
+    arret = threading.Event()
+    workers = [threading.Thread(target=event_handler.vider_file, args=(arret,), daemon=True) for _ in range(nb_travaux)]
+    for worker in workers:
+        worker.start()
+
+    print(f"👀 Surveillance du répertoire {dossier_a_surveiller} pour de nouveaux fichiers "
+          f"({nb_travaux} fichier(s) et {budget.max_lignes} ligne(s) en cours au plus)...")
 
+    ralentissement_fichiers = Ralentissement("fichiers", "{en_attente} fichier(s) en attente : {actifs} fichier(s) déjà en cours de traitement")
+    ralentissement_lignes = Ralentissement("lignes", "Lecture en pause : {en_cours}/{max_lignes} lignes en cours")
     try:
+        etat_publie = None
+        attentes_lignes = budget.attentes
         while True:
+            file_attente.verifier_stabilite()  # Un fichier n'est traité qu'une fois sa copie terminée
+            profondeur = file_attente.profondeur()
+            actifs = event_handler.actifs
+            # Ralentissements : tous les workers occupés avec des fichiers en file, ou lecture mise en attente
+            # par le budget de lignes depuis la dernière vérification
+            ralentissement_fichiers.mettre_a_jour(actifs >= nb_travaux and profondeur > actifs,
+                                                  en_attente=profondeur - actifs, actifs=actifs)
+            ralentissement_lignes.mettre_a_jour(budget.attentes > attentes_lignes,
+                                                en_cours=budget.en_cours, max_lignes=budget.max_lignes)
+            attentes_lignes = budget.attentes
+            # Profondeur de la file et charge publiées dans le fichier de métriques (réécrit seulement quand elles changent)
+            etat = (profondeur, actifs, budget.en_cours, ralentissement_fichiers.debut, ralentissement_lignes.debut)
+            if etat != etat_publie:
+                definir_jauge("accuse_file_attente_profondeur", profondeur)
+                definir_jauge("accuse_fichiers_en_cours", actifs)
+                ecrire_metriques()
+                etat_publie = etat
             time.sleep(1)  # Attendre 1 seconde avant de vérifier à nouveau
     except KeyboardInterrupt:
         observer.stop()
+        arret.set()
         print("❌ Surveillance arrêtée.")
     observer.join()
+    for worker in workers:
+        worker.join()
+    file_attente.fermer()
 
 # --- Partie principale du programme ---
 if __name__ == "__main__":
@@ -64,17 +192,14 @@ if __name__ == "__main__":
 
     dateDuJour = date.today().strftime("%d/%m/%Y")
 
-    # Champs attendus dans le fichier Excel
-    champs_attendus = ["Date Liq", "Matricule", "Identité Allocataire", "Identité Destinataire bailleur",
-                       "Adresse Ligne 2", "Adresse Ligne 3", "Adresse Ligne 4",
-                       "Adresse Ligne 5", "Adresse Ligne 6", "Adresse Ligne 7"]
-    
     # Lancer la surveillance du répertoire
     surveiller_repertoire(
-        chemins["dossier_a_surveiller"], 
-        chemins["template_word"], 
-        chemins["dossier_sortie"], 
-        champs_attendus, 
-        dateDuJour, 
-        chemins["dossier_traite"]
+        chemins["dossier_a_surveiller"],
+        chemins["template_word"],
+        chemins["dossier_sortie"],
+        CHAMPS_ACCUSE,
+        dateDuJour,
+        chemins["dossier_traite"],
+        TYPES_CHAMPS,
+        chemins["file_attente"]
     )
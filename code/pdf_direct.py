@@ -0,0 +1,210 @@
+import importlib.util
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from conversion import CONVERTISSEUR_DEFAUT, chemin_pdf, convertir_lot_libreoffice
+from modeles import BALISE_CHAMP, TYPES_PARTIES_TEXTE, charger_modele, empreinte_fichier
+
+# Moteur PDF direct (facultatif) : le corps fixe du courrier est converti une seule fois en PDF par LibreOffice,
+# puis chaque accusé est produit en superposant les champs variables sur ce fond, sans passer par un .docx.
+# PyPDF2 et reportlab ne sont importés qu'à la première utilisation du moteur : seule leur présence est vérifiée ici
+DISPONIBLE = all(importlib.util.find_spec(module) is not None for module in ("PyPDF2", "reportlab"))
+
+# Moteur activé par défaut dans les interfaces si ACCUSE_PDF_DIRECT=1
+ACTIF_PAR_DEFAUT = DISPONIBLE and os.environ.get("ACCUSE_PDF_DIRECT") == "1"
+
+# Fonds PDF et positions des champs, par empreinte de template (partagés entre les processus de génération)
+DOSSIER_FONDS = os.path.join(tempfile.gettempdir(), "accuse_reception_pdf")
+
+# Valeur qui ne peut pas être superposée au fond (trop longue pour la ligne, caractère hors police) :
+# la ligne repasse par le rendu Word + LibreOffice
+class HorsGabarit(Exception):
+    pass
+
+# Repère unique écrit à la place d'un champ pour retrouver sa position dans le PDF du template
+def _repere(numero):
+    return f"QZX{numero:03d}"
+
+# Vérifier qu'un template peut être superposé : chaque balise est seule dans un paragraphe aligné à gauche,
+# sans logique Jinja. Retourne {champ: limite droite en points} ou lève ValueError avec la raison
+def _analyser_template(fichier_template):
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.oxml.ns import qn
+    from docx.text.paragraph import Paragraph
+    # Alignements compatibles avec la superposition : le champ commence toujours au même endroit
+    alignements_gauche = {None, WD_ALIGN_PARAGRAPH.LEFT, WD_ALIGN_PARAGRAPH.JUSTIFY}
+    document = Document(fichier_template)
+    section = document.sections[0]
+    limite = (section.page_width - section.right_margin) / 12700  # EMU -> points
+    champs = {}
+    for part in document.part.package.iter_parts():
+        if part.content_type not in TYPES_PARTIES_TEXTE:
+            continue
+        for element in part.element.iter(qn("w:p")):
+            paragraphe = Paragraph(element, None)
+            texte = paragraphe.text
+            if "{%" in texte:
+                raise ValueError("logique Jinja ({% ... %}) dans le template")
+            if "{{" not in texte:
+                continue
+            balise = BALISE_CHAMP.fullmatch(texte.strip())
+            if not balise:
+                raise ValueError(f"champ au milieu d'un texte : « {texte.strip()} »")
+            if paragraphe.paragraph_format.alignment not in alignements_gauche:
+                raise ValueError(f"champ {balise.group(1)} dans un paragraphe centré ou aligné à droite")
+            champs[balise.group(1)] = limite
+    if not champs:
+        raise ValueError("aucun champ dans le template")
+    return champs
+
+def _multiplier(a, b):
+    return [
+        a[0] * b[0] + a[1] * b[2], a[0] * b[1] + a[1] * b[3],
+        a[2] * b[0] + a[3] * b[2], a[2] * b[1] + a[3] * b[3],
+        a[4] * b[0] + a[5] * b[2] + b[4], a[4] * b[1] + a[5] * b[3] + b[5],
+    ]
+
+# Police standard PDF la plus proche de la police du template
+def _police_standard(nom_police):
+    nom = nom_police.lower()
+    gras, italique = "bold" in nom, "italic" in nom or "oblique" in nom
+    if "times" in nom or ("serif" in nom and "sans" not in nom):
+        return {(False, False): "Times-Roman", (True, False): "Times-Bold", (False, True): "Times-Italic", (True, True): "Times-BoldItalic"}[gras, italique]
+    famille = "Courier" if "mono" in nom or "courier" in nom else "Helvetica"
+    suffixe = ("Bold" if gras else "") + ("Oblique" if italique else "")
+    return f"{famille}-{suffixe}" if suffixe else famille
+
+# Retrouver les repères dans le PDF du template : page, position, police et taille de chaque champ
+def _positions_reperes(pdf_reperes, reperes):
+    from PyPDF2 import PdfReader
+    positions = {}
+    for numero_page, page in enumerate(PdfReader(pdf_reperes).pages):
+        def visiteur(texte, cm, tm, police, taille):
+            texte = texte.strip()
+            for champ, repere in reperes.items():
+                if texte.startswith(repere):
+                    matrice = _multiplier(tm, cm)
+                    nom_police = str((police or {}).get("/BaseFont", "")).split("+")[-1]
+                    positions.setdefault(champ, []).append({
+                        "page": numero_page, "x": matrice[4], "y": matrice[5],
+                        "taille": taille * abs(matrice[3] or 1), "police": _police_standard(nom_police),
+                    })
+        page.extract_text(visitor_text=visiteur)
+    return positions
+
+# Préparer (une fois par template) le fond PDF sans les champs et la position de chaque champ
+# Retourne le chemin du fond, ou lève ValueError si le template ne peut pas être superposé
+def preparer_fond(fichier_template, convertisseur=CONVERTISSEUR_DEFAUT):
+    if not DISPONIBLE:
+        raise ValueError("PyPDF2 et reportlab sont nécessaires au moteur PDF direct")
+    empreinte = empreinte_fichier(fichier_template)
+    fond = os.path.join(DOSSIER_FONDS, empreinte + ".pdf")
+    description = os.path.join(DOSSIER_FONDS, empreinte + ".json")
+    if not os.path.exists(description):
+        os.makedirs(DOSSIER_FONDS, exist_ok=True)
+        dossier_travail = tempfile.mkdtemp(prefix="fond_", dir=DOSSIER_FONDS)
+        try:
+            contenu = _construire_fond(fichier_template, convertisseur, dossier_travail, fond)
+        finally:
+            shutil.rmtree(dossier_travail, ignore_errors=True)
+        # Le résultat (fond ou raison du refus) est mémorisé : l'analyse n'est refaite que si le template change
+        description_temporaire = f"{description}.{os.getpid()}.tmp"
+        with open(description_temporaire, "w", encoding="utf-8") as f:
+            json.dump(contenu, f, ensure_ascii=False)
+        os.replace(description_temporaire, description)
+    else:
+        with open(description, encoding="utf-8") as f:
+            contenu = json.load(f)
+    if "refus" in contenu:
+        raise ValueError(contenu["refus"])
+    return fond
+
+def _construire_fond(fichier_template, convertisseur, dossier_travail, fond):
+    try:
+        limites = _analyser_template(fichier_template)
+    except ValueError as e:
+        return {"refus": str(e)}
+    reperes = {champ: _repere(i) for i, champ in enumerate(sorted(limites))}
+    modele = charger_modele(fichier_template)
+    docx_reperes = os.path.join(dossier_travail, "reperes.docx")
+    docx_fond = os.path.join(dossier_travail, "fond.docx")
+    modele.enregistrer(reperes, docx_reperes)
+    modele.enregistrer(dict.fromkeys(limites, ""), docx_fond)
+    erreurs = convertisseur([docx_reperes, docx_fond], dossier_travail)
+    if erreurs:
+        # Échec de LibreOffice non mémorisé : la préparation sera retentée à la prochaine génération
+        raise ValueError(f"conversion du template impossible : {next(iter(erreurs.values()))}")
+    try:
+        positions = _positions_reperes(chemin_pdf(docx_reperes, dossier_travail), reperes)
+    except Exception as e:
+        raise ValueError(f"PDF du template illisible : {e}")  # Non mémorisé, comme un échec de conversion
+    manquants = sorted(set(reperes) - set(positions))
+    if manquants:
+        refus = f"champs introuvables dans le PDF du template : {', '.join(manquants)}"
+        if convertisseur is not convertir_lot_libreoffice:
+            # PDF d'un autre convertisseur (factice : pages vides) : refus non mémorisé, retenté avec LibreOffice
+            raise ValueError(refus)
+        return {"refus": refus}
+    os.replace(chemin_pdf(docx_fond, dossier_travail), fond)
+    return {"champs": {champ: {"limite": limites[champ], "positions": positions[champ]} for champ in limites}}
+
+# Fond PDF préparé par preparer_fond, chargé une fois par processus (voir modeles.charger_modele)
+class ModelePdf:
+    def __init__(self, chemin, octets, empreinte):
+        from PyPDF2 import PdfReader
+        self.chemin = chemin
+        self.empreinte = empreinte
+        with open(os.path.join(DOSSIER_FONDS, empreinte + ".pdf"), "rb") as f:
+            self.fond = f.read()
+        with open(os.path.join(DOSSIER_FONDS, empreinte + ".json"), encoding="utf-8") as f:
+            self.champs = json.load(f)["champs"]
+        self.tailles_pages = [(float(p.mediabox.width), float(p.mediabox.height)) for p in PdfReader(io.BytesIO(self.fond)).pages]
+        self.pages_champs = {p["page"] for champ in self.champs.values() for p in champ["positions"]}
+
+    # Superposer les valeurs au fond et écrire le PDF final ; renvoie la durée du rendu et de l'écriture (secondes)
+    def enregistrer(self, contexte, fichier_sortie):
+        from PyPDF2 import PdfReader, PdfWriter
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from reportlab.pdfgen import canvas
+        debut = time.perf_counter()
+        for champ, description in self.champs.items():
+            valeur = str(contexte.get(champ, ""))
+            for position in description["positions"]:
+                try:
+                    valeur.encode("cp1252")
+                except UnicodeEncodeError:
+                    raise HorsGabarit(f"caractère non pris en charge dans {champ}")
+                if position["x"] + stringWidth(valeur, position["police"], position["taille"]) > description["limite"]:
+                    raise HorsGabarit(f"valeur trop longue pour la ligne : {champ}")
+
+        calque = io.BytesIO()
+        dessin = canvas.Canvas(calque)
+        for numero_page, taille_page in enumerate(self.tailles_pages):
+            dessin.setPageSize(taille_page)
+            for champ, description in self.champs.items():
+                for position in description["positions"]:
+                    if position["page"] == numero_page:
+                        dessin.setFont(position["police"], position["taille"])
+                        dessin.drawString(position["x"], position["y"], str(contexte.get(champ, "")))
+            dessin.showPage()
+        dessin.save()
+
+        calques = PdfReader(calque).pages
+        sortie = PdfWriter()
+        for numero_page, page in enumerate(PdfReader(io.BytesIO(self.fond)).pages):
+            if numero_page in self.pages_champs:
+                page.merge_page(calques[numero_page])
+            sortie.add_page(page)
+        milieu = time.perf_counter()
+        with open(fichier_sortie, "wb") as f:
+            sortie.write(f)
+        return {"rendu": milieu - debut, "enregistrement": time.perf_counter() - milieu}
+
+# Rendu PDF direct d'un document (fond préparé au préalable par preparer_fond)
+def rendre_pdf_direct(fichier_template, donnees, fichier_sortie):
+    return charger_modele(fichier_template, ModelePdf).enregistrer(donnees, fichier_sortie)
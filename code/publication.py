@@ -0,0 +1,214 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from archivage import creer_zip_depuis_dossier, publier_fichier
+from manifeste import NOM_MANIFESTE
+
+# Génération dans un dossier de travail local (disque rapide, hors du dossier synchronisé par OneDrive), puis
+# publication du lot entier vers le dossier final en une seule étape, une fois la génération terminée :
+#   "dossier" : dossier final absent, le lot y est renommé d'un coup ; sinon ses documents y sont déplacés ensemble
+#   "zip"     : un seul fichier zip déposé dans le dossier final (pas de génération incrémentale dans ce mode)
+# Chaque lot a un journal : après un arrêt brutal, les lots terminés sont publiés au démarrage suivant
+# et les lots inachevés supprimés (le fichier Excel, non archivé, est simplement retraité).
+# Chaque lot a aussi un verrou, gardé par le processus qui l'écrit : la reprise ne touche jamais au lot
+# d'un autre processus encore en marche (deux cli.py lancés en même temps sur le même dossier local).
+
+# Racine des dossiers de travail locaux (disque local non synchronisé, comme la file d'attente du surveillant)
+DOSSIER_LOCAL_DEFAUT = os.environ.get("ACCUSE_DOSSIER_LOCAL") or os.path.join(
+    os.environ.get("LOCALAPPDATA", os.path.expanduser("~")), "Appli_Accuse_Reception", "lots")
+
+MODES_PUBLICATION = ("dossier", "zip")
+
+NOM_JOURNAL = ".publication.json"
+NOM_VERROU = ".proprietaire.lock"
+
+# Dossier de lot sans journal plus récent que ce délai (secondes) : lot en cours de création, laissé à la reprise
+DELAI_CREATION = 60
+
+# Verrou exclusif sur un fichier, gardé tant que le fichier reste ouvert (rendu par le système à la mort du processus).
+# None si un autre détenteur l'a déjà
+def _verrouiller(chemin):
+    f = open(chemin, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+def _ecrire_journal(dossier_local, journal):
+    chemin = os.path.join(dossier_local, NOM_JOURNAL)
+    with open(f"{chemin}.tmp", "w", encoding="utf-8") as f:
+        json.dump(journal, f, ensure_ascii=False)
+    os.replace(f"{chemin}.tmp", chemin)
+
+def _lire_journal(dossier_local):
+    try:
+        with open(os.path.join(dossier_local, NOM_JOURNAL), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Documents d'un lot local (hors fichiers techniques : journal, manifeste, espaces de travail des lots)
+def _documents(dossier_local):
+    for racine, dossiers, fichiers in os.walk(dossier_local):
+        dossiers[:] = [d for d in dossiers if not d.startswith(".")]
+        for nom in fichiers:
+            if not nom.startswith("."):
+                yield os.path.join(racine, nom)
+
+# Déplacer les documents d'un lot dans un dossier final existant, puis ajouter ses entrées au manifeste final
+# (seulement celles écrites pendant le lot : le manifeste local commence par une copie de l'ancien)
+def _fusionner(source, destination, taille_manifeste):
+    for fichier in _documents(source):
+        cible = os.path.join(destination, os.path.relpath(fichier, source))
+        os.makedirs(os.path.dirname(cible), exist_ok=True)
+        publier_fichier(fichier, cible)
+    manifeste = os.path.join(source, NOM_MANIFESTE)
+    if os.path.exists(manifeste):
+        with open(manifeste, "rb") as f:
+            f.seek(taille_manifeste)
+            nouvelles_entrees = f.read()
+        if nouvelles_entrees:
+            with open(os.path.join(destination, NOM_MANIFESTE), "ab") as f:
+                f.write(nouvelles_entrees)
+
+# Publier un lot local terminé d'après son journal. Peut être relancé après une interruption : les documents
+# déjà déplacés ne sont plus dans le lot, le zip déjà déposé n'est pas recopié.
+# verrou : verrou du lot, rendu juste avant la suppression du dossier (journal déjà retiré : lot plus à reprendre)
+def publier_lot(dossier_local, verrou=None):
+    journal = _lire_journal(dossier_local)
+    destination = journal["destination"]
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    if journal["mode"] == "zip":
+        os.makedirs(destination, exist_ok=True)
+        chemin_zip = os.path.join(destination, journal["nom_zip"])
+        if not os.path.exists(chemin_zip):
+            zip_local = creer_zip_depuis_dossier(dossier_local, os.path.join(dossier_local, ".lot", journal["nom_zip"]))
+            publier_fichier(zip_local, chemin_zip)
+    elif not os.path.isdir(destination):
+        # Copie complète à côté du dossier final puis renommage : le dossier n'apparaît qu'entier
+        provisoire = f"{destination}.{journal['identifiant']}.partiel"
+        shutil.rmtree(provisoire, ignore_errors=True)
+        shutil.copytree(dossier_local, provisoire, ignore=shutil.ignore_patterns(NOM_JOURNAL, NOM_VERROU, ".lot*"))
+        try:
+            os.rename(provisoire, destination)
+        except OSError:
+            # Dossier final créé entre-temps par un autre traitement : fusion comme pour un dossier existant
+            _fusionner(provisoire, destination, 0)
+            shutil.rmtree(provisoire, ignore_errors=True)
+    else:
+        _fusionner(dossier_local, destination, journal["taille_manifeste"])
+    os.remove(os.path.join(dossier_local, NOM_JOURNAL))
+    if verrou is not None:
+        verrou.close()
+    shutil.rmtree(dossier_local, ignore_errors=True)
+
+# Dossier de travail local d'une génération, destiné à un dossier final
+class LotLocal:
+    def __init__(self, racine, destination, mode):
+        self.destination = destination
+        self.mode = mode
+        identifiant = f"{datetime.now():%Y%m%d-%H%M%S}_{uuid.uuid4().hex[:6]}"
+        self.dossier = os.path.join(racine, f"{os.path.basename(os.path.normpath(destination))}_{identifiant}")
+        os.makedirs(self.dossier)
+        self.verrou = _verrouiller(os.path.join(self.dossier, NOM_VERROU))  # Gardé jusqu'à la publication ou l'abandon
+        taille_manifeste = 0
+        manifeste = os.path.join(destination, NOM_MANIFESTE)
+        if mode == "dossier" and os.path.exists(manifeste):
+            # Génération incrémentale : le manifeste final est repris, les documents déjà publiés sont cherchés
+            # dans le dossier final (voir moteur.generer_documents, dossier_publication)
+            shutil.copyfile(manifeste, os.path.join(self.dossier, NOM_MANIFESTE))
+            taille_manifeste = os.path.getsize(os.path.join(self.dossier, NOM_MANIFESTE))
+        self.journal = {"destination": os.path.abspath(destination), "mode": mode, "identifiant": identifiant,
+                        "taille_manifeste": taille_manifeste, "termine": False, "pid": os.getpid(),
+                        "nom_zip": f"{os.path.basename(os.path.normpath(destination))}_{identifiant}.zip"}
+        _ecrire_journal(self.dossier, self.journal)
+
+    # Options de generer_documents pour ce lot
+    def options(self):
+        return {"dossier_publication": self.destination} if self.mode == "dossier" else {}
+
+    # Emplacement final de chaque document du lot (en mode zip : le zip)
+    def emplacements(self):
+        if self.mode == "zip":
+            chemin_zip = os.path.join(self.destination, self.journal["nom_zip"])
+            return {fichier: chemin_zip for fichier in _documents(self.dossier)}
+        return {fichier: os.path.join(self.destination, os.path.relpath(fichier, self.dossier))
+                for fichier in _documents(self.dossier)}
+
+    # Génération terminée : le journal le note avant la publication (reprise possible si elle est interrompue)
+    def publier(self):
+        emplacements = self.emplacements()
+        self.journal["termine"] = True
+        _ecrire_journal(self.dossier, self.journal)
+        publier_lot(self.dossier, self.verrou)
+        return emplacements
+
+    # Génération en erreur : rien n'est publié
+    def abandonner(self):
+        self.verrou.close()
+        shutil.rmtree(self.dossier, ignore_errors=True)
+
+# Dossiers de travail locaux d'une interface (une racine par interface : une reprise ne touche jamais
+# aux lots en cours d'une autre interface lancée en même temps)
+class DepotLocal:
+    def __init__(self, racine, mode="dossier"):
+        if mode not in MODES_PUBLICATION:
+            raise ValueError(f"Mode de publication inconnu : {mode} (attendu : {', '.join(MODES_PUBLICATION)})")
+        self.racine = racine
+        self.mode = mode
+        self._verrou = threading.Lock()
+        self._repris = False
+
+    # Lots laissés par un arrêt brutal : publiés s'ils étaient terminés, supprimés sinon.
+    # Les lots dont le verrou est encore tenu appartiennent à un processus en marche et sont laissés tels quels
+    def reprendre(self):
+        publies = []
+        for nom in sorted(os.listdir(self.racine)) if os.path.isdir(self.racine) else []:
+            dossier_local = os.path.join(self.racine, nom)
+            if not os.path.isdir(dossier_local):
+                continue
+            journal = _lire_journal(dossier_local)
+            if journal is None and time.time() - os.path.getmtime(dossier_local) < DELAI_CREATION:
+                continue  # Lot qui vient d'être créé, pas encore verrouillé
+            try:
+                verrou = _verrouiller(os.path.join(dossier_local, NOM_VERROU))
+            except OSError:
+                continue  # Dossier supprimé entre-temps par son propriétaire
+            if verrou is None:
+                continue
+            if journal and journal.get("termine"):
+                publier_lot(dossier_local, verrou)
+                publies.append(journal["destination"])
+            else:
+                verrou.close()
+                shutil.rmtree(dossier_local, ignore_errors=True)
+        return publies
+
+    # Nouveau lot local ; la reprise des lots précédents a lieu avant le premier lot du processus
+    def ouvrir(self, destination):
+        with self._verrou:
+            if not self._repris:
+                self._repris = True
+                self.reprendre()
+        return LotLocal(self.racine, destination, self.mode)
+
+# Dépôt d'une interface selon ACCUSE_PUBLICATION_<INTERFACE> (sinon ACCUSE_PUBLICATION, sinon defaut) :
+# "direct" (documents écrits directement dans le dossier final, aucun dépôt local), "dossier" ou "zip"
+def depot_local(interface, defaut="direct"):
+    mode = os.environ.get(f"ACCUSE_PUBLICATION_{interface.upper()}", os.environ.get("ACCUSE_PUBLICATION", defaut))
+    if mode == "direct":
+        return None
+    return DepotLocal(os.path.join(DOSSIER_LOCAL_DEFAUT, interface), mode)
@@ -0,0 +1,92 @@
+import os
+import re
+
+from modeles import ModeleJinja, charger_modele
+
+# Registre des templates d'un dossier : chaque template Word du dossier est un type de courrier.
+# Les templates sont préparés à la découverte et restent compilés en mémoire (cache borné de modeles.charger_modele),
+# avec la liste des champs qu'ils utilisent. Le template d'une ligne est choisi par sa colonne de type de courrier,
+# sinon d'après le nom du fichier Excel, sinon c'est le template par défaut.
+
+# Colonne facultative des exports indiquant le type de courrier de chaque ligne
+CHAMP_TYPE_COURRIER = "Type_Courrier"
+
+# Identifiant d'un template d'après son nom de fichier : "13. Accusé de réception.docx" -> "13_Accusé_de_réception"
+def identifiant_modele(chemin):
+    nom = os.path.splitext(os.path.basename(chemin))[0]
+    return re.sub(r"\W+", "_", nom).strip("_")
+
+# Templates Word (hors fichiers de verrouillage "~$..." créés par Word)
+def est_template(nom):
+    return nom.lower().endswith(".docx") and not nom.startswith("~$")
+
+# Clés sous lesquelles un type de courrier peut être désigné : identifiant complet, numéro seul, libellé sans numéro
+def _cles_recherche(identifiant):
+    cle = identifiant.lower()
+    numero = re.match(r"(\d+)_(.+)", cle)
+    return [cle, *numero.groups()] if numero else [cle]
+
+# Numéro de template désigné explicitement dans un nom de fichier Excel : "impayes_modele-13.xlsx".
+# Un nombre seul (date, compteur) ne choisit jamais de template
+MARQUEUR_NUMERO = re.compile(r"(?:^|_)modele_(\d+)(?:_|$)")
+
+class RegistreModeles:
+    def __init__(self, dossier, defaut=None, classe=ModeleJinja, champ_type=CHAMP_TYPE_COURRIER):
+        self.dossier = dossier
+        self.defaut = defaut  # Template des lignes sans type de courrier (None : ces lignes sont en erreur)
+        self.classe = classe
+        self.champ_type = champ_type
+        self.modeles = {}  # Identifiant -> chemin du template
+        self.champs = {}  # Identifiant -> champs utilisés par le template
+        self.erreurs = {}  # Identifiant -> raison pour laquelle le template n'a pas pu être préparé
+        self._cles = {}
+
+    # Parcourir le dossier et préparer chaque template. Peut être rappelé : seuls les templates nouveaux ou modifiés
+    # sont recompilés, un template ajouté au dossier est pris en compte sans redémarrer
+    def decouvrir(self):
+        modeles, champs, erreurs, cles = {}, {}, {}, {}
+        noms = sorted(os.listdir(self.dossier)) if os.path.isdir(self.dossier) else []
+        for nom in filter(est_template, noms):
+            chemin = os.path.join(self.dossier, nom)
+            identifiant = identifiant_modele(chemin)
+            try:
+                champs[identifiant] = set(charger_modele(chemin, self.classe).champs)
+            except Exception as e:
+                erreurs[identifiant] = str(e)  # Template illisible : les autres restent utilisables
+                continue
+            modeles[identifiant] = chemin
+            for cle in _cles_recherche(identifiant):
+                cles.setdefault(cle, identifiant)
+        self.modeles, self.champs, self.erreurs, self._cles = modeles, champs, erreurs, cles
+        return modeles
+
+    # Template désigné par une valeur de la colonne de type de courrier ("13", "13_Accusé...", "Accusé...")
+    def chercher(self, valeur):
+        identifiant = self._cles.get(identifiant_modele(str(valeur)).lower())
+        return self.modeles[identifiant] if identifiant else None
+
+    # Template dont l'identifiant complet ou le libellé figure en mots entiers dans le nom du fichier Excel
+    # (le plus précis l'emporte), ou dont le numéro suit le marqueur "modele-"
+    def pour_fichier(self, nom_fichier):
+        nom = identifiant_modele(nom_fichier).lower()
+        marqueur = MARQUEUR_NUMERO.search(nom)
+        if marqueur and marqueur.group(1) in self._cles:
+            return self.modeles[self._cles[marqueur.group(1)]]
+        trouves = [cle for cle in self._cles if not cle.isdigit() and f"_{cle}_" in f"_{nom}_"]
+        return self.modeles[self._cles[max(trouves, key=len)]] if trouves else None
+
+    # Fonction de choix du template de chaque ligne pour un fichier Excel (voir moteur.generer_documents)
+    def selecteur(self, nom_fichier=None):
+        defaut = (self.pour_fichier(nom_fichier) if nom_fichier else None) or self.defaut
+
+        def choisir(donnees):
+            valeur = str(donnees.get(self.champ_type, "") or "").strip()
+            if valeur:
+                chemin = self.chercher(valeur)
+                if chemin is None:
+                    raise ValueError(f"Type de courrier inconnu : {valeur}")
+                return chemin
+            if defaut is None:
+                raise ValueError(f"Type de courrier non renseigné (colonne {self.champ_type})")
+            return defaut
+        return choisir
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from modeles import empreinte_fichier
+
+# Cache des résultats de génération, partagé par toutes les sessions (Streamlit, NiceGUI) : un fichier déjà traité
+# (même contenu, mêmes templates, mêmes options) n'est ni relu ni régénéré, son dossier de sortie et son zip
+# sont réutilisés. Une entrée JSON par résultat dans un dossier caché du dossier des résultats ; la date de
+# modification de l'entrée est celle de sa dernière utilisation. Au-delà de la taille maximale, les résultats
+# les moins récemment utilisés sont supprimés du disque. Un résultat avec des lignes en erreur n'est pas réutilisé
+# mais il est enregistré quand même, pour que ses fichiers soient supprimés à leur tour.
+
+# Taille maximale des résultats gardés (Mo)
+TAILLE_MAX_RESULTATS = int(os.environ.get("ACCUSE_CACHE_RESULTATS_MO", "2048")) * 1024 * 1024
+
+# Clé d'un résultat : contenu du fichier Excel, contenu de chaque template utilisable et options de génération
+def cle_resultat(octets_excel, fichiers_templates, **options):
+    empreinte = hashlib.sha256(octets_excel)
+    for chemin in sorted(fichiers_templates):
+        empreinte.update(f"\0{os.path.basename(chemin)}:{empreinte_fichier(chemin)}".encode())
+    empreinte.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return empreinte.hexdigest()[:32]
+
+# Taille et date de modification d'un fichier produit (None s'il a disparu)
+def _signature(chemin):
+    try:
+        stat = os.stat(chemin)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+def taille_dossier(dossier):
+    return sum(os.path.getsize(os.path.join(racine, nom)) for racine, _, noms in os.walk(dossier) for nom in noms)
+
+class CacheResultats:
+    def __init__(self, dossier, taille_max=TAILLE_MAX_RESULTATS):
+        self.dossier_index = os.path.join(dossier, ".resultats")
+        self.taille_max = taille_max
+        self._verrou = threading.Lock()
+        self._verrous = {}
+
+    # Un seul traitement par clé à la fois : un envoi en double (autre session, autre onglet) attend le premier
+    # puis réutilise son résultat au lieu de générer une seconde fois
+    @contextmanager
+    def verrou(self, cle):
+        with self._verrou:
+            verrou = self._verrous.setdefault(cle, threading.Lock())
+        with verrou:
+            yield
+
+    def _chemin(self, cle):
+        return os.path.join(self.dossier_index, f"{cle}.json")
+
+    # Résultat en cache, si tous ses fichiers sont encore là et n'ont pas été remplacés depuis (sinon l'entrée est oubliée)
+    def chercher(self, cle):
+        chemin = self._chemin(cle)
+        try:
+            with open(chemin, encoding="utf-8") as f:
+                entree = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not entree.get("reutilisable", True):
+            return None
+        if any(_signature(fichier) != signature for fichier, signature in entree["fichiers"].items()):
+            self._oublier(chemin)
+            return None
+        os.utime(chemin)  # Dernière utilisation
+        return entree
+
+    # Enregistrer un résultat. fichiers : fichiers produits dont dépend la réutilisation (zip, documents).
+    # proprietaire : le dossier de sortie n'appartient qu'à ce résultat et sera supprimé en entier à l'éviction ;
+    # sinon (dossier partagé, du jour) seuls les fichiers listés sont supprimés.
+    # annexes : fichiers supprimés avec le résultat sans être nécessaires à sa réutilisation (aperçu PDF).
+    # reutilisable=False (lignes en erreur) : jamais rendu par chercher, seulement compté pour l'éviction ;
+    # enregistré sous une clé à part pour ne pas remplacer un résultat complet de même clé
+    def enregistrer(self, cle, dossier_sortie, fichiers, proprietaire=False, reutilisable=True, annexes=(), **infos):
+        if not reutilisable:
+            cle = f"{cle}_{uuid.uuid4().hex[:8]}"
+        fichiers = {fichier: _signature(fichier) for fichier in fichiers}
+        annexes = {fichier: _signature(fichier) for fichier in annexes if fichier}
+        interieur = os.path.abspath(dossier_sortie) + os.sep
+        externes = [signature for fichier, signature in [*fichiers.items(), *annexes.items()]
+                    if signature and not (proprietaire and os.path.abspath(fichier).startswith(interieur))]
+        taille = (taille_dossier(dossier_sortie) if proprietaire else 0) + sum(signature[0] for signature in externes)
+        entree = {"cle": cle, "dossier": dossier_sortie, "proprietaire": proprietaire, "reutilisable": reutilisable,
+                  "fichiers": fichiers, "annexes": annexes, "taille": taille,
+                  "date": datetime.now().isoformat(timespec="seconds"), "infos": infos}
+        os.makedirs(self.dossier_index, exist_ok=True)
+        chemin = self._chemin(cle)
+        chemin_temporaire = f"{chemin}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(chemin_temporaire, "w", encoding="utf-8") as f:
+            json.dump(entree, f, ensure_ascii=False)
+        os.replace(chemin_temporaire, chemin)
+        self.evincer(garder=cle)
+        return entree
+
+    # Supprimer les résultats les moins récemment utilisés jusqu'à revenir sous la taille maximale
+    def evincer(self, garder=None):
+        with self._verrou:
+            entrees = []
+            for nom in os.listdir(self.dossier_index) if os.path.isdir(self.dossier_index) else []:
+                chemin = os.path.join(self.dossier_index, nom)
+                if not nom.endswith(".json"):
+                    continue
+                try:
+                    with open(chemin, encoding="utf-8") as f:
+                        entrees.append((os.path.getmtime(chemin), chemin, json.load(f)))
+                except (OSError, ValueError):
+                    continue
+            total = sum(entree["taille"] for _, _, entree in entrees)
+            for _, chemin, entree in sorted(entrees, key=lambda e: e[0]):
+                if total <= self.taille_max:
+                    break
+                if entree["cle"] == garder:
+                    continue
+                self._supprimer(entree)
+                self._oublier(chemin)
+                total -= entree["taille"]
+
+    def _oublier(self, chemin):
+        try:
+            os.remove(chemin)
+        except OSError:
+            pass
+
+    # Fichiers d'un résultat évincé : seuls ceux qui n'ont pas été remplacés depuis par un autre traitement
+    def _supprimer(self, entree):
+        for fichier, signature in [*entree["fichiers"].items(), *entree.get("annexes", {}).items()]:
+            if signature and _signature(fichier) == signature:
+                self._oublier(fichier)
+        if entree["proprietaire"]:
+            shutil.rmtree(entree["dossier"], ignore_errors=True)
+        else:
+            try:
+                os.rmdir(entree["dossier"])  # Dossier partagé supprimé seulement s'il ne contient plus rien
+            except OSError:
+                pass
@@ -0,0 +1,11 @@
+import os
+
+import streamlit as st
+
+import telechargements
+
+# Point d'entrée du serveur : `streamlit run code/serveur.py`. L'application app.py est servie avec la route de
+# téléchargement en flux des zips et des aperçus (voir telechargements.py) à la place des fichiers statiques de
+# Streamlit, limités à 200 Mo et accessibles sans session
+telechargements.route_active = True
+app = st.App(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"), routes=telechargements.routes())
@@ -0,0 +1,78 @@
+import os
+import secrets
+import threading
+
+from archivage import espace_travail
+
+# Téléchargement des fichiers produits (zip, aperçu PDF) par la route /telechargement/<jeton> de serveur.py.
+# Le fichier est lu en flux depuis le disque (aucune limite de taille, rien en mémoire) et n'est servi que sur un
+# jeton aléatoire créé par une session encore ouverte : le lien ne donne rien à une autre personne ni après la session.
+# Les zips sont écrits dans un dossier de travail propre à la session, supprimé une fois la session fermée.
+
+PREFIXE = "telechargement"
+
+# Vrai quand l'application est lancée par serveur.py (route montée) ; sinon les interfaces passent par st.download_button
+route_active = False
+
+_liens = {}  # jeton -> (chemin, nom, en_ligne, session)
+_jetons = {}  # (session, chemin, en_ligne) -> jeton : un seul lien par fichier et par session, d'une relance à l'autre
+_espaces = {}  # session -> (espace_travail ouvert, chemin du dossier)
+_verrou = threading.Lock()
+
+def _session_courante():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def _session_active(session):
+    from streamlit import runtime
+    return runtime.exists() and runtime.get_instance().is_active_session(session)
+
+# Oublier les liens et supprimer les dossiers des sessions fermées (garder : session en cours)
+def _nettoyer(garder=None):
+    for jeton, (chemin, nom, en_ligne, session) in list(_liens.items()):
+        if session != garder and not _session_active(session):
+            del _liens[jeton]
+            _jetons.pop((session, chemin, en_ligne), None)
+    for session in [session for session in _espaces if session != garder and not _session_active(session)]:
+        espace, _ = _espaces.pop(session)
+        espace.__exit__(None, None, None)
+
+# Dossier de travail de la session Streamlit en cours (zips à télécharger), créé à la première demande
+def dossier_session():
+    session = _session_courante()
+    with _verrou:
+        _nettoyer(session)
+        if session not in _espaces:
+            espace = espace_travail("accuse_session_")
+            _espaces[session] = (espace, espace.__enter__())
+        return _espaces[session][1]
+
+# Lien relatif vers un fichier pour la session Streamlit en cours.
+# en_ligne : affiché par le navigateur (aperçu PDF dans un iframe) au lieu d'être enregistré
+def lien(chemin, nom=None, en_ligne=False):
+    session = _session_courante()
+    chemin = os.path.abspath(chemin)
+    with _verrou:
+        _nettoyer(session)
+        jeton = _jetons.get((session, chemin, en_ligne))
+        if jeton is None:
+            jeton = secrets.token_urlsafe(24)
+            _jetons[(session, chemin, en_ligne)] = jeton
+        _liens[jeton] = (chemin, nom or os.path.basename(chemin), en_ligne, session)
+    return f"{PREFIXE}/{jeton}"
+
+# Route Starlette : fichier envoyé par morceaux, 404 pour un jeton inconnu, d'une session fermée ou un fichier supprimé
+async def telecharger(requete):
+    from starlette.responses import FileResponse, PlainTextResponse
+    with _verrou:
+        entree = _liens.get(requete.path_params["jeton"])
+    if entree is None or not _session_active(entree[3]) or not os.path.isfile(entree[0]):
+        return PlainTextResponse("Lien expiré : relancez le traitement depuis l'application.", status_code=404)
+    chemin, nom, en_ligne, _ = entree
+    return FileResponse(chemin, filename=nom, content_disposition_type="inline" if en_ligne else "attachment",
+                        headers={"Cache-Control": "no-store"})
+
+def routes():
+    from starlette.routing import Route
+    return [Route(f"/{PREFIXE}/{{jeton}}", telecharger)]
@@ -1,11 +1,16 @@
-import pandas as pd
-from docx import Document
+import time
+DEBUT = time.perf_counter()  # Référence du délai de démarrage (voir mesures.premiere_fenetre)
+
 from datetime import date
 import os
 import tkinter as tk
 from tkinter import filedialog
-from datetime import datetime
-import shutil
+import generateur
+from generateur import CHAMPS_ACCUSE, GenerateurLot
+from mesures import premiere_fenetre
+from moteur import rendre_texte
+from publication import depot_local
+from registre import CHAMP_TYPE_COURRIER
 
 # Définition du chemin jusqu'à Documents
 dossier_base = os.path.join(os.path.expanduser("~"), "OneDrive - Cafdoc", "Documents", "DEVS", "Appli_Accuse_Reception")
@@ -29,104 +34,74 @@ def verifier_et_creer_repertoires():
 def choisir_fichier():
     root = tk.Tk()
     root.withdraw()
+    premiere_fenetre("tkinter", DEBUT)
     fichier = filedialog.askopenfilename(title="Sélectionnez un fichier Excel",
                                          filetypes=[("Fichiers Excel", "*.xlsx;*.xls")])
     return fichier
 
-# Fonction pour déplacer le fichier traité
+# Fonction pour déplacer le fichier traité (nom unique réservé dans l'archive, sans boucle de recherche)
 def deplacer_fichier(fichier):
     try:
-        dossier_destination = definir_chemin("archive")
-        os.makedirs(dossier_destination, exist_ok=True)
-        
-        chemin_destination = os.path.join(dossier_destination, os.path.basename(fichier))
-        #chemin_destination = dossier_destination
-
         if not os.path.exists(fichier):  # Vérifie si le fichier source existe
             print(f"❌ Le fichier source n'existe pas : {fichier}")
             return
 
-        if os.path.exists(chemin_destination):  # Vérifie si le fichier destination existe déjà
-            print(f"⚠️ Le fichier {chemin_destination} existe déjà. Renommage en cours...")
-            base, ext = os.path.splitext(chemin_destination)
-            i = 1
-            while os.path.exists(f"{base}_{i}{ext}"):
-                i += 1
-            chemin_destination = f"{base}_{i}{ext}"
-
-        # Afficher le contenu du répertoire archive
-        print(f"📂 Contenu du dossier {dossier_destination} :")
-        print(os.listdir(dossier_destination))
-        shutil.move(fichier, chemin_destination)
+        chemin_destination = generateur.deplacer_fichier(fichier, definir_chemin("archive"))
         print(f"✅ Fichier déplacé vers : {chemin_destination}")
 
     except Exception as e:
         print(f"❌ Erreur lors du déplacement du fichier : {e}")
 
 
-# Fonction pour vérifier et extraire les données du fichier Excel
-def extraire_donnees(fichier_excel, champs_attendus):
+# Fonction pour vérifier l'en-tête du fichier Excel et préparer la lecture en flux de ses lignes
+def extraire_donnees(fichier_excel, champs_attendus=CHAMPS_ACCUSE):
     try:
-        df = pd.read_excel(fichier_excel)
-        df.columns = [col.strip() for col in df.columns]
-
-        champs_manquants = [champ for champ in champs_attendus if champ not in df.columns]
-        if champs_manquants:
-            print(f"⚠️ Champs manquants : {', '.join(champs_manquants)}")
-            return None
-
-        return df[champs_attendus].to_dict(orient="records")
+        return generateur.extraire_donnees(fichier_excel, champs_attendus, champs_facultatifs=[CHAMP_TYPE_COURRIER])
     except FileNotFoundError:
         print("❌ Fichier non trouvé.")
+    except ValueError as e:
+        print(f"⚠️ {e}")
     except Exception as e:
         print(f"❌ Erreur : {e}")
     return None
 
-# Fonction pour remplir un template Word
-def remplir_template(fichier_template, dossier_sortie, donnees_liste, dateDuJour):
+# Fonction pour remplir un template Word pour chaque ligne, en parallèle sur plusieurs processus
+# (template à balises {{ champ }} simples, mise en forme des runs conservée)
+def remplir_template(fichier_template, dossier_sortie, donnees_liste, dateDuJour, nb_workers=None):
     try:
-        os.makedirs(dossier_sortie, exist_ok=True)
-        for donnees in donnees_liste:
-            doc = Document(fichier_template)
-            
-            def traiter_paragraphe(paragraphe):
-                for cle, valeur in donnees.items():
-                    placeholder = f"{{{{ {cle} }}}}"
-                    if pd.isna(valeur):
-                        valeur = ""
-                    if isinstance(valeur, (datetime, pd.Timestamp)):
-                        valeur = valeur.strftime("%d/%m/%Y")
-                    paragraphe.text = paragraphe.text.replace(placeholder, str(valeur))
-
-            for paragraphe in doc.paragraphs:
-                traiter_paragraphe(paragraphe)
-
-            matricule = str(donnees.get("Matricule", "inconnu")).strip()
-            fichier_sortie = os.path.join(dossier_sortie, f"accuseReception_{matricule}_{dateDuJour.replace('/', '-')}.docx")
-            doc.save(fichier_sortie)
+        # Documents produits sur le disque local puis publiés en bloc dans le dossier OneDrive (voir publication.py)
+        resultat = GenerateurLot(fichier_template, fonction_rendu=rendre_texte, nb_workers=nb_workers,
+                                 dossier_templates=os.path.dirname(fichier_template),
+                                 depot=depot_local("tkinter", defaut="dossier")).generer(
+            donnees_liste, dossier_sortie, dateDuJour.replace('/', '-'))
+        for fichier_sortie in resultat.fichiers:
             print(f"✅ Document généré : {fichier_sortie}")
+        for message in resultat.messages_erreurs():
+            print(f"❌ {message}")
+        if resultat.ignores:
+            print(f"⏭️ {resultat.ignores} document(s) déjà à jour, non régénéré(s)")
+        return resultat
     except Exception as e:
         print(f"❌ Erreur : {e}")
 
 # --- Exécution du programme ---
-verifier_et_creer_repertoires() # Vérifie et crée les répertoires nécessaires
-fichier_excel = choisir_fichier() # Sélectionner un fichier Excel
-
-if fichier_excel:
-    dateDuJour = date.today().strftime("%d/%m/%Y") # Date du jour au format JJ/MM/AAAA
+if __name__ == "__main__":
+    verifier_et_creer_repertoires() # Vérifie et crée les répertoires nécessaires
     template_word = definir_chemin("template", "13. Accusé de réception déclaration d'impayés.docx") # Chemin du template Word
-    dossier_sortie = definir_chemin("accuse_recep", f"accuses_reception_{dateDuJour.replace('/', '-')}") # Dossier de sortie
-
-    champs_attendus = ["Date Liq", "Matricule", "Identité Allocataire", "Identité Destinataire bailleur",
-                       "Adresse Ligne 2", "Adresse Ligne 3", "Adresse Ligne 4",
-                       "Adresse Ligne 5", "Adresse Ligne 6", "Adresse Ligne 7"]
-
-    donnees_liste = extraire_donnees(fichier_excel, champs_attendus) # Extraire les données du fichier Excel
-    if not os.path.exists(fichier_excel):  # 🔍 Vérification après extraction
-        print(f"❌ Problème : le fichier {fichier_excel} a été supprimé après l'extraction !")
+    GenerateurLot(template_word, fonction_rendu=rendre_texte, dossier_templates=os.path.dirname(template_word)).prechauffer() # Template et lecture Excel préparés pendant le choix du fichier
+    fichier_excel = choisir_fichier() # Sélectionner un fichier Excel
+
+    if fichier_excel:
+        dateDuJour = date.today().strftime("%d/%m/%Y") # Date du jour au format JJ/MM/AAAA
+        dossier_sortie = definir_chemin("accuse_recep", f"accuses_reception_{dateDuJour.replace('/', '-')}") # Dossier de sortie
+
+        donnees_liste = extraire_donnees(fichier_excel) # Extraire les données du fichier Excel
+        if not os.path.exists(fichier_excel):  # 🔍 Vérification après extraction
+            print(f"❌ Problème : le fichier {fichier_excel} a été supprimé après l'extraction !")
+        else:
+            if donnees_liste:
+                # Fichier refusé par la vérification préalable (ou génération impossible) : il reste en place
+                if remplir_template(template_word, dossier_sortie, donnees_liste, dateDuJour) is not None:
+                    deplacer_fichier(fichier_excel)
     else:
-        if donnees_liste:
-            remplir_template(template_word, dossier_sortie, donnees_liste, dateDuJour)
-            deplacer_fichier(fichier_excel)
-else:
-    print("❌ Aucun fichier sélectionné. Opération annulée.")
+        print("❌ Aucun fichier sélectionné. Opération annulée.")
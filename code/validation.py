@@ -0,0 +1,141 @@
+import os
+
+from conversion import verifier_convertisseur
+from lecture import FORMAT_DATE
+from modeles import ModeleJinja, charger_modele
+
+# Vérification d'un fichier Excel avant la génération : tout le fichier est contrôlé d'un coup, colonne par colonne
+# (pandas), et tous les problèmes sont rapportés ensemble avant qu'un seul document soit écrit.
+# Sert aussi d'essai à blanc (cli.py --verifier) : rien n'est généré, seul le rapport est produit.
+# Avant une génération, seules les colonnes contrôlées sont gardées en mémoire ; le fichier est ensuite relu en flux.
+
+# Nombre de numéros de ligne cités par problème (le reste est compté)
+NB_LIGNES_CITEES = 10
+
+# Types de champs contrôlés (voir generateur.TYPES_CHAMPS) et libellé du problème
+LIBELLES_TYPES = {"date": "Date illisible", "entier": "Nombre illisible"}
+# Types dont une valeur illisible bloque la génération ; un nombre illisible (matricule "X1") est seulement signalé
+TYPES_BLOQUANTS = {"date"}
+
+class RapportValidation:
+    def __init__(self, fichier):
+        self.fichier = fichier
+        self.nb_lignes = 0
+        self.erreurs = []  # Problèmes bloquants : la génération n'est pas lancée
+        self.avertissements = []  # Signalés sans bloquer
+
+    @property
+    def valide(self):
+        return not self.erreurs
+
+    # Ajouter un problème, avec les lignes concernées (numéros comme dans les erreurs de génération)
+    def ajouter(self, message, lignes=(), bloquant=True):
+        lignes = list(lignes)
+        if lignes:
+            cites = ", ".join(str(ligne) for ligne in lignes[:NB_LIGNES_CITEES])
+            reste = f" (+{len(lignes) - NB_LIGNES_CITEES})" if len(lignes) > NB_LIGNES_CITEES else ""
+            message = f"{message} : ligne{'s' if len(lignes) > 1 else ''} {cites}{reste}"
+        (self.erreurs if bloquant else self.avertissements).append(message)
+
+    def messages(self):
+        return [f"❌ {message}" for message in self.erreurs] + [f"⚠️ {message}" for message in self.avertissements]
+
+    def __str__(self):
+        nom = os.path.basename(self.fichier)
+        if self.valide:
+            entete = f"{nom} : {self.nb_lignes} ligne(s) vérifiée(s), aucun problème bloquant"
+        else:
+            entete = f"{nom} : {len(self.erreurs)} problème(s) bloquant(s) sur {self.nb_lignes} ligne(s)"
+        return "\n".join([entete, *(f"  {message}" for message in self.messages())])
+
+# Levée par la génération quand la vérification préalable échoue ; le rapport complet reste disponible
+class ErreurValidation(ValueError):
+    def __init__(self, rapport):
+        super().__init__(str(rapport))
+        self.rapport = rapport
+
+# Valeurs renseignées mais illisibles d'une colonne normalisée (voir lecture.normaliser_bloc :
+# une date ou un nombre qui n'a pas pu être converti reste tel quel)
+def _illisibles(serie, type_champ):
+    import pandas as pd
+    if type_champ == "date":
+        lisibles = pd.to_datetime(serie, format=FORMAT_DATE, errors="coerce").notna()
+    else:
+        lisibles = serie.str.fullmatch(r"-?\d+")
+    return (serie != "") & ~lisibles
+
+# Templates présents, lisibles, et dont toutes les balises correspondent à une colonne du fichier
+def _verifier_templates(rapport, chemins, classe, colonnes):
+    for chemin in sorted(chemins):
+        nom = os.path.basename(chemin)
+        if not os.path.isfile(chemin):
+            rapport.ajouter(f"Template introuvable : {chemin}")
+            continue
+        try:
+            champs = charger_modele(chemin, classe).champs
+        except Exception as e:
+            rapport.ajouter(f"Template illisible ({nom}) : {e}")
+            continue
+        manquants = sorted(set(champs) - set(colonnes))
+        if manquants:
+            rapport.ajouter(f"Balises du template {nom} sans colonne dans le fichier : {', '.join(manquants)}")
+
+# Vérifier les lignes d'un fichier (TableLignes, lues en entier ou sur les seules colonnes contrôlées) avant leur génération.
+# colonnes : colonnes lues dans le fichier (balises des templates) ; la table peut n'en contenir qu'une partie.
+# choisir_template : choix du template par ligne (registre.selecteur), sinon fichier_template pour toutes les lignes
+def valider_lignes(table, colonnes, fichier_template=None, classe=ModeleJinja, types_champs=None, choisir_template=None,
+                   champ_type=None, convertisseur=None, pdf_direct=False):
+    import pandas as pd
+    rapport = RapportValidation(table.fichier_excel or "")
+    types_champs = {champ: type_champ for champ, type_champ in (types_champs or {}).items()
+                    if champ in table.positions and type_champ in LIBELLES_TYPES}
+
+    if convertisseur is not None:
+        try:
+            verifier_convertisseur(convertisseur)
+        except FileNotFoundError as e:
+            # Avec le moteur PDF direct, le convertisseur ne sert qu'aux templates hors gabarit
+            rapport.ajouter(str(e), bloquant=not pdf_direct)
+
+    a_verifier = [champ for champ in table.positions if champ == "Matricule" or champ == champ_type or champ in types_champs]
+    df = pd.DataFrame({champ: table.colonne(champ) for champ in a_verifier}, index=pd.RangeIndex(len(table)), dtype=str)
+    rapport.nb_lignes = len(df)
+    if not len(df):
+        rapport.ajouter("Aucune ligne à traiter", bloquant=False)
+    numeros = pd.Series(range(1, len(df) + 1), index=df.index)
+
+    # Template de chaque ligne, décidé une fois par valeur distincte de la colonne de type de courrier
+    if choisir_template is not None:
+        types = df[champ_type] if champ_type in df else pd.Series("", index=df.index)
+        choix = {}
+        for valeur in types.unique():
+            try:
+                choix[valeur] = choisir_template({champ_type: valeur})
+            except ValueError as e:
+                choix[valeur] = None
+                rapport.ajouter(str(e), numeros[types == valeur])
+        templates = types.map(choix)
+    else:
+        templates = pd.Series(fichier_template, index=df.index)
+    _verifier_templates(rapport, set(templates.dropna()) or {fichier_template} - {None}, classe, colonnes)
+
+    for champ, type_champ in types_champs.items():
+        illisibles = _illisibles(df[champ], type_champ)
+        if illisibles.any():
+            rapport.ajouter(f"{LIBELLES_TYPES[type_champ]} dans {champ}", numeros[illisibles],
+                            bloquant=type_champ in TYPES_BLOQUANTS)
+
+    if "Matricule" in df:
+        matricules = df["Matricule"].str.strip()
+        vides = matricules == ""
+        if vides.any():
+            rapport.ajouter("Matricule non renseigné", numeros[vides])
+        # Deux lignes de même matricule et même template donneraient le même document (le second écrase le premier)
+        cles = matricules + "\x00" + templates.fillna("")
+        doublons = ~vides & cles.duplicated(keep=False)
+        groupes = list(numeros[doublons].groupby(matricules[doublons], sort=False))
+        for matricule, lignes in groupes[:NB_LIGNES_CITEES]:
+            rapport.ajouter(f"Matricule {matricule} en double", lignes)
+        if len(groupes) > NB_LIGNES_CITEES:
+            rapport.ajouter(f"{len(groupes) - NB_LIGNES_CITEES} autre(s) matricule(s) en double")
+    return rapport
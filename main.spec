@@ -1,16 +1,27 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+# Exécutable de l'interface NiceGUI (code/main.py), construit en mode dossier :
+# un exécutable "onefile" décompresse toutes ses bibliothèques dans un dossier temporaire à chaque lancement,
+# ce qui représentait l'essentiel du délai avant l'affichage de la fenêtre.
+
+# Modules jamais utilisés par l'interface NiceGUI (interfaces Streamlit et tkinter, outils de développement,
+# dépendances facultatives que pandas ou PyPDF2 chargeraient s'ils étaient présents sur le poste de build)
+EXCLUS = [
+    'tkinter', 'streamlit', 'watchdog',
+    'matplotlib', 'scipy', 'IPython', 'jupyter_client', 'notebook', 'pytest',
+    'PyQt5', 'PyQt6', 'PySide2', 'PySide6',
+]
 
 a = Analysis(
     ['code\\main.py'],
-    pathex=[],
+    pathex=['code'],
     binaries=[],
     datas=[],
     hiddenimports=[],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=EXCLUS,
     noarchive=False,
     optimize=0,
 )
@@ -19,16 +30,13 @@ pyz = PYZ(a.pure)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='main',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,  # Les bibliothèques compressées par UPX sont décompressées (et réanalysées par l'antivirus) à chaque lancement
     console=True,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -36,3 +44,13 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name='main',
+)